@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asyncio event loop of the c2w front-ends running without twisted.
+
+The engines (see ServerEngine and ClientEngine) only ask their clock for
+the two methods of twisted's IReactorTime they use: callLater and
+seconds.  LoopClock provides them on top of an asyncio event loop, so the
+same engines run under the twisted reactor (udp_chat_server,
+tcp_chat_server...) or under asyncio (AioServer, AioClient).
+
+This code base runs on python 2 only, where asyncio is trollius, its
+deprecated backport: the loops of trollius are the only ones used.
+uvloop, which needs python 3, cannot run here.
+"""
+import logging
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+moduleLogger = logging.getLogger('c2w.protocol.aio')
+
+
+def newEventLoop():
+    """
+    Creates an event loop, sets it as the current one and returns it.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    moduleLogger.info('event loop: %s', loopName(loop))
+    return loop
+
+
+def loopName(loop):
+    """
+    :param loop: an event loop.
+
+    Returns the name of the implementation of loop, to tell the runs
+    apart when comparing them.
+    """
+    return '%s.%s' % (type(loop).__module__, type(loop).__name__)
+
+
+def runForever(loop):
+    """
+    :param loop: an event loop.
+
+    Runs loop until it is stopped or the process is interrupted (Ctrl-C),
+    then closes it.
+    """
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
+
+
+class LoopClock(object):
+
+    def __init__(self, loop):
+        """
+        :param loop: the asyncio event loop running the timers.
+
+        The IReactorTime of an asyncio event loop, given to the engines
+        and to TimingWheel.getWheel.  The time is the one of the loop (a
+        monotonic clock): the engines only use it to measure delays.
+
+        .. attribute:: loop
+
+            The event loop.
+        """
+        self.loop = loop
+
+    def seconds(self):
+        """
+        Returns the current time of the loop, in seconds.
+        """
+        return self.loop.time()
+
+    def callLater(self, delay, function, *args):
+        """
+        :param float delay: the delay before the call, in seconds.
+        :param function: the function to call.
+        :param args: its arguments.
+
+        Schedules function(*args) and returns its DelayedCall.
+        """
+        return DelayedCall(self.loop, delay, function, args)
+
+
+class DelayedCall(object):
+    """
+    A call scheduled by LoopClock.callLater, with the cancel and active
+    methods of twisted's IDelayedCall.
+    """
+    __slots__ = ('handle', 'function', 'args', 'time', 'called', 'cancelled')
+
+    def __init__(self, loop, delay, function, args):
+        self.function  = function
+        self.args      = args
+        self.time      = loop.time() + delay
+        self.called    = False
+        self.cancelled = False
+        self.handle    = loop.call_later(delay, self.fire)
+
+    def fire(self):
+        self.called = True
+        self.function(*self.args)
+
+    def getTime(self):
+        """
+        Returns the time of the loop at which the call is scheduled.
+        """
+        return self.time
+
+    def active(self):
+        """
+        Returns True until the call is made or cancelled.
+        """
+        return not (self.called or self.cancelled)
+
+    def cancel(self):
+        """
+        Cancels the call.  Cancelling a call that was already made or
+        cancelled does nothing.
+        """
+        if self.active():
+            self.cancelled = True
+            self.handle.cancel()
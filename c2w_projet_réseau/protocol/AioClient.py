@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asyncio front-end of the c2w client, without user interface.
+
+UdpClientProtocol and TcpClientProtocol are the asyncio counterparts of
+udp_chat_client and tcp_chat_client, driving a DatagramClientEngine or a
+StreamClientEngine with the timers running on the event loop (see
+Aio.LoopClock).  They have the same methods for the clientProxy.
+
+HeadlessClientProxy stands for the graphical user interface of c2w.main:
+it prints what the interface would show and reads the commands of the
+user on the standard input, one per line:
+
+- /join <movie title>: go to the room of a movie;
+- /main: go back to the main room;
+- /quit: leave the system (as the end of the input does);
+- anything else is sent as a chat message.
+"""
+import logging
+import random
+import sys
+from Aio import asyncio
+import Aio
+import ClientEngine
+from Tools import USER_STATES
+from c2w.main.constants import ROOM_IDS
+
+moduleLogger = logging.getLogger('c2w.protocol.aio_client')
+
+
+class HeadlessClientProxy(object):
+
+    def __init__(self, loop, roomName=None, interactive=True):
+        """
+        :param loop: the event loop of the client, stopped when the user
+            leaves the system.
+        :param string roomName: the movie room to join once logged in, or
+            None to stay in the main room.
+        :param bool interactive: read the commands of the user on the
+            standard input.
+
+        .. attribute:: protocol
+
+            The UdpClientProtocol or TcpClientProtocol the commands are
+            given to (set by run).
+        """
+        self.loop        = loop
+        self.roomName    = roomName
+        self.interactive = interactive
+        self.protocol    = None
+
+    def connectionRejectedONE(self, message):
+        print "login rejected: %s" % message
+        self.loop.stop()
+
+    def initCompleteONE(self, userList, movieList):
+        print "users: %s" % ', '.join('%s (%s)' % user for user in userList)
+        print "movies: %s" % ', '.join(movie[0] for movie in movieList)
+        if self.roomName is not None:
+            # once the movie list is acknowledged: the server would
+            # otherwise see the join before the end of the login
+            self.loop.call_soon(self.protocol.sendJoinRoomRequestOIE, self.roomName)
+        if self.interactive:
+            self.loop.add_reader(sys.stdin.fileno(), self.commandReceived)
+
+    def joinRoomOKONE(self):
+        print "joined the room"
+
+    def userUpdateReceivedONE(self, userName, roomName):
+        print "%s is now in %s" % (userName, roomName)
+
+    def chatMessageReceivedONE(self, userName, message):
+        print "%s: %s" % (userName, message)
+
+    def leaveSystemOKONE(self):
+        print "left the system"
+        if self.interactive:
+            self.loop.remove_reader(sys.stdin.fileno())
+        self.loop.stop()
+
+    def commandReceived(self):
+        """
+        Called by the event loop when a line of the user can be read.
+        """
+        line = sys.stdin.readline()
+        if not line:
+            self.loop.remove_reader(sys.stdin.fileno())
+            self.protocol.sendLeaveSystemRequestOIE()
+            return
+        line = line.rstrip('\n')
+        if line.startswith('/join '):
+            self.protocol.sendJoinRoomRequestOIE(line[len('/join '):])
+        elif line == '/main':
+            self.protocol.sendJoinRoomRequestOIE(ROOM_IDS.MAIN_ROOM)
+        elif line == '/quit':
+            self.protocol.sendLeaveSystemRequestOIE()
+        elif line:
+            self.protocol.sendChatMessageOIE(line)
+
+
+class ClientProtocol(object):
+    """
+    The methods called by the clientProxy, common to the UDP and TCP
+    clients: they are handed to the engine.
+    """
+
+    def sendLoginRequestOIE(self, userName):
+        self.engine.login(userName)
+
+    def sendChatMessageOIE(self, message):
+        self.engine.chat(message)
+
+    def sendJoinRoomRequestOIE(self, roomName):
+        self.engine.joinRoom(roomName)
+
+    def sendLeaveSystemRequestOIE(self):
+        self.engine.leaveSystem()
+
+
+class UdpClientProtocol(ClientProtocol, asyncio.DatagramProtocol):
+
+    def __init__(self, serverAddress, serverPort, clientProxy, lossPr, clock):
+        """
+        :param serverAddress: the IP address of the c2w server.
+        :param serverPort: the port number used by the c2w server.
+        :param clientProxy: the clientProxy (a HeadlessClientProxy).
+        :param lossPr: the packet loss probability for outgoing packets.
+        :param clock: the Aio.LoopClock of the event loop.
+
+        The asyncio version of udp_chat_client.c2wUdpChatClientProtocol.
+
+        .. attribute:: engine
+
+            The ClientEngine.DatagramClientEngine handling the messages.
+        """
+        self.serverAddress = serverAddress
+        self.serverPort    = serverPort
+        self.clientProxy   = clientProxy
+        self.lossPr        = lossPr
+        self.transport     = None
+        self.engine        = ClientEngine.DatagramClientEngine(clientProxy, self.writeDatagram,
+                                                               clock=clock)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, datagram, address):
+        self.engine.datagramReceived(datagram)
+
+    def error_received(self, exc):
+        moduleLogger.warning('socket error: %s', exc)
+
+    def writeDatagram(self, datagram):
+        """
+        :param string datagram: a datagram built by the engine.
+
+        Sends datagram to the server (the transport is connected to it),
+        or drops it with the probability lossPr.
+        """
+        if(self.lossPr and random.random() < self.lossPr):
+            return
+        self.transport.sendto(datagram)
+
+
+class TcpClientProtocol(ClientProtocol, asyncio.Protocol):
+
+    def __init__(self, clientProxy, clock):
+        """
+        :param clientProxy: the clientProxy (a HeadlessClientProxy).
+        :param clock: the Aio.LoopClock of the event loop.
+
+        The asyncio version of tcp_chat_client.c2wTcpChatClientProtocol.
+
+        .. attribute:: engine
+
+            The ClientEngine.StreamClientEngine handling the messages.
+        """
+        self.clientProxy = clientProxy
+        self.transport   = None
+        self.engine      = ClientEngine.StreamClientEngine(clientProxy, self.writeData,
+                                                           self.loseConnection, clock=clock)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.engine.dataReceived(data)
+
+    def connection_lost(self, exc):
+        if self.engine.state != USER_STATES.DISCONNECTED:
+            print "connection lost"
+            self.clientProxy.loop.stop()
+
+    def writeData(self, data):
+        self.transport.write(data)
+
+    def loseConnection(self):
+        self.transport.close()
+
+
+def run(protocol, serverAddress, serverPort, userName, roomName=None, lossPr=0,
+        interactive=True):
+    """
+    :param string protocol: 'UDP' or 'TCP'.
+    :param serverAddress: the IP address (or the name) of the server.
+    :param int serverPort: the port number of the server.
+    :param string userName: the name to log in with.
+    :param string roomName: the movie room to join once logged in.
+    :param float lossPr: the packet loss probability for the outgoing
+        datagrams (UDP only).
+    :param bool interactive: read the commands on the standard input.
+
+    Runs a c2w client on an asyncio event loop until the user leaves the
+    system.
+    """
+    loop = Aio.newEventLoop()
+    clock = Aio.LoopClock(loop)
+    clientProxy = HeadlessClientProxy(loop, roomName, interactive)
+    if protocol == 'UDP':
+        endpoint = loop.create_datagram_endpoint(
+            lambda: UdpClientProtocol(serverAddress, serverPort, clientProxy, lossPr, clock),
+            remote_addr=(serverAddress, serverPort))
+    else:
+        endpoint = loop.create_connection(
+            lambda: TcpClientProtocol(clientProxy, clock), serverAddress, serverPort)
+    transport, clientProxy.protocol = loop.run_until_complete(endpoint)
+    clientProxy.protocol.sendLoginRequestOIE(userName)
+    Aio.runForever(loop)
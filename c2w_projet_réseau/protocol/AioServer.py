@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asyncio front-end of the c2w server.
+
+UdpServerProtocol and TcpServerProtocol are the asyncio counterparts of
+udp_chat_server and tcp_chat_server: thin adapters handing the bytes
+received to a DatagramServerEngine or a StreamServerEngine and writing the
+bytes they send, with the timers of the engines running on the event loop
+(see Aio.LoopClock).
+
+The serverProxy of c2w.main lives with the twisted reactor, which also
+streams the videos.  The asyncio server uses a Store.ServerStore instead:
+the same user and movie store, in memory, without the video part (as with
+the -n option of the twisted server): the movies are given to serve, and
+a join streams nothing.
+"""
+import logging
+import random
+from Aio import asyncio
+import Aio
+import ServerEngine
+import Outbox
+import Metrics
+from Store import User, Movie, ServerStore
+
+moduleLogger = logging.getLogger('c2w.protocol.aio_server')
+
+
+class UdpServerProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, serverProxy, lossPr, clock):
+        """
+        :param serverProxy: the user and movie store (a ServerStore).
+        :param lossPr: the packet loss probability for outgoing packets.
+        :param clock: the Aio.LoopClock of the event loop.
+
+        The asyncio version of udp_chat_server.c2wUdpChatServerProtocol.
+
+        .. attribute:: engine
+
+            The ServerEngine.DatagramServerEngine handling the datagrams.
+        """
+        self.lossPr      = lossPr
+        self.transport   = None
+        self.engine      = ServerEngine.DatagramServerEngine(serverProxy, self.writeDatagram,
+                                                             clock=clock)
+        self.serverProxy = self.engine.serverProxy
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, datagram, address):
+        self.engine.datagramReceived(datagram, address[:2])
+
+    def error_received(self, exc):
+        moduleLogger.warning('socket error: %s', exc)
+
+    def writeDatagram(self, datagram, userAdrs):
+        """
+        :param string datagram: a datagram built by the engine.
+        :param tuple userAdrs: the user address (host, port).
+
+        Sends datagram, or drops it with the probability lossPr (the -l
+        option of the launchers).
+        """
+        if(self.lossPr and random.random() < self.lossPr):
+            return
+        self.transport.sendto(datagram, userAdrs)
+
+    def queueStats(self):
+        return self.engine.queueStats()
+
+
+class TcpServerProtocol(asyncio.Protocol):
+
+    # Bytes queued for a client that does not read before it is dropped.
+    sendBudget = 64 * 1024
+
+    def __init__(self, serverProxy, clock):
+        """
+        :param serverProxy: the user and movie store (a ServerStore).
+        :param clock: the Aio.LoopClock of the event loop.
+
+        The asyncio version of tcp_chat_server.c2wTcpChatServerProtocol,
+        one instance per connection.  The flow control is the same: while
+        the transport asks us to pause writing, the messages wait in an
+        Outbox.
+
+        .. attribute:: engine
+
+            The ServerEngine.StreamServerEngine handling the messages of
+            the connection, created once it is made.
+        """
+        self.serverProxy = serverProxy
+        self.clock       = clock
+        self.transport   = None
+        self.engine      = None
+        self.paused      = False
+        self.stopped     = False
+        self.outbox      = Outbox.Outbox(self.sendBudget,
+                                         ServerEngine.StreamServerEngine.metrics.dropped)
+
+    def connection_made(self, transport):
+        self.transport = transport
+        address = transport.get_extra_info('peername')[:2]
+        self.engine = ServerEngine.StreamServerEngine(self.serverProxy, address,
+                                                      self.writeMessage, self.loseConnection,
+                                                      clock=self.clock)
+        self.engine.metrics.track(self)
+
+    def data_received(self, data):
+        self.engine.dataReceived(data)
+
+    def connection_lost(self, exc):
+        self.stopped = True
+        self.outbox.clear()
+        self.engine.metrics.untrack(self)
+        self.engine.connectionLost()
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        data = self.outbox.drain()
+        if(data):
+            self.transport.writelines(data)
+
+    def writeMessage(self, msgBuf, key=None):
+        """
+        :param msgBuf: the message, as a string or as a tuple of strings
+            written one after the other.
+        :param string key: for a notification, the name of the user it is
+            about.
+
+        Same as c2wTcpChatServerProtocol.writeMessage.
+        """
+        if(self.stopped):
+            return
+        if(not self.paused and not self.outbox):
+            if(isinstance(msgBuf, tuple)):
+                self.transport.writelines(msgBuf)
+            else:
+                self.transport.write(msgBuf)
+            return
+        if(isinstance(msgBuf, tuple)):
+            msgBuf = ''.join(msgBuf)
+        if(not self.outbox.push(msgBuf, key, lossy=self.engine.reliable)):
+        #slow consumer: drop it before it eats the memory of the server
+            moduleLogger.warning('%s:%s does not read, closing the connection: %s',
+                                 self.engine.address[0], self.engine.address[1],
+                                 self.bufferStats())
+            self.stopped = True
+            self.outbox.clear()
+            self.transport.abort()
+
+    def bufferStats(self):
+        stats = self.outbox.stats()
+        stats['paused'] = self.paused
+        return stats
+
+    def metricGauges(self):
+        return (('c2w_outbox_messages', None, len(self.outbox)),
+                ('c2w_outbox_bytes', None, self.outbox.bufferedBytes),
+                ('c2w_paused_connections', None, 1 if self.paused else 0))
+
+    def loseConnection(self):
+        """
+        Closes the connection, when the engine gives up on the client.
+        """
+        self.transport.close()
+
+
+class MetricsProtocol(asyncio.Protocol):
+    """
+    Answers any HTTP request with the metrics of the server (see
+    Metrics.httpResponse).
+    """
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.request   = ''
+
+    def data_received(self, data):
+        self.request += data
+        if '\r\n\r\n' in self.request or '\n\n' in self.request:
+            self.transport.write(Metrics.httpResponse())
+            self.transport.close()
+
+
+def parseMovie(spec):
+    """
+    :param string spec: a movie given as TITLE:IP:PORT (the --movie
+        option of the launchers).
+
+    Returns (movieTitle, movieIpAddress, moviePort).  Raises ValueError
+    when spec is not of this form.
+    """
+    movieTitle, movieIpAddress, moviePort = spec.rsplit(':', 2)
+    return (movieTitle, movieIpAddress, int(moviePort))
+
+
+def serve(protocol, port, movies=(), lossPr=0, interface='', metricsAddress=None):
+    """
+    :param string protocol: 'UDP' or 'TCP'.
+    :param int port: the port to listen on.
+    :param movies: the (movieTitle, movieIpAddress, moviePort) of the
+        movies of the server.
+    :param float lossPr: the packet loss probability for the outgoing
+        datagrams (UDP only).
+    :param string interface: the address to listen on (all by default).
+    :param string metricsAddress: where to serve the metrics (see
+        Metrics.listen), or None.
+
+    Runs the c2w server on an asyncio event loop until it is interrupted.
+    """
+    loop = Aio.newEventLoop()
+    clock = Aio.LoopClock(loop)
+    store = ServerStore(movies)
+    host = interface or '0.0.0.0'
+    if protocol == 'UDP':
+        endpoint = loop.create_datagram_endpoint(
+            lambda: UdpServerProtocol(store, lossPr, clock), local_addr=(host, port))
+    else:
+        endpoint = loop.create_server(
+            lambda: TcpServerProtocol(store, clock), host, port)
+    loop.run_until_complete(endpoint)
+    if metricsAddress is not None:
+        if metricsAddress.isdigit():
+            endpoint = loop.create_server(MetricsProtocol, '127.0.0.1', int(metricsAddress))
+        else:
+            Metrics.unlinkStaleSocket(metricsAddress)
+            endpoint = loop.create_unix_server(MetricsProtocol, metricsAddress)
+        loop.run_until_complete(endpoint)
+    print "c2w %s server listening on port %d (%s)" % (protocol, port, Aio.loopName(loop))
+    Aio.runForever(loop)
@@ -0,0 +1,571 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Selective repeat ARQ of the c2w protocol.
+
+Sequence numbers are 11 bits wide (see Codec), so every comparison is done
+modulo SEQ_MODULO.  A window never spans more than half of the sequence
+space, which keeps "ahead of" and "behind" unambiguous across the wrap.
+
+SendWindow is used by the sender: it numbers the messages, lets at most
+windowSize of them wait for an acknowledgement at the same time and
+queues the others.  Each message in flight is acknowledged (and
+retransmitted) on its own.  The queue can be bounded: when it is full the
+oldest message of a droppable type (a chat message, say) makes room for
+the new one, and QueueOverflow is raised when none can be dropped.
+
+ReceiveWindow is used by the receiver: it hands the messages over in
+sequence order, holds the ones received ahead of a gap and recognizes the
+ones already handed over.
+
+DuplicateFilter is used by the receiver of a stop-and-wait peer (the
+clients, and the servers in the legacy mode): messages come in order but
+sequence numbers may be skipped, so it only recognizes the messages
+already handled.
+
+AckCoalescer is used by a receiver that negotiated cumulative
+acknowledgements: instead of answering each message with its own type 0
+acknowledgement, it waits a little and acknowledges everything received
+with one type 4 message, or with a trailer on a message it sends anyway.
+
+RttEstimator gives the retransmission timeout of a peer from the round
+trip times measured on its acknowledgements (RFC 6298).
+"""
+from collections import deque
+import Codec
+
+SEQ_MODULO  = 1 << Codec.SEQ_BITS
+MAX_WINDOW  = SEQ_MODULO // 2
+
+
+class QueueOverflow(Exception):
+    """
+    Raised by SendWindow.push when the queue is full of messages that
+    cannot be dropped: the peer does not keep up with the messages sent to
+    it.
+    """
+
+
+def seqAdd(seqNbr, n):
+    """
+    Returns the sequence number n steps after seqNbr.
+    """
+    return (seqNbr + n) % SEQ_MODULO
+
+
+def seqDiff(seqNbr, base):
+    """
+    Returns the number of steps from base to seqNbr, going forward.
+    """
+    return (seqNbr - base) % SEQ_MODULO
+
+
+class Outstanding(object):
+    """
+    A message sent through a SendWindow and not acknowledged yet.
+
+    .. attribute:: seqNbr
+
+        The sequence number of the message.
+
+    .. attribute:: msgType
+
+        The type of the message.
+
+    .. attribute:: msgBuf
+
+        The complete message, as written on the wire.
+
+    .. attribute:: timer
+
+        The retransmission timer of the message (None when not armed).
+
+    .. attribute:: tries
+
+        The number of times the message has been written.
+
+    .. attribute:: sentAt
+
+        When the message was first written.
+    """
+    __slots__ = ('seqNbr', 'msgType', 'msgBuf', 'timer', 'tries', 'sentAt')
+
+    def __init__(self, seqNbr, msgType, msgBuf):
+        self.seqNbr  = seqNbr
+        self.msgType = msgType
+        self.msgBuf  = msgBuf
+        self.timer   = None
+        self.tries   = 0
+        self.sentAt  = None
+
+    def cancelTimer(self):
+        """
+        Cancels the retransmission timer if it is armed.
+        """
+        if self.timer is not None:
+            if self.timer.active():
+                self.timer.cancel()
+            self.timer = None
+
+
+class SendWindow(object):
+
+    def __init__(self, windowSize=1, firstSeqNbr=0, rtt=None,
+                 maxPending=None, droppableTypes=()):
+        """
+        :param int windowSize: the maximum number of messages waiting for
+            an acknowledgement at the same time.
+        :param int firstSeqNbr: the sequence number of the first message.
+        :param RttEstimator rtt: the estimator giving the retransmission
+            timeout of the peer (a new one by default).
+        :param int maxPending: the maximum number of messages waiting for
+            room in the window (no limit if None).
+        :param droppableTypes: the message types that may be dropped to
+            make room in a full queue.
+
+        .. attribute:: base
+
+            The oldest sequence number not acknowledged yet (equal to
+            nextSeqNbr when nothing is in flight).
+
+        .. attribute:: nextSeqNbr
+
+            The sequence number given to the next message admitted.
+
+        .. attribute:: inFlight
+
+            A dictionary seqNbr -> Outstanding of the messages sent and
+            not acknowledged.
+
+        .. attribute:: pending
+
+            The messages waiting for room in the window, as
+            (msgType, msgBody) tuples, oldest first.
+
+        .. attribute:: rtt
+
+            The RttEstimator of the peer.
+
+        .. attribute:: peakPending
+
+            The largest number of messages that waited in pending at the
+            same time.
+
+        .. attribute:: dropped
+
+            The number of messages dropped because the queue was full.
+        """
+        if not 1 <= windowSize <= MAX_WINDOW:
+            raise ValueError('window size must be between 1 and %d' % MAX_WINDOW)
+        if maxPending is not None and maxPending < 1:
+            raise ValueError('queue length must be at least 1')
+        self.windowSize     = windowSize
+        self.base           = firstSeqNbr
+        self.nextSeqNbr     = firstSeqNbr
+        self.inFlight       = {}
+        self.pending        = deque()
+        self.rtt            = rtt if rtt is not None else RttEstimator()
+        self.maxPending     = maxPending
+        self.droppableTypes = frozenset(droppableTypes)
+        self.peakPending    = 0
+        self.dropped        = 0
+
+    def push(self, msgType, msgBody=''):
+        """
+        :param int msgType   : the type of the message.
+        :param string msgBody: the body of the message (everything after
+            msgLen, empty for the types made of msgHead only).
+
+        Queues a message.  It gets its sequence number when admit lets it
+        into the window.
+
+        If the queue is full, the oldest queued message of a droppable
+        type is dropped to make room, or the new message itself when it is
+        droppable and no queued one is.  The dropped (msgType, msgBody) is
+        returned, None if nothing was dropped.  QueueOverflow is raised
+        (and the message is not queued) when nothing can be dropped.
+        """
+        pending = self.pending
+        dropped = None
+        if self.maxPending is not None and len(pending) >= self.maxPending:
+            for i, message in enumerate(pending):
+                if message[0] in self.droppableTypes:
+                    del pending[i]
+                    dropped = message
+                    break
+            else:
+                if msgType not in self.droppableTypes:
+                    raise QueueOverflow('%d messages queued, none can be dropped'
+                                        % len(pending))
+                self.dropped += 1
+                return (msgType, msgBody)
+            self.dropped += 1
+        pending.append((msgType, msgBody))
+        if len(pending) > self.peakPending:
+            self.peakPending = len(pending)
+        return dropped
+
+    def admit(self):
+        """
+        Moves as many pending messages as the window allows in flight and
+        returns the list of their Outstanding, in sequence order.  The
+        caller is in charge of writing them and arming their timer.
+        """
+        admitted = []
+        pending = self.pending
+        while pending and seqDiff(self.nextSeqNbr, self.base) < self.windowSize:
+            msgType, msgBody = pending.popleft()
+            outstanding = Outstanding(self.nextSeqNbr, msgType,
+                                      Codec.build(self.nextSeqNbr, msgType, msgBody))
+            self.inFlight[self.nextSeqNbr] = outstanding
+            self.nextSeqNbr = seqAdd(self.nextSeqNbr, 1)
+            admitted.append(outstanding)
+        return admitted
+
+    def ack(self, seqNbr, now=None):
+        """
+        :param int seqNbr: the sequence number carried by an
+            acknowledgement.
+        :param float now: when the acknowledgement was received.  If
+            given and the message was written only once, the round trip
+            time is fed to rtt (Karn's rule: the acknowledgement of a
+            retransmitted message could answer any of its copies).
+
+        Returns the Outstanding acknowledged (its timer is cancelled), or
+        None if seqNbr is not in flight (duplicate or stray
+        acknowledgement).  The base of the window slides over every
+        acknowledged message.
+        """
+        outstanding = self.inFlight.pop(seqNbr, None)
+        if outstanding is None:
+            return None
+        outstanding.cancelTimer()
+        if now is not None and outstanding.tries == 1:
+            self.rtt.sample(now - outstanding.sentAt)
+        self.slide()
+        return outstanding
+
+    def ackCumulative(self, cumAck, sackBitmap=0, now=None):
+        """
+        :param int cumAck: every message before this sequence number was
+            received.
+        :param int sackBitmap: bit i is set if message cumAck + 1 + i was
+            received.
+        :param float now: when the acknowledgement was received (see ack).
+
+        Returns the list of the Outstanding acknowledged, in sequence
+        order.  A cumAck older than base (a late acknowledgement) or newer
+        than nextSeqNbr (a bogus one) acknowledges nothing by itself.
+        """
+        seqNbrs = []
+        count = seqDiff(cumAck, self.base)
+        if count <= seqDiff(self.nextSeqNbr, self.base):
+            seqNbrs.extend(seqAdd(self.base, i) for i in xrange(count))
+        bit = 0
+        while sackBitmap:
+            if sackBitmap & 1:
+                seqNbrs.append(seqAdd(cumAck, 1 + bit))
+            sackBitmap >>= 1
+            bit += 1
+        acked = []
+        for seqNbr in seqNbrs:
+            outstanding = self.ack(seqNbr, now)
+            if outstanding is not None:
+                acked.append(outstanding)
+        return acked
+
+    def slide(self):
+        """
+        Moves the base of the window to the oldest message still in flight.
+        """
+        inFlight = self.inFlight
+        while self.base != self.nextSeqNbr and self.base not in inFlight:
+            self.base = seqAdd(self.base, 1)
+
+    def isInFlight(self, outstanding):
+        """
+        Returns True while outstanding has not been acknowledged or dropped.
+        """
+        return self.inFlight.get(outstanding.seqNbr) is outstanding
+
+    def close(self):
+        """
+        Cancels every retransmission timer and forgets all the messages.
+        """
+        for outstanding in self.inFlight.itervalues():
+            outstanding.cancelTimer()
+        self.inFlight.clear()
+        self.pending.clear()
+        self.base = self.nextSeqNbr
+
+
+class ReceiveWindow(object):
+
+    def __init__(self, windowSize=MAX_WINDOW, expectedSeqNbr=0):
+        """
+        :param int windowSize: how far ahead of the expected sequence
+            number a message is held instead of being considered as
+            already received.
+        :param int expectedSeqNbr: the sequence number of the next
+            message to hand over.
+
+        .. attribute:: expected
+
+            The sequence number of the next message to hand over.
+
+        .. attribute:: held
+
+            A dictionary seqNbr -> message of the messages received ahead
+            of a gap.
+
+        .. attribute:: duplicates
+
+            The number of messages received again.
+        """
+        if not 1 <= windowSize <= MAX_WINDOW:
+            raise ValueError('window size must be between 1 and %d' % MAX_WINDOW)
+        self.windowSize = windowSize
+        self.expected   = expectedSeqNbr
+        self.held       = {}
+        self.duplicates = 0
+
+    def reset(self, expectedSeqNbr=0):
+        """
+        Forgets everything, the next message expected is expectedSeqNbr.
+        """
+        self.expected = expectedSeqNbr
+        self.held.clear()
+
+    def receive(self, seqNbr, message):
+        """
+        :param int seqNbr: the sequence number of the received message.
+        :param message: the received message.
+
+        Returns the list of the messages that can now be handed over, in
+        sequence order.  It is empty when message is held waiting for an
+        earlier one, and None when message was already received (it must
+        be acknowledged again but not handled).
+        """
+        distance = seqDiff(seqNbr, self.expected)
+        if distance >= self.windowSize:
+            self.duplicates += 1
+            return None
+        if distance > 0:
+            if seqNbr in self.held:
+                self.duplicates += 1
+                return None
+            self.held[seqNbr] = message
+            return []
+        delivered = [message]
+        expected = seqAdd(seqNbr, 1)
+        held = self.held
+        while expected in held:
+            delivered.append(held.pop(expected))
+            expected = seqAdd(expected, 1)
+        self.expected = expected
+        return delivered
+
+
+class DuplicateFilter(object):
+
+    def __init__(self, firstSeqNbr=None):
+        """
+        :param int firstSeqNbr: the sequence number of a message already
+            handled, or None if no message was received yet.
+
+        .. attribute:: lastSeqNbr
+
+            The sequence number of the last message handled.
+
+        .. attribute:: duplicates
+
+            The number of messages recognized as already handled.
+        """
+        self.lastSeqNbr = firstSeqNbr
+        self.duplicates = 0
+
+    def isDuplicate(self, seqNbr):
+        """
+        :param int seqNbr: the sequence number of a received message.
+
+        Returns True if the message was already handled (it is then to be
+        acknowledged again and nothing else).  Otherwise the message is
+        recorded as handled and False is returned.  Any message less than
+        half the sequence space ahead of the last one is new, so skipped
+        sequence numbers do no harm.
+        """
+        if self.lastSeqNbr is not None:
+            distance = seqDiff(seqNbr, self.lastSeqNbr)
+            if distance == 0 or distance >= MAX_WINDOW:
+                self.duplicates += 1
+                return True
+        self.lastSeqNbr = seqNbr
+        return False
+
+
+class RttEstimator(object):
+
+    def __init__(self, initialRto=0.5, minRto=0.05, maxRto=4.0):
+        """
+        :param float initialRto: the timeout used before the first sample.
+        :param float minRto: the lower bound of the timeout.
+        :param float maxRto: the upper bound of the timeout, backoff
+            included.
+
+        .. attribute:: srtt
+
+            The smoothed round trip time (None before the first sample).
+
+        .. attribute:: rttvar
+
+            The round trip time variation.
+
+        .. attribute:: rto
+
+            The current retransmission timeout, in seconds.
+        """
+        self.minRto = minRto
+        self.maxRto = maxRto
+        self.srtt   = None
+        self.rttvar = None
+        self.rto    = initialRto
+
+    def sample(self, rtt):
+        """
+        :param float rtt: a measured round trip time, in seconds.
+
+        Updates srtt, rttvar and rto.  Only samples taken on messages
+        sent once must be given (Karn's rule).
+        """
+        if self.srtt is None:
+            self.srtt   = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt   = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, self.minRto), self.maxRto)
+
+    def timeout(self, tries):
+        """
+        :param int tries: the number of times the message has been
+            written, including the one the timer is armed for.
+
+        Returns the delay before the next retransmission: rto doubled for
+        each retransmission already done, bounded by maxRto.
+        """
+        return min(self.rto * (1 << min(tries - 1, 16)), self.maxRto)
+
+
+class AckCoalescer(object):
+
+    def __init__(self, sendAck, timerWheel, expectedSeqNbr=0, ackDelay=0.02, maxPending=8):
+        """
+        :param sendAck: the function writing an acknowledgement message
+            to the peer, called with the message.
+        :param TimingWheel timerWheel: the wheel the delayed
+            acknowledgement timer is armed on.
+        :param int expectedSeqNbr: the sequence number of the first
+            message expected from the peer.
+        :param float ackDelay: how long an acknowledgement may be held,
+            in seconds.  It must stay well below the retransmission
+            timeout of the peer.
+        :param int maxPending: an acknowledgement is sent right away once
+            this many messages are waiting for it.
+
+        .. attribute:: expected
+
+            The sequence number of the next message expected: every
+            message before it was received.
+
+        .. attribute:: held
+
+            The set of the sequence numbers received after a gap.
+
+        .. attribute:: pending
+
+            The number of messages received since the last
+            acknowledgement.
+
+        .. attribute:: acksSent
+
+            The number of type 4 acknowledgements sent.
+
+        .. attribute:: acksPiggybacked
+
+            The number of acknowledgements sent as a trailer.
+        """
+        self.sendAck         = sendAck
+        self.timerWheel      = timerWheel
+        self.ackDelay        = ackDelay
+        self.maxPending      = maxPending
+        self.expected        = expectedSeqNbr
+        self.held            = set()
+        self.pending         = 0
+        self.timer           = None
+        self.acksSent        = 0
+        self.acksPiggybacked = 0
+
+    def received(self, seqNbr):
+        """
+        :param int seqNbr: the sequence number of a message just received
+            (even a duplicate one, which must be acknowledged again).
+
+        Records the message and makes sure an acknowledgement leaves soon.
+        """
+        distance = seqDiff(seqNbr, self.expected)
+        if distance == 0:
+            expected = seqAdd(seqNbr, 1)
+            held = self.held
+            while expected in held:
+                held.discard(expected)
+                expected = seqAdd(expected, 1)
+            self.expected = expected
+        elif distance <= Codec.SACK_BITS:
+            self.held.add(seqNbr)
+        self.pending += 1
+        if self.pending >= self.maxPending:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.timerWheel.arm(self.ackDelay, self.flush)
+
+    def sackBitmap(self):
+        """
+        Returns the bitmap of the messages held after expected.
+        """
+        bitmap = 0
+        for seqNbr in self.held:
+            bitmap |= 1 << (seqDiff(seqNbr, self.expected) - 1)
+        return bitmap
+
+    def trailer(self):
+        """
+        Returns the ack trailer to append to a message sent to the peer,
+        or an empty string if nothing waits for an acknowledgement.  The
+        delayed acknowledgement is then cancelled.
+        """
+        if not self.pending:
+            return ''
+        self.clear()
+        self.acksPiggybacked += 1
+        return Codec.ackTrailer(self.expected, self.sackBitmap())
+
+    def flush(self):
+        """
+        Sends the type 4 acknowledgement of every message received since
+        the last one.
+        """
+        self.timer = None
+        if not self.pending:
+            return
+        self.clear()
+        self.acksSent += 1
+        self.sendAck(Codec.encodeExtendedAck(self.expected, self.sackBitmap()))
+
+    def clear(self):
+        """
+        Forgets the pending acknowledgement and cancels its timer.
+        """
+        self.pending = 0
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
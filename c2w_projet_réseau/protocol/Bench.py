@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Microbenchmarks of the hot paths of the codec and of the engines.
+
+Each case times one call of a function the server or the client makes for
+every message: reading the header fields (Tools), building a request
+(ClientEngine.constructMsgBuf), building and sending the user list, the
+movie list, a notification broadcast or a chat message broadcast
+(ServerEngine, over a Store.ServerStore), and parsing the lists on the
+client.  The movie list is packed once by the room index: sendMovieList
+times the sending of the cached body, movieListBody its packing.  The list and broadcast cases run at several sizes, from 10 to
+10,000 users and from 1 to 255 movies (see MAX_BODY_LEN for the largest
+user lists).
+
+A case is identified by its name and its size, as in
+'server.sendUserList[users=1000]'.  run returns a dictionary identifier ->
+seconds per call, the best of several repeats; compare tells the cases
+slower than in a baseline (a previous run stored as JSON) by more than a
+threshold.
+
+The server side uses StreamServerEngines in the reliable transport mode
+writing to nowhere: what is measured is the building of the messages, not
+the retransmission machinery or the sockets.
+"""
+import itertools
+import platform
+import timeit
+import Codec
+import Tools
+import ClientEngine
+import ServerEngine
+from Store import ServerStore
+from c2w.main.client_model import c2wClientModel
+from c2w.main.constants import ROOM_IDS
+
+USER_COUNTS  = (10, 100, 1000, 10000)
+MOVIE_COUNTS = (1, 16, 255)
+
+CHAT_MESSAGE = 'x' * 100
+
+# The msgLen field has 16 bits: beyond about 5,000 users the user list
+# does not fit in a message, only its body is built then.
+MAX_BODY_LEN = 0xFFFF - Codec.HEAD_LEN_SIZE
+
+
+def timeLoop(function, number):
+    """
+    Returns the time taken by number calls of function.
+    """
+    loop = itertools.repeat(None, number)
+    timer = timeit.default_timer
+    start = timer()
+    for _ in loop:
+        function()
+    return timer() - start
+
+
+def measure(function, minTime=0.05, repeat=5):
+    """
+    :param function: the function to time, called without arguments.
+    :param float minTime: the minimum duration of a repeat, in seconds.
+    :param int repeat: the number of repeats.
+
+    Returns the seconds per call of function, the best of the repeats.
+    The number of calls per repeat is doubled until a repeat lasts
+    minTime.
+    """
+    number = 1
+    elapsed = timeLoop(function, number)
+    while elapsed < minTime:
+        number *= 2
+        elapsed = timeLoop(function, number)
+    best = elapsed / number
+    for _ in xrange(repeat - 1):
+        best = min(best, timeLoop(function, number) / number)
+    return best
+
+
+def caseId(name, **size):
+    if not size:
+        return name
+    return '%s[%s]' % (name, ','.join('%s=%s' % item for item in sorted(size.items())))
+
+
+def discard(*args):
+    pass
+
+
+class ServerFixture(object):
+
+    def __init__(self, userCount, movieCount):
+        """
+        :param int userCount: the number of users logged in.
+        :param int movieCount: the number of movies.
+
+        A store of userCount users spread over the main room and the
+        rooms of movieCount movies, each user with the StreamServerEngine
+        of his connection.
+
+        .. attribute:: engines
+
+            The engines of the users, in the order of the users.
+        """
+        self.store = ServerStore([('Movie %d' % movieId, '10.0.%d.%d' % divmod(movieId, 256),
+                                   5000 + movieId)
+                                  for movieId in xrange(1, movieCount + 1)])
+        rooms = [ROOM_IDS.MAIN_ROOM] + [movie.movieTitle for movie in self.store.getMovieList()]
+        self.movies = [(movie.movieId, movie.movieIpAddress, movie.moviePort, movie.movieTitle)
+                       for movie in self.store.getMovieList()]
+        self.engines = []
+        for index in xrange(userCount):
+            address = ('10.1.%d.%d' % divmod(index % 65536, 256), 10000 + index)
+            engine = ServerEngine.StreamServerEngine(self.store, address, discard, discard)
+            engine.reliable = True
+            engine.setUserState(address, Tools.USER_STATES.IN_ROOM)
+            engine.serverProxy.addUser('user%05d' % index, rooms[index % len(rooms)],
+                                       engine, address)
+            self.engines.append(engine)
+        self.serverProxy = self.engines[0].serverProxy
+        self.users = self.serverProxy.getUserList()
+
+    def buildUserList(self):
+        #every login changes the list: build it again each time
+        self.serverProxy.version += 1
+        self.serverProxy.userListBody()
+
+    def sendUserList(self):
+        self.serverProxy.version += 1
+        engine = self.engines[0]
+        engine.sendReliable(engine.address, 7, self.serverProxy.userListBody())
+
+    def buildMovieList(self):
+        #what the room index does once, when it is built
+        Codec.movieListBody(self.movies)
+
+    def sendMovieList(self):
+        engine = self.engines[0]
+        engine.sendReliable(engine.address, 8, self.serverProxy.movieListBody())
+
+    def broadcastNotification(self):
+        user = self.users[0]
+        self.engines[0].broadcastNotification(user, self.users[1:])
+
+    def broadcastChatMessage(self):
+        user = self.users[0]
+        self.engines[0].broadcastChatMessage(user, CHAT_MESSAGE, self.users[1:])
+
+
+class ClientFixture(object):
+
+    def __init__(self):
+        """
+        A DatagramClientEngine, without user interface, given the lists
+        of the server again and again.
+        """
+        self.engine = ClientEngine.DatagramClientEngine(None, discard)
+
+    def userListReceived(self, datagram):
+        self.engine.clientModel = c2wClientModel()
+        self.engine.userListRecieved(datagram, len(datagram))
+
+    def movieListReceived(self, datagram):
+        self.engine.clientModel = c2wClientModel()
+        self.engine.movieListReceived(datagram, len(datagram))
+
+
+def cases(userCounts=USER_COUNTS, movieCounts=MOVIE_COUNTS):
+    """
+    Yields the (identifier, function) of every case, the fixtures of the
+    largest sizes being built last.
+    """
+    chatMessage = Codec.encodeChatMessage(5, 'user00001', CHAT_MESSAGE)
+    msgLen = len(chatMessage)
+    yield caseId('tools.getHead'), lambda: Tools.getHead(chatMessage)
+    yield caseId('tools.getLen'), lambda: Tools.getLen(chatMessage)
+    yield caseId('tools.getData'), lambda: Tools.getData(chatMessage, msgLen)
+
+    client = ClientFixture()
+    construct = client.engine.constructMsgBuf
+    yield caseId('client.constructMsgBuf', type=0), lambda: construct(5, 0)
+    yield caseId('client.constructMsgBuf', type=1), lambda: construct(5, 1, 'user00001')
+    yield caseId('client.constructMsgBuf', type=3), lambda: construct(5, 3, 12)
+    yield caseId('client.constructMsgBuf', type=13), lambda: construct(5, 13, CHAT_MESSAGE)
+
+    for movieCount in movieCounts:
+        server = ServerFixture(1, movieCount)
+        movieList = Codec.frame(2, 8, server.serverProxy.movieListBody())
+        yield caseId('server.movieListBody', movies=movieCount), server.buildMovieList
+        yield caseId('server.sendMovieList', movies=movieCount), server.sendMovieList
+        yield (caseId('client.movieListReceived', movies=movieCount),
+               lambda movieList=movieList: client.movieListReceived(movieList))
+
+    for userCount in userCounts:
+        server = ServerFixture(userCount, 4)
+        userListBody = server.serverProxy.userListBody()
+        yield caseId('server.userListBody', users=userCount), server.buildUserList
+        if len(userListBody) <= MAX_BODY_LEN:
+            userList = Codec.frame(1, 7, userListBody)
+            yield caseId('server.sendUserList', users=userCount), server.sendUserList
+            yield (caseId('client.userListRecieved', users=userCount),
+                   lambda userList=userList: client.userListReceived(userList))
+        yield (caseId('server.sendNotification', users=userCount),
+               server.broadcastNotification)
+        yield (caseId('server.sendChatMessage', users=userCount),
+               server.broadcastChatMessage)
+
+
+def run(userCounts=USER_COUNTS, movieCounts=MOVIE_COUNTS, pattern=None, minTime=0.05,
+        repeat=5, progress=None):
+    """
+    :param userCounts: the numbers of users of the list and broadcast
+        cases.
+    :param movieCounts: the numbers of movies of the movie list cases.
+    :param string pattern: only run the cases whose identifier contains
+        it.
+    :param float minTime: the minimum duration of a repeat (see measure).
+    :param int repeat: the number of repeats of each case.
+    :param progress: called with the identifier and the result of each
+        case, or None.
+
+    Returns a dictionary identifier -> seconds per call.
+    """
+    results = {}
+    for identifier, function in cases(userCounts, movieCounts):
+        if pattern is not None and pattern not in identifier:
+            continue
+        results[identifier] = measure(function, minTime, repeat)
+        if progress is not None:
+            progress(identifier, results[identifier])
+    return results
+
+
+def document(results):
+    """
+    Returns the results of run with a description of the interpreter
+    they were measured on, to be stored as JSON.
+    """
+    return {'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'results': results}
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    :param dict results: the results of run.
+    :param dict baseline: the results of a previous run.
+    :param float threshold: the relative slowdown beyond which a case is
+        a regression.
+
+    Returns the sorted list of the (identifier, baseline seconds, seconds,
+    ratio, regression) of the cases in both.
+    """
+    comparison = []
+    for identifier in sorted(results):
+        if identifier in baseline and baseline[identifier]:
+            ratio = results[identifier] / baseline[identifier]
+            comparison.append((identifier, baseline[identifier], results[identifier],
+                               ratio, ratio > 1 + threshold))
+    return comparison
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Message brokers connecting the nodes of a sharded c2w server.
+
+A broker delivers the messages published on a topic to the callbacks
+subscribed to it.  A message is any value marshal can serialize (tuples,
+lists, strings and numbers).  The nodes (see Sharding) only need:
+
+- subscribe(topic, callback): callback(message) is called for every
+  message published on topic after the call;
+- publish(topic, message).
+
+The messages published by one node on one topic are delivered in order.
+Two brokers are provided:
+
+- LocalBroker delivers the messages in the same process, on the next
+  reactor iteration, to run several nodes in one process;
+- UnixBroker is the client of a BrokerHub listening on a Unix socket
+  (scripts/c2w_broker.py), to run the nodes in several processes of the
+  same machine.
+
+Another transport (a TCP hub, an existing message bus) only has to
+provide the same two methods.
+"""
+import marshal
+from twisted.internet import reactor
+from twisted.internet.protocol import Factory, ReconnectingClientFactory
+from twisted.protocols.basic import Int32StringReceiver
+from twisted.python import log
+
+# Requests sent to a BrokerHub: (OP_SUBSCRIBE, topic) or
+# (OP_PUBLISH, topic, message).  The hub sends (topic, message).
+OP_SUBSCRIBE = 0
+OP_PUBLISH   = 1
+
+
+class LocalBroker(object):
+
+    def __init__(self, clock=None):
+        """
+        :param clock: the IReactorTime scheduling the deliveries (the
+            reactor by default).
+
+        .. attribute:: subscribers
+
+            A dictionary topic -> list of callbacks.
+
+        .. attribute:: queue
+
+            The (topic, message) published and not delivered yet.  The
+            messages are copied when published, as a remote broker would.
+        """
+        self.clock       = clock if clock is not None else reactor
+        self.subscribers = {}
+        self.queue       = []
+        self.deliverCall = None
+        self.published   = 0
+
+    def subscribe(self, topic, callback):
+        self.subscribers.setdefault(topic, []).append(callback)
+
+    def publish(self, topic, message):
+        self.published += 1
+        self.queue.append((topic, marshal.dumps(message)))
+        if self.deliverCall is None:
+            self.deliverCall = self.clock.callLater(0, self.deliver)
+
+    def deliver(self):
+        """
+        Delivers the queued messages, in the order they were published.
+        """
+        self.deliverCall = None
+        queue, self.queue = self.queue, []
+        for topic, data in queue:
+            for callback in self.subscribers.get(topic, ()):
+                try:
+                    callback(marshal.loads(data))
+                except Exception:
+                    log.err(None, 'message on %s not handled' % topic)
+
+
+class HubConnection(Int32StringReceiver):
+
+    MAX_LENGTH = 64 * 1024 * 1024
+
+    def __init__(self, hub):
+        self.hub    = hub
+        self.topics = set()
+
+    def stringReceived(self, data):
+        request = marshal.loads(data)
+        if request[0] == OP_SUBSCRIBE:
+            self.topics.add(request[1])
+            self.hub.subscribers.setdefault(request[1], set()).add(self)
+        else:
+            self.hub.publish(request[1], request[2])
+
+    def connectionLost(self, reason):
+        for topic in self.topics:
+            self.hub.subscribers[topic].discard(self)
+
+
+class BrokerHub(Factory):
+
+    def __init__(self):
+        """
+        Relays the messages published by its clients (UnixBroker) to the
+        clients subscribed to their topic.
+
+        .. attribute:: subscribers
+
+            A dictionary topic -> set of HubConnection.
+
+        .. attribute:: relayed
+
+            The number of messages written to the subscribers.
+        """
+        self.subscribers = {}
+        self.relayed     = 0
+
+    def buildProtocol(self, addr):
+        return HubConnection(self)
+
+    def publish(self, topic, message):
+        data = marshal.dumps((topic, message))
+        for connection in self.subscribers.get(topic, ()):
+            connection.sendString(data)
+            self.relayed += 1
+
+
+class BrokerClient(Int32StringReceiver):
+
+    MAX_LENGTH = 64 * 1024 * 1024
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def connectionMade(self):
+        self.broker.connected(self)
+
+    def stringReceived(self, data):
+        self.broker.received(*marshal.loads(data))
+
+    def connectionLost(self, reason):
+        self.broker.disconnected(self)
+
+
+class UnixBroker(ReconnectingClientFactory):
+
+    maxDelay = 2
+
+    def __init__(self, path, clock=None):
+        """
+        :param string path: the Unix socket of the BrokerHub.
+        :param clock: the reactor to connect with (the reactor by
+            default).
+
+        Connects to the hub right away, and again whenever the
+        connection is lost.  The requests made while it is not connected
+        are sent once it is.
+
+        .. attribute:: pending
+
+            The requests waiting for the connection.
+        """
+        self.path        = path
+        self.clock       = clock if clock is not None else reactor
+        self.subscribers = {}
+        self.pending     = []
+        self.connection  = None
+        self.published   = 0
+        self.clock.connectUNIX(path, self)
+
+    def buildProtocol(self, addr):
+        self.resetDelay()
+        return BrokerClient(self)
+
+    def connected(self, connection):
+        self.connection = connection
+        # subscribe again after a reconnection
+        requests = [(OP_SUBSCRIBE, topic) for topic in self.subscribers]
+        requests += [request for request in self.pending if request[0] == OP_PUBLISH]
+        self.pending = []
+        for request in requests:
+            connection.sendString(marshal.dumps(request))
+
+    def disconnected(self, connection):
+        if self.connection is connection:
+            self.connection = None
+            log.msg('connection to the broker at %s lost' % self.path)
+
+    def send(self, request):
+        if self.connection is None:
+            self.pending.append(request)
+        else:
+            self.connection.sendString(marshal.dumps(request))
+
+    def subscribe(self, topic, callback):
+        if topic not in self.subscribers:
+            self.subscribers[topic] = []
+            self.send((OP_SUBSCRIBE, topic))
+        self.subscribers[topic].append(callback)
+
+    def publish(self, topic, message):
+        self.published += 1
+        self.send((OP_PUBLISH, topic, message))
+
+    def received(self, topic, message):
+        for callback in self.subscribers.get(topic, ()):
+            try:
+                callback(message)
+            except Exception:
+                log.err(None, 'message on %s not handled' % topic)
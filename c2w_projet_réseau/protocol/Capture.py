@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Capture of the c2w traffic of a server.
+
+When a Recorder is enabled, the server engines record every message they
+receive and send, and the end of every TCP connection:
+
+    if(Capture.recorder is not None):
+        Capture.recorder.record(Capture.INBOUND, address, datagram)
+
+As with Trace, this costs the test of a module attribute while no capture
+is enabled.  The engines read recorder when they are created: enable is
+called by the launchers (their --capture option) before the server
+starts.
+
+A capture file is a header (MAGIC and the protocol, 'UDP' or 'TCP')
+followed by records, each one being:
+
+- RECORD: the time (seconds since the epoch, a double), the direction
+  (INBOUND, OUTBOUND or CLOSED), the length of the peer and the length of
+  the data;
+- the peer, as 'host:port';
+- the data: the datagram or the TCP message, as received or sent.
+
+The file is only appended to, through a buffer: the records reach the
+disk by blocks of bufferSize bytes, and when the recorder is closed (at
+the exit of the process).  A capture cut by a crash is read up to its
+last complete record.  Replay sends a capture back to a server.
+"""
+import atexit
+import struct
+import time
+
+MAGIC = 'C2WCAP\x01'
+HEADER = struct.Struct('!7s3s')
+RECORD = struct.Struct('!dBBI')
+
+INBOUND  = 0
+OUTBOUND = 1
+CLOSED   = 2
+
+# Set by enable: the server engines record their messages when not None.
+recorder = None
+
+
+def formatPeer(address):
+    return '%s:%d' % (address[0], address[1])
+
+
+def parsePeer(peer):
+    host, _, port = peer.rpartition(':')
+    return (host, int(port))
+
+
+class Recorder(object):
+
+    def __init__(self, path, protocol, bufferSize=65536, timer=time.time):
+        """
+        :param string path: the capture file, created or appended to.
+        :param string protocol: 'UDP' or 'TCP'.
+        :param int bufferSize: the size of the write buffer.
+        :param timer: the function giving the time of the records.
+
+        Appends records to a capture file.  A file that already holds
+        a capture must be one of the same protocol.
+
+        .. attribute:: records
+
+            The number of records written.
+
+        .. attribute:: bytes
+
+            The number of bytes of data recorded.
+        """
+        self.protocol = protocol
+        self.timer    = timer
+        self.peers    = {}
+        self.records  = 0
+        self.bytes    = 0
+        self.file     = open(path, 'ab', bufferSize)
+        self.file.seek(0, 2)
+        if self.file.tell() == 0:
+            self.file.write(HEADER.pack(MAGIC, protocol))
+        else:
+            with open(path, 'rb') as captureFile:
+                magic, captured = HEADER.unpack(captureFile.read(HEADER.size))
+            if magic != MAGIC or captured != protocol:
+                self.file.close()
+                raise ValueError('%s is not a %s capture' % (path, protocol))
+
+    def peerOf(self, address):
+        """
+        Returns the peer field of address, formatted once per address.
+        """
+        peer = self.peers.get(address)
+        if peer is None:
+            if len(self.peers) >= 65536:
+                self.peers.clear()
+            peer = self.peers[address] = formatPeer(address)
+        return peer
+
+    def record(self, direction, address, data=''):
+        """
+        :param int direction: INBOUND, OUTBOUND or CLOSED.
+        :param address: the (host, port) address of the client.
+        :param data: the message, a string or a tuple of strings.
+        """
+        peer = self.peerOf(address)
+        write = self.file.write
+        if isinstance(data, tuple):
+            dataLen = sum(len(part) for part in data)
+            write(RECORD.pack(self.timer(), direction, len(peer), dataLen) + peer)
+            for part in data:
+                write(part)
+        else:
+            dataLen = len(data)
+            write(RECORD.pack(self.timer(), direction, len(peer), dataLen) + peer)
+            write(data)
+        self.records += 1
+        self.bytes += dataLen
+
+    def recordingWrite(self, write):
+        """
+        Returns the write function of a DatagramServerEngine, recording
+        the datagrams before handing them to write.
+        """
+        def recordedWrite(datagram, userAdrs):
+            self.record(OUTBOUND, userAdrs, datagram)
+            write(datagram, userAdrs)
+        return recordedWrite
+
+    def recordingWriteMessage(self, writeMessage, address):
+        """
+        Returns the writeMessage function of the StreamServerEngine of
+        the client at address, recording the messages before handing
+        them to writeMessage.
+        """
+        def recordedWriteMessage(msgBuf, key=None):
+            self.record(OUTBOUND, address, msgBuf)
+            writeMessage(msgBuf, key)
+        return recordedWriteMessage
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+def enable(path, protocol, bufferSize=65536):
+    """
+    :param string path: the capture file.
+    :param string protocol: 'UDP' or 'TCP'.
+    :param int bufferSize: the size of the write buffer.
+
+    Records the traffic of the server engines created from now on, until
+    the process exits.  Returns the Recorder.
+    """
+    global recorder
+    recorder = Recorder(path, protocol, bufferSize)
+    atexit.register(recorder.close)
+    return recorder
+
+
+def disable():
+    """
+    Stops recording and closes the capture file.
+    """
+    global recorder
+    if recorder is not None:
+        recorder.close()
+        recorder = None
+
+
+class Reader(object):
+
+    def __init__(self, path):
+        """
+        :param string path: a capture file.
+
+        Iterating over a Reader gives the (time, direction, peer, data) of
+        the records of the capture, peer being a (host, port) tuple.
+
+        .. attribute:: protocol
+
+            The protocol of the capture, 'UDP' or 'TCP'.
+        """
+        self.path = path
+        with open(path, 'rb') as captureFile:
+            header = captureFile.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError('%s is not a c2w capture' % path)
+        magic, self.protocol = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError('%s is not a c2w capture' % path)
+
+    def __iter__(self):
+        peers = {}
+        with open(self.path, 'rb', 65536) as captureFile:
+            captureFile.seek(HEADER.size)
+            read = captureFile.read
+            while True:
+                head = read(RECORD.size)
+                if len(head) < RECORD.size:
+                    return
+                timestamp, direction, peerLen, dataLen = RECORD.unpack(head)
+                peer = read(peerLen)
+                data = read(dataLen)
+                # the end of a capture cut by a crash
+                if len(data) < dataLen:
+                    return
+                address = peers.get(peer)
+                if address is None:
+                    address = peers[peer] = parsePeer(peer)
+                yield timestamp, direction, address, data
@@ -0,0 +1,684 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Transport independent engine of the c2w client.
+
+Like the server engines (see ServerEngine), the client engines do no I/O
+of their own: the bytes received from the server are handed to them, the
+bytes to send go through the write function given to them, and their
+timers are armed on the TimingWheel of the clock given to them (the
+reactor by default).  The twisted protocols (udp_chat_client,
+tcp_chat_client) are thin adapters wiring an engine to their transport.
+
+ClientEngine sends the requests of the user one at a time, each one until
+it is acknowledged, and updates the client model and the user interface
+from the messages of the server:
+
+- DatagramClientEngine receives the messages of the server through an
+  Arq.ReceiveWindow, as the server keeps several of them in flight;
+- StreamClientEngine cuts the TCP stream into messages and negotiates
+  the reliable transport mode, in which nothing is acknowledged.
+"""
+import collections
+import logging
+from twisted.internet import reactor
+import Tools
+import Codec
+import Arq
+import Framer
+import TimingWheel
+import Trace
+from c2w.main.client_model import c2wClientModel
+from c2w.main.constants import ROOM_IDS
+from Tools import USER_STATES
+
+moduleLogger = logging.getLogger('c2w.protocol.client_engine')
+
+
+class ClientEngine(object):
+
+    # Number of tries per message before the server is considered as gone.
+    maxTries = 10
+
+    def __init__(self, clientProxy, write, clock=None):
+        """
+        :param clientProxy: the clientProxy of the user interface.
+        :param write: the function sending a message to the server,
+            called with the message.
+        :param clock: the IReactorTime giving the time and running the
+            timers (the reactor by default).
+
+        .. attribute:: seqNbr
+
+            The sequence number of the request being sent.
+
+        .. attribute:: timer
+
+            The retransmission timer of the request waiting for its
+            acknowledgement.
+
+        .. attribute:: counter
+
+            The number of times that request has been written.
+
+        .. attribute:: rtt
+
+            The Arq.RttEstimator giving the retransmission timeout,
+            measured on the acknowledgements of the server.
+
+        .. attribute:: timerWheel
+
+            The TimingWheel of clock, shared by all the engines using it,
+            on which the retransmission timers are armed.
+
+        .. attribute:: sentAt
+
+            When the request waiting for its acknowledgement was first
+            sent.
+
+        .. attribute:: clientModel
+
+            The client model (database), which stores the users and the
+            movies.
+
+        .. attribute:: state
+
+            The state of the user, mainly used to react correctly to the
+            acknowledgements.
+
+        .. attribute:: userName
+
+            The name of the user.
+
+        .. attribute:: roomName
+
+            The room of the user.
+
+        .. attribute:: msgQueue
+
+            The chat messages waiting for the request being sent to be
+            acknowledged.
+
+        .. attribute:: ackReceived
+
+            False while a chat message waits for its acknowledgement.
+        """
+        self.clientProxy  = clientProxy
+        self.write        = write
+        self.clock        = clock if clock is not None else reactor
+        self.timerWheel   = TimingWheel.getWheel(self.clock)
+        self.timer        = None
+        self.seqNbr       = 0
+        self.counter      = 0
+        self.rtt          = Arq.RttEstimator()
+        self.sentAt       = None
+        self.clientModel  = c2wClientModel()
+        self.state        = USER_STATES.DISCONNECTED
+        self.userName     = None
+        self.roomName     = None
+        self.msgQueue     = collections.deque()
+        self.ackReceived  = True
+
+    def login(self, userName):
+        """
+        :param string userName: The user name that the user has typed.
+        """
+        self.userName = userName
+        self.state = USER_STATES.CONNECTING
+        self.transmit(self.constructMsgBuf(self.seqNbr, 1, userName) + self.loginTrailer())
+        if(Trace.enabled):
+            moduleLogger.debug('----->login message sent')
+
+    def loginTrailer(self):
+        """
+        Returns what follows the login request: the capabilities offered
+        to the server, if any.
+        """
+        return ''
+
+    def chat(self, message):
+        """
+        :param string message: The text of the chat message.
+
+        Sends a chat message, or queues it behind the request waiting for
+        its acknowledgement.
+        """
+        if(self.ackReceived):
+            if(Trace.enabled):
+                moduleLogger.debug('----->message sent to server : %s seq (%d)', message, self.seqNbr)
+            self.ackReceived = False
+            self.transmit(self.constructMsgBuf(self.seqNbr, 13, message))
+        else:
+            if(Trace.enabled):
+                moduleLogger.debug('----->message added to queue : %s seq (%d)', message, self.seqNbr)
+            self.msgQueue.append(message)
+
+    def joinRoom(self, roomName):
+        """
+        :param roomName: The room name (or movie title), or
+            ROOM_IDS.MAIN_ROOM to go back to the main room.
+        """
+        if(Trace.enabled):
+            moduleLogger.debug('----->join room requested')
+        self.roomName = roomName
+        self.state = USER_STATES.TO_ROOM_REQUEST_PENDING
+        # for the main room the movieId to be sent is 0
+        if(roomName == ROOM_IDS.MAIN_ROOM):
+            movieId = 0
+        #otherwise it's the movieId of the movieRoom
+        else:
+            movieId = self.clientModel.getMovieByTitle(roomName).movieId
+        self.transmit(self.constructMsgBuf(self.seqNbr, 3, movieId))
+
+    def leaveSystem(self):
+        """
+        Asks the server to leave the system.
+        """
+        if(Trace.enabled):
+            moduleLogger.debug('----->leave system request sent')
+        self.state = USER_STATES.TO_OUT_OF_THE_SYSTEM_ROOM_REQUEST_PENDING
+        self.transmit(self.constructMsgBuf(self.seqNbr, 2))
+
+    def transmit(self, msgBuf):
+        """
+        :param string msgBuf: a request for the server.
+
+        Writes the request, and again each time its timer expires.
+        """
+        self.writeRequest(msgBuf)
+        self.manageTimer(msgBuf)
+
+    def writeRequest(self, msgBuf):
+        """
+        :param string msgBuf: a request for the server.
+        """
+        self.write(msgBuf)
+
+    def sendAcknowledgement(self, seqNbr):
+        """
+        :param seqNbr : the sequence of the message received
+        """
+        self.write(self.constructMsgBuf(seqNbr, 0))
+
+    def waitingAck(self):
+        """
+        Returns True while a request waits for its acknowledgement.
+        """
+        return self.timer is not None and self.timer.active()
+
+    def acknowledged(self):
+        """
+        Called when the server acknowledged the request waiting for it.
+        """
+        if(Trace.enabled):
+            moduleLogger.debug('<-----acknowlegment received')
+        self.timer.cancel()
+        if(self.counter == 1):
+        #Karn's rule: only a message sent once gives a valid RTT
+            self.rtt.sample(self.clock.seconds() - self.sentAt)
+        self.counter = 0
+        self.delivered()
+
+    def delivered(self):
+        """
+        Called when the request sent last has been delivered.  The next
+        queued chat message is sent and a pending join room or leave
+        system request is completed.
+        """
+        self.seqNbr = Arq.seqAdd(self.seqNbr, 1)
+        self.ackReceived = True
+        if(self.msgQueue):
+            self.chat(self.msgQueue.popleft())
+        #If join room or leave system requested
+        if self.state == USER_STATES.TO_OUT_OF_THE_SYSTEM_ROOM_REQUEST_PENDING :
+            self.clientProxy.leaveSystemOKONE()
+        elif self.state == USER_STATES.TO_ROOM_REQUEST_PENDING :
+            self.state = USER_STATES.IN_ROOM
+            self.clientModel.updateUserChatroom(self.userName, self.roomName)
+            self.clientProxy.joinRoomOKONE()
+
+    def manageTimer(self, msgBuf):
+        """
+        :param string msgBuf: the request just written.
+
+        Arms the timer writing the request again after the timeout given
+        by the RTT estimator, doubled at each try.  After maxTries tries
+        the server is considered as unreachable.
+        """
+        if(Trace.enabled):
+            moduleLogger.debug('timer activated')
+        if(self.counter < self.maxTries):
+            if(self.counter == 0):
+                self.sentAt = self.clock.seconds()
+            self.counter += 1
+            self.timer = self.timerWheel.arm(self.rtt.timeout(self.counter), self.transmit, msgBuf)
+        else:
+            self.counter = 0
+            self.serverUnreachable()
+
+    def serverUnreachable(self):
+        """
+        Called when a request was sent maxTries times without being
+        acknowledged.  The pending messages are dropped and the user
+        interface goes back to the login screen.
+        """
+        moduleLogger.warning('no answer from the server after %d tries', self.maxTries)
+        self.msgQueue.clear()
+        self.ackReceived = True
+        if self.state == USER_STATES.CONNECTING :
+            self.state = USER_STATES.DISCONNECTED
+            self.clientProxy.connectionRejectedONE("Serveur injoignable")
+        else :
+            self.state = USER_STATES.DISCONNECTED
+            self.clientProxy.leaveSystemOKONE()
+
+    def messageReceived(self, datagram):
+        """
+        :param string datagram: a message of the server (not an
+            acknowledgement), in sequence order.
+
+        Handles one message of the server.
+        """
+        msgSeq, msgType = Tools.getHead(datagram)
+        if(msgType in (5, 6) and self.waitingAck()):
+        #the answer to the login shows it was received, even if its
+        #acknowledgement was lost: the next request must not be sent with
+        #the sequence number of the login, as a duplicate of it
+            self.acknowledged()
+
+        #Login ok received
+        if (msgType == 5):
+            if(Trace.enabled):
+                moduleLogger.debug('<-----login ok received')
+                moduleLogger.debug('----->acknowledgment sent')
+            #when login ok recieved the user must be added to dataBase
+            self.roomName = ROOM_IDS.OUT_OF_THE_SYSTEM_ROOM
+            self.clientModel.addUser(self.userName, None, self.roomName)
+
+        #Login failed
+        elif(msgType == 6):
+            if(Trace.enabled):
+                moduleLogger.debug('<-----Login failed received')
+                moduleLogger.debug('----->acknowledgment sent')
+            self.clientProxy.connectionRejectedONE("Nom d'utilisateur indisponible")
+
+        else :
+            msgLen  = Tools.getLen(datagram)
+            #User list received
+            if(msgType == 7):
+                if(Trace.enabled):
+                    moduleLogger.debug('<-----User list received')
+                    moduleLogger.debug('----->acknowledgment sent')
+                self.userListRecieved(datagram, msgLen)
+
+            #Movie list received
+            elif(msgType == 8):
+                if(Trace.enabled):
+                    moduleLogger.debug('<-----Movie list received')
+                    moduleLogger.debug('----->acknowledgment sent')
+                self.movieListReceived(datagram, msgLen)
+
+            #Chat message received
+            elif(msgType == 14):
+                if(Trace.enabled):
+                    moduleLogger.debug('<-----chat message received')
+                    moduleLogger.debug('----->acknowledgment sent')
+                self.chatMessageRecieved(datagram, msgLen)
+
+            #Notification received
+            elif(msgType in (9, 10, 11, 12) ):
+                if(Trace.enabled):
+                    moduleLogger.debug('<-----notification message received')
+                    moduleLogger.debug('----->acknowledgment sent')
+                self.notificationRecieved(datagram, msgLen, msgType)
+
+        #Interface update after receiving movie and user lists
+        if self.state == USER_STATES.INITIALAZATION_COMPLETE :
+            self.initializationComplete()
+
+    def initializationComplete(self):
+        """
+        Called once both the user list and the movie list are received:
+        the user interface shows the main room.
+        """
+        if(Trace.enabled):
+            moduleLogger.debug('**initialization step complete**')
+        self.state = USER_STATES.IN_ROOM
+        self.roomName = ROOM_IDS.MAIN_ROOM
+        userList = []
+        for user in self.clientModel.getUserList():
+            movie = self.clientModel.getMovieById(user.userChatRoom)
+            if(movie == None):
+                userList.append((user.userName, ROOM_IDS.MAIN_ROOM))
+                self.clientModel.updateUserChatroom(user.userName, ROOM_IDS.MAIN_ROOM)
+            else :
+                userList.append((user.userName, movie.movieTitle))
+                self.clientModel.updateUserChatroom(user.userName, movie.movieTitle)
+        movieList = [(m.movieTitle,m.movieIpAddress,m.moviePort) for m in self.clientModel.getMovieList()]
+        self.clientProxy.initCompleteONE(userList, movieList)
+
+    def constructMsgBuf(self, seqNbr, msgType, msgData = ''):
+        """
+        :param int seqNbr     : the sequence number field of the message
+        :param int msgType    : the message Type field
+        :param string msgData : the message data field
+
+        this function constract the message buffer for
+        all messages for the client to send
+        supported types :0, 1, 2, 3, 13
+        """
+        """""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+        |seqNbr (11 bits) + msgtype (5bits) | msgLen(2bytes) (+ message (variable length))|
+        |         msgHead(2bytes)           |                                             |
+        """""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
+        if(msgType in (0, 2)):
+        #for types 0 (acknowledgement), 2(disconnect)
+            return Codec.encode(msgType, seqNbr)
+        #for types 1 (login), 3 (join room), 13(chat message)
+        return Codec.encode(msgType, seqNbr, msgData)
+
+    def userListRecieved(self, datagram, msgLen):
+        """
+        :param string datagram : the message packet
+        :param int msgLen    : the message length
+
+        This function is called by the protocol when the user list message
+        is recieved.It unpacks the message packet, extract users information
+        and fill the database model.
+        """
+        if self.state is USER_STATES.MOVIE_LIST_RECIEVED:
+            self.state = USER_STATES.INITIALAZATION_COMPLETE
+        else : self.state = USER_STATES.USER_LIST_RECIEVED
+        for userChatRoom, userName in Codec.decodeUserList(datagram):
+            if(userChatRoom == 0):
+                userChatRoom = ROOM_IDS.MAIN_ROOM
+
+            if(self.userName != userName):
+                self.clientModel.addUser(userName, None, userChatRoom)
+
+    def movieListReceived(self, datagram, msgLen):
+        """
+        :param string datagram : the message packet
+        :param int msgLen    : the message length
+
+        This function is called by the protocol when the movie list message
+        is recieved.It unpacks the message packet, extract movies information
+        and fill the database model.
+        """
+        if self.state is USER_STATES.USER_LIST_RECIEVED:
+            self.state = USER_STATES.INITIALAZATION_COMPLETE
+        else : self.state = USER_STATES.MOVIE_LIST_RECIEVED
+        for movieId, host, port, movieName in Codec.decodeMovieList(datagram):
+            self.clientModel.addMovie(movieName,host,port,movieId)
+
+    def notificationRecieved(self, datagram, msgLen, msgType):
+        """
+        :param string datagram : the message packet
+        :param int msgLen    : the message length
+        :param int msgType : the message type
+
+        This function is called by the protocol when a notification message
+        is recieved.It unpacks the message packet and update database according
+        to data extracted.
+        """
+        movieId, userName  = Codec.decodeNotification(datagram)
+        #connection notification recieved
+        if msgType == 9 :
+            roomName = ROOM_IDS.MAIN_ROOM
+            self.clientModel.addUser(userName, None, ROOM_IDS.MAIN_ROOM)
+        #To main room notification recieved
+        elif msgType == 11:
+            roomName = ROOM_IDS.MAIN_ROOM
+        #Leave the system notification recieved
+        elif msgType == 10:
+            roomName = ROOM_IDS.OUT_OF_THE_SYSTEM_ROOM
+        #moving to movie room notification recieved
+        else:
+            roomName = self.clientModel.getMovieById(movieId).movieTitle
+        #update database and interface
+        self.clientModel.updateUserChatroom(userName, roomName)
+        self.clientProxy.userUpdateReceivedONE(userName, roomName)
+
+    def chatMessageRecieved(self, datagram, msgLen):
+        """
+        :param string datagram : the message packet
+        :param int msgLen    : the message length
+
+        This function is called by the protocol when a chat message
+        is recieved.It unpacks the message packet, extract the chat message
+        and update the interface to show message in the chat room.
+        """
+        userName, message    = Codec.decodeChatMessage(datagram)
+        self.clientProxy.chatMessageReceivedONE(userName, message)
+
+
+class DatagramClientEngine(ClientEngine):
+
+    # Offer cumulative acknowledgements to the server at login.
+    cumulativeAcks = True
+
+    def __init__(self, clientProxy, write, clock=None):
+        """
+        :param clientProxy: the clientProxy of the user interface.
+        :param write: the function sending a datagram to the server,
+            called with the datagram.
+        :param clock: the IReactorTime giving the time and running the
+            timers (the reactor by default).
+
+        The engine of the UDP client.
+
+        .. attribute:: receiveWindow
+
+            The Arq.ReceiveWindow handing the messages of the server
+            over in sequence order.  The server keeps several messages
+            in flight, so they can arrive out of order or twice.
+
+        .. attribute:: ackCoalescer
+
+            The Arq.AckCoalescer acknowledging the messages of the
+            server, or None if the server did not accept cumulative
+            acknowledgements at login.
+        """
+        ClientEngine.__init__(self, clientProxy, write, clock)
+        self.receiveWindow = Arq.ReceiveWindow()
+        self.ackCoalescer  = None
+
+    def login(self, userName):
+        #the server numbers its messages from 0 again for each login
+        self.receiveWindow.reset()
+        self.ackCoalescer = None
+        ClientEngine.login(self, userName)
+
+    def loginTrailer(self):
+        if(self.cumulativeAcks):
+            return Codec.capsTrailer(Codec.CAP_CUMULATIVE_ACK)
+        return ''
+
+    def writeRequest(self, msgBuf):
+        """
+        :param string msgBuf : a request for the server.
+
+        Sends a request, with the pending acknowledgement as a trailer
+        if there is one.
+        """
+        if(self.ackCoalescer is not None):
+            msgBuf += self.ackCoalescer.trailer()
+        self.write(msgBuf)
+
+    def acknowledge(self, seqNbr):
+        """
+        :param seqNbr : the sequence of the message received
+
+        Acknowledges a message of the server: right away with a type 0
+        message, or later and together with the next ones if cumulative
+        acknowledgements were negotiated.
+        """
+        if(self.ackCoalescer is None):
+            self.sendAcknowledgement(seqNbr)
+        else:
+            self.ackCoalescer.received(seqNbr)
+
+    def datagramReceived(self, datagram):
+        """
+        :param string datagram: a datagram of the server.
+        """
+        msgSeq, msgType = Tools.getHead(datagram)
+        if(len(datagram) > Codec.messageLength(datagram)):
+            capabilities, ack = Codec.parseTrailers(datagram)
+            if(msgType == 5 and self.cumulativeAcks and capabilities is not None
+               and capabilities & Codec.CAP_CUMULATIVE_ACK and self.ackCoalescer is None):
+            #the server accepted cumulative acknowledgements
+                self.ackCoalescer = Arq.AckCoalescer(self.write, self.timerWheel, msgSeq)
+            if(ack is not None):
+                self.cumulativeAckReceived(ack[0])
+
+        #Acknowledgement received
+        if(msgType == 0):
+            if(msgSeq == self.seqNbr and self.waitingAck()):
+                self.acknowledged()
+            else:
+            #late or repeated ack, the message was already acknowledged
+                if(Trace.enabled):
+                    moduleLogger.debug('<-----duplicate acknowlegment received')
+            return
+
+        #Cumulative acknowledgement received
+        if(msgType == 4):
+            self.cumulativeAckReceived(msgSeq)
+            return
+
+        #acknowledge every message, even a duplicate or an early one,
+        #so that the server stops sending it again.  Before handling it:
+        #a request sent while handling it must not overtake the ack
+        self.acknowledge(msgSeq)
+        delivered = self.receiveWindow.receive(msgSeq, datagram)
+        if(delivered is None):
+            if(Trace.enabled):
+                moduleLogger.debug('<-----duplicate message received (%d)', msgSeq)
+        else:
+            #the messages are handled in the order the server sent them
+            for message in delivered:
+                self.messageReceived(message)
+
+    def cumulativeAckReceived(self, cumAck):
+        """
+        :param int cumAck : every message before cumAck was received by
+            the server.
+
+        Handles a type 4 acknowledgement or an ack trailer: it
+        acknowledges the request waiting for it if cumAck is right after
+        it.
+        """
+        if(self.waitingAck() and cumAck == Arq.seqAdd(self.seqNbr, 1)):
+            self.acknowledged()
+
+
+class StreamClientEngine(ClientEngine):
+
+    # Offer the reliable transport mode to the server at login.
+    reliableTransport = True
+
+    def __init__(self, clientProxy, write, loseConnection, clock=None):
+        """
+        :param clientProxy: the clientProxy of the user interface.
+        :param write: the function writing bytes on the connection.
+        :param loseConnection: the function closing the connection.
+        :param clock: the IReactorTime giving the time and running the
+            timers (the reactor by default).
+
+        The engine of the TCP client.
+
+        .. attribute:: receiveFilter
+
+            The Arq.DuplicateFilter recognizing the messages the server
+            sent again because our acknowledgement came too late.
+
+        .. attribute:: framer
+
+            The StreamFramer cutting the received stream into messages.
+
+        .. attribute:: reliable
+
+            True once the server accepted the reliable transport mode
+            (see Codec.RELIABLE_SEQ): messages are neither acknowledged
+            nor retransmitted, a request is done as soon as it is
+            written.
+        """
+        ClientEngine.__init__(self, clientProxy, write, clock)
+        self.loseConnection = loseConnection
+        self.receiveFilter  = Arq.DuplicateFilter()
+        self.framer         = Framer.StreamFramer()
+        self.reliable       = False
+
+    def login(self, userName):
+        if(self.reliableTransport and self.userName is None):
+        #first login on this connection: offer the reliable transport mode
+            self.seqNbr = Codec.RELIABLE_SEQ
+        #the server numbers its messages from 0 again for each login
+        self.receiveFilter = Arq.DuplicateFilter()
+        ClientEngine.login(self, userName)
+
+    def transmit(self, msgBuf):
+        """
+        :param string msgBuf: a request for the server.
+
+        In the reliable transport mode the request is delivered as soon
+        as it is written, otherwise it is written again each time its
+        timer expires.
+        """
+        self.writeRequest(msgBuf)
+        if(self.reliable):
+            self.delivered()
+        else:
+            self.manageTimer(msgBuf)
+
+    def dataReceived(self, data):
+        """
+        :param string data: bytes received on the connection.
+        """
+        try:
+            frames = self.framer.feed(data)
+        except Framer.FramingError:
+            moduleLogger.warning('invalid stream received, closing the connection')
+            self.loseConnection()
+            return
+        for frame in frames:
+            self.frameReceived(frame)
+
+    def frameReceived(self, datagram):
+        """
+        :param string datagram: a complete message of the server.
+        """
+        msgSeq, msgType = Tools.getHead(datagram)
+        if(msgType in (5, 6) and msgSeq == Codec.RELIABLE_SEQ
+           and self.seqNbr == Codec.RELIABLE_SEQ and self.waitingAck()):
+        #the server accepted the reliable transport mode, its answer
+        #stands for the acknowledgement of the login
+            if(Trace.enabled):
+                moduleLogger.debug('<-----reliable transport mode accepted')
+            self.reliable = True
+            self.timer.cancel()
+            self.counter = 0
+            self.delivered()
+        elif(msgType == 0 and (self.reliable or msgSeq != self.seqNbr or not self.waitingAck())):
+        #late or repeated ack, the message was already acknowledged
+            if(Trace.enabled):
+                moduleLogger.debug('<-----duplicate acknowlegment received')
+            return
+        elif(msgType != 0 and not self.reliable and self.receiveFilter.isDuplicate(msgSeq)):
+        #our ack came too late: acknowledge again, do not handle it again
+            if(Trace.enabled):
+                moduleLogger.debug('<-----duplicate message received (%d)', msgSeq)
+            self.sendAcknowledgement(msgSeq)
+            return
+
+        if(msgType == 0):
+            self.acknowledged()
+        else:
+            self.messageReceived(datagram)
+            if(not self.reliable):
+                self.sendAcknowledgement(msgSeq)
+
+    def serverUnreachable(self):
+        self.loseConnection()
+        ClientEngine.serverUnreachable(self)
@@ -0,0 +1,491 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Multi-process UDP server: N workers sharing the server port.
+
+The supervisor process binds N UDP sockets on the server port with
+SO_REUSEPORT, then forks one worker per socket.  Each worker runs its own
+reactor and its own c2wUdpChatServerProtocol, so the server uses N cores.
+
+A client belongs to one worker, chosen by a hash of its address (see
+ownerOf).  On Linux a classic BPF program attached to the sockets makes
+the kernel compute the same hash, so the datagrams of a client reach its
+worker directly; elsewhere, or for a datagram the program could not
+place, the worker that received it forwards it to the owner.
+
+The workers are connected two by two by Unix stream sockets (created
+before the fork) carrying:
+
+- the datagrams received for a client of another worker;
+- the messages for the clients of another worker (a notification or a
+  chat message for a member of the room on the other worker): the owner
+  sends them through the send window of the client, as its own;
+- the changes of the user store (addUser, updateUserChatroom,
+  removeUser), applied by every worker to its copy of the store so that
+  the user lists and the room members are the same everywhere;
+- the movies to stream, streamed by the first worker only.
+
+The messages for a worker are grouped and written once per reactor
+iteration.  Two clients logging in with the same name at the same time
+on two workers are both accepted: the user store is only eventually
+consistent across the workers.  Each worker keeps the user it knew first
+under that name, and ignores the changes about the other one.
+"""
+import ctypes
+import errno
+import marshal
+import os
+import signal
+import socket
+import struct
+import sys
+import zlib
+from twisted.internet.protocol import Factory
+from twisted.protocols.basic import Int32StringReceiver
+from twisted.python import log
+
+# Not defined by the socket module of python 2.
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+SO_ATTACH_REUSEPORT_CBPF = 51
+# Classic BPF offset of the IP header (SKF_NET_OFF)
+SKF_NET_OFF = -0x100000
+IPV4_ADDRESS = struct.Struct('!I')
+
+# Messages exchanged by the workers
+MSG_DATAGRAM     = 0   # (MSG_DATAGRAM, address, datagram)
+MSG_SEND         = 1   # (MSG_SEND, address, msgType, msgBody)
+MSG_USER_ADDED   = 2   # (MSG_USER_ADDED, userName, userChatRoom, address)
+MSG_USER_MOVED   = 3   # (MSG_USER_MOVED, userName, userChatRoom)
+MSG_USER_REMOVED = 4   # (MSG_USER_REMOVED, userName)
+MSG_STREAM_MOVIE = 5   # (MSG_STREAM_MOVIE, movieTitle)
+
+
+class sock_filter(ctypes.Structure):
+    _fields_ = [('code', ctypes.c_uint16),
+                ('jt', ctypes.c_uint8),
+                ('jf', ctypes.c_uint8),
+                ('k', ctypes.c_uint32)]
+
+
+class sock_fprog(ctypes.Structure):
+    _fields_ = [('len', ctypes.c_ushort),
+                ('filter', ctypes.POINTER(sock_filter))]
+
+
+def ownerOf(address, count):
+    """
+    :param address: the (host, port) address of a client.
+    :param int count: the number of workers.
+
+    Returns the index of the worker the client belongs to: the source
+    address xor the source port, modulo count, as computed by the BPF
+    program of attachSteering (a crc32 of the address if host is not an
+    IPv4 address).
+    """
+    host, port = address
+    try:
+        key = IPV4_ADDRESS.unpack(socket.inet_aton(host))[0] ^ port
+    except (socket.error, TypeError):
+        key = zlib.crc32('%s:%s' % address) & 0xffffffff
+    return key % count
+
+
+def internRoom(room):
+    """
+    Returns the interned room name: the protocol compares the rooms with
+    the ROOM_IDS constants by identity.
+    """
+    return intern(room) if type(room) is str else room
+
+
+def attachSteering(sock, count):
+    """
+    :param sock: one of the UDP sockets sharing the port.
+    :param int count: the number of sockets sharing the port.
+
+    Attaches to the sockets of the port a BPF program giving each
+    datagram to the socket of index ownerOf(source, count), in the order
+    the sockets were bound.  IP options are not skipped: such datagrams
+    land on another worker and are forwarded.  Returns False if the
+    system does not support it (then the kernel spreads the datagrams by
+    its own hash).
+    """
+    program = [(0x20, SKF_NET_OFF + 12),    # ld [source address]
+               (0x07, 0),                   # tax
+               (0x28, SKF_NET_OFF + 20),    # ldh [source port]
+               (0xac, 0),                   # xor x
+               (0x94, count),               # mod #count
+               (0x16, 0)]                   # ret a
+    filters = (sock_filter * len(program))(
+        *[sock_filter(code, 0, 0, k & 0xffffffff) for code, k in program])
+    fprog = sock_fprog(len(program), ctypes.cast(filters, ctypes.POINTER(sock_filter)))
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF,
+                        ctypes.string_at(ctypes.addressof(fprog), ctypes.sizeof(fprog)))
+    except socket.error:
+        return False
+    return True
+
+
+def fork(count, port, interface=''):
+    """
+    :param int count: the number of workers.
+    :param int port: the UDP port of the server.
+    :param string interface: the address to listen on (all by default).
+
+    Binds count sockets on port, creates the channels between the
+    workers and forks them.  Returns the Worker of the calling process in
+    each worker.  In the supervisor it never returns: it waits for the
+    workers, passes SIGTERM and SIGUSR1 on to them, stops them all as
+    soon as one exits and exits in turn.
+
+    Must be called before the twisted reactor is imported, the workers
+    would share its descriptors otherwise.
+    """
+    if 'twisted.internet.reactor' in sys.modules:
+        raise RuntimeError('the workers must be forked before the reactor is installed')
+    sockets = []
+    for index in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        sock.setblocking(False)
+        sock.bind((interface, port))
+        sockets.append(sock)
+    steered = attachSteering(sockets[0], count)
+    channels = {}
+    for index in range(count):
+        for peer in range(index + 1, count):
+            channels[index, peer], channels[peer, index] = socket.socketpair()
+    pids = []
+    for index in range(count):
+        pid = os.fork()
+        if pid == 0:
+            peers = dict((peer, channels.pop((index, peer)))
+                         for peer in range(count) if peer != index)
+            for sock in channels.values() + sockets[:index] + sockets[index + 1:]:
+                sock.close()
+            return Worker(index, count, sockets[index], peers, steered)
+        pids.append(pid)
+    for sock in channels.values() + sockets:
+        sock.close()
+    supervise(pids)
+
+
+def supervise(pids):
+    """
+    :param list pids: the process ids of the workers.
+
+    Waits for the workers and exits, with status 1 if the first one to
+    exit failed.  SIGUSR1, which starts a profile of a server (see
+    Profiler), is passed on to every worker.
+    """
+    pids = list(pids)
+    stopping = []
+
+    def stop(signum=None, frame=None):
+        stopping.append(signum)
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+    def forward(signum, frame):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+    # the terminal sends SIGINT to the workers too, they stop by themselves
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGUSR1, forward)
+    status = 0
+    while pids:
+        try:
+            pid, code = os.wait()
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        if pid not in pids:
+            continue
+        pids.remove(pid)
+        if code and not stopping:
+            status = 1
+        stop()
+    sys.exit(status)
+
+
+class Peer(Int32StringReceiver):
+
+    MAX_LENGTH = 64 * 1024 * 1024
+
+    def __init__(self, worker, peer):
+        self.worker = worker
+        self.peer   = peer
+
+    def connectionMade(self):
+        self.worker.peerConnected(self.peer, self)
+
+    def stringReceived(self, data):
+        self.worker.channelReceived(self.peer, data)
+
+    def connectionLost(self, reason):
+        self.worker.peerLost(self.peer)
+
+
+class Worker(object):
+
+    def __init__(self, index, count, udpSocket, peerSockets, steered=False):
+        """
+        :param int index: the index of this worker.
+        :param int count: the number of workers.
+        :param udpSocket: the UDP socket of this worker, bound to the
+            server port.
+        :param dict peerSockets: a dictionary index -> the Unix socket
+            connected to the worker of that index.
+        :param bool steered: whether the kernel gives the datagrams to
+            their owner (see attachSteering).
+
+        .. attribute:: engine
+
+            The ServerEngine.DatagramServerEngine of this worker, set by
+            attach.
+
+        .. attribute:: serverProxy
+
+            The ClusterServerProxy given to the engine.
+
+        .. attribute:: outgoing
+
+            A dictionary index -> list of the messages for that worker
+            posted during this reactor iteration.
+
+        .. attribute:: forwarded, relayed, published, received
+
+            The number of datagrams forwarded to their owner, of
+            messages given to another worker to send, of changes of the
+            user store published and of messages received from the other
+            workers.
+        """
+        self.index       = index
+        self.count       = count
+        self.udpSocket   = udpSocket
+        self.peerSockets = peerSockets
+        self.steered     = steered
+        self.peers       = {}
+        self.engine      = None
+        self.serverProxy = None
+        self.outgoing    = {}
+        self.flushCall   = None
+        self.reactor     = None
+        self.forwarded   = 0
+        self.relayed     = 0
+        self.published   = 0
+        self.received    = 0
+
+    def install(self):
+        """
+        Replaces reactor.listenUDP so that the server port is the socket
+        bound for this worker, and connects the channels to the other
+        workers.  Imports (so installs) the reactor.
+        """
+        from twisted.internet import reactor
+        self.reactor = reactor
+        listenUDP = reactor.listenUDP
+
+        def listen(port, protocol, interface='', maxPacketSize=8192):
+            if self.udpSocket is None or port != self.udpSocket.getsockname()[1]:
+                return listenUDP(port, protocol, interface, maxPacketSize)
+            return self.listenUDP(protocol, maxPacketSize)
+        reactor.listenUDP = listen
+        for peer, sock in self.peerSockets.items():
+            factory = Factory()
+            factory.buildProtocol = lambda addr, peer=peer: Peer(self, peer)
+            reactor.adoptStreamConnection(sock.fileno(), socket.AF_UNIX, factory)
+            sock.close()
+        self.peerSockets = {}
+
+    def listenUDP(self, protocol, maxPacketSize=8192):
+        """
+        Starts protocol on the UDP socket of this worker and returns the
+        listening port.
+        """
+        port = self.reactor.adoptDatagramPort(self.udpSocket.fileno(), socket.AF_INET,
+                                              protocol, maxPacketSize)
+        self.udpSocket.close()
+        self.udpSocket = None
+        return port
+
+    def attach(self, engine, serverProxy):
+        """
+        :param engine: the ServerEngine.DatagramServerEngine of this
+            worker.
+        :param serverProxy: its (indexed) serverProxy.
+
+        Returns the ClusterServerProxy the engine must use instead of
+        serverProxy.
+        """
+        self.engine = engine
+        self.serverProxy = ClusterServerProxy(serverProxy, self)
+        return self.serverProxy
+
+    def owns(self, address):
+        """
+        Returns True if the client at address belongs to this worker.
+        """
+        return self.count == 1 or ownerOf(address, self.count) == self.index
+
+    def forwardDatagram(self, address, datagram):
+        """
+        Gives a datagram received from the client at address to the
+        worker it belongs to.
+        """
+        self.forwarded += 1
+        self.post(ownerOf(address, self.count), (MSG_DATAGRAM, address, datagram))
+
+    def send(self, address, msgType, msgBody):
+        """
+        Asks the worker the client at address belongs to to send it a
+        message (see c2wUdpChatServerProtocol.sendReliable).
+        """
+        self.relayed += 1
+        self.post(ownerOf(address, self.count), (MSG_SEND, address, msgType, msgBody))
+
+    def publish(self, message):
+        """
+        Sends a change of the user store to every other worker.
+        """
+        self.published += 1
+        for peer in range(self.count):
+            if peer != self.index:
+                self.post(peer, message)
+
+    def post(self, peer, message):
+        """
+        Queues message for the worker peer, until the end of this reactor
+        iteration.
+        """
+        self.outgoing.setdefault(peer, []).append(message)
+        if self.flushCall is None:
+            self.flushCall = self.reactor.callLater(0, self.flush)
+
+    def flush(self):
+        """
+        Writes the queued messages, one string per worker.  The messages
+        for a worker whose channel is not connected yet stay queued.
+        """
+        if self.flushCall is not None and self.flushCall.active():
+            self.flushCall.cancel()
+        self.flushCall = None
+        for peer in self.outgoing.keys():
+            channel = self.peers.get(peer)
+            if channel is not None:
+                channel.sendString(marshal.dumps(self.outgoing.pop(peer)))
+
+    def peerConnected(self, peer, channel):
+        self.peers[peer] = channel
+        if self.outgoing.get(peer) and self.flushCall is None:
+            self.flushCall = self.reactor.callLater(0, self.flush)
+
+    def peerLost(self, peer):
+        self.peers.pop(peer, None)
+        self.outgoing.pop(peer, None)
+        log.msg('worker %d lost the channel to worker %d' % (self.index, peer))
+
+    def channelReceived(self, peer, data):
+        """
+        Handles the messages written by flush on the worker peer.
+        """
+        for message in marshal.loads(data):
+            self.received += 1
+            try:
+                self.dispatch(message, peer)
+            except Exception:
+                log.err(None, 'message %r from worker %d failed' % (message[0], peer))
+
+    def dispatch(self, message, peer):
+        kind = message[0]
+        if kind == MSG_DATAGRAM:
+            self.engine.datagramReceived(message[2], message[1])
+        elif kind == MSG_SEND:
+            self.engine.sendReliable(*message[1:])
+        elif kind == MSG_STREAM_MOVIE:
+            self.serverProxy.serverProxy.startStreamingMovie(message[1])
+        else:
+            self.serverProxy.apply(message, peer)
+
+    def stats(self):
+        """
+        Returns a dictionary with the counts of messages exchanged with
+        the other workers.
+        """
+        return {'worker': self.index, 'workers': self.count,
+                'steered': self.steered, 'forwarded': self.forwarded,
+                'relayed': self.relayed, 'published': self.published,
+                'received': self.received,
+                'queued': sum(len(messages) for messages in self.outgoing.values())}
+
+
+class ClusterServerProxy(object):
+
+    def __init__(self, serverProxy, worker):
+        """
+        :param serverProxy: the serverProxy to wrap (a
+            RoomIndexedServerProxy).
+        :param Worker worker: the worker of this process.
+
+        Publishes the changes of the user store made by this worker and
+        applies the ones of the other workers.  Every method not defined
+        here is forwarded to serverProxy.
+        """
+        self.serverProxy = serverProxy
+        self.worker      = worker
+
+    def __getattr__(self, name):
+        return getattr(self.serverProxy, name)
+
+    def addUser(self, userName, userChatRoom, userChatInstance=None, userAddress=None):
+        result = self.serverProxy.addUser(userName, userChatRoom, userChatInstance, userAddress)
+        self.worker.publish((MSG_USER_ADDED, userName, userChatRoom, userAddress))
+        return result
+
+    def updateUserChatroom(self, userName, userChatRoom):
+        result = self.serverProxy.updateUserChatroom(userName, userChatRoom)
+        self.worker.publish((MSG_USER_MOVED, userName, userChatRoom))
+        return result
+
+    def removeUser(self, userName):
+        result = self.serverProxy.removeUser(userName)
+        self.worker.publish((MSG_USER_REMOVED, userName))
+        return result
+
+    def startStreamingMovie(self, movieTitle):
+        if self.worker.index == 0:
+            return self.serverProxy.startStreamingMovie(movieTitle)
+        self.worker.post(0, (MSG_STREAM_MOVIE, movieTitle))
+
+    def apply(self, message, peer):
+        """
+        Applies a change of the user store published by the worker peer.
+
+        A name logged in on two workers at the same time is kept by each
+        worker for the user it knew first: the other one is not added,
+        and its moves and its removal are ignored.
+        """
+        kind, userName = message[:2]
+        if kind == MSG_USER_ADDED:
+            userChatRoom, address = message[2:]
+            if self.serverProxy.userExists(userName):
+                log.msg('user %s of worker %d already exists, ignored' % (userName, peer))
+                return
+            self.serverProxy.addUser(userName, internRoom(userChatRoom), None, tuple(address))
+            return
+        user = self.serverProxy.getUserByName(userName)
+        if user is None or ownerOf(user.userAddress, self.worker.count) != peer:
+            # not added, or the user of this name is another one
+            log.msg('user %s of worker %d unknown, change ignored' % (userName, peer))
+        elif kind == MSG_USER_MOVED:
+            self.serverProxy.updateUserChatroom(userName, internRoom(message[2]))
+        elif kind == MSG_USER_REMOVED:
+            self.serverProxy.removeUser(userName)
@@ -0,0 +1,482 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Wire codec of the c2w protocol.
+
+Every fixed part of a message is described by a precompiled struct.Struct,
+the variable parts (user names, movie titles, chat messages) are handled by
+plain slicing, so no format string is built or parsed while packets flow.
+
+Every message starts with the same header:
+---------------------------------------------------------------------------
+|seqNbr (11 bits) + msgtype (5bits) | msgLen(2bytes) (+ message (var. len))|
+|         msgHead(2bytes)           |                                     |
+---------------------------------------------------------------------------
+Types 0, 5 and 6 only carry msgHead.
+
+Peers that negotiated it at login (see capsTrailer) also use the extended
+acknowledgement (type 4) and may append trailers after the end of a
+message, as given by msgLen (or after msgHead for types 5 and 6).  Peers
+that did not negotiate never receive them, and would ignore the trailing
+bytes anyway.
+
+Over TCP trailers would break the framing of a peer that does not know
+them, so the reliable transport mode is negotiated with the sequence
+number of the login instead: a client offering it sends its login with
+RELIABLE_SEQ, and a server accepting it answers with a login ok (or
+rejected) carrying RELIABLE_SEQ, without acknowledging the login.  From
+then on neither side acknowledges nor retransmits anything.
+"""
+import struct
+import socket
+
+
+class MSG_TYPES(object):
+    ACK                   = 0
+    LOGIN                 = 1
+    LEAVE_SYSTEM          = 2
+    JOIN_ROOM             = 3
+    EXTENDED_ACK          = 4
+    LOGIN_OK              = 5
+    LOGIN_REJECTED        = 6
+    USER_LIST             = 7
+    MOVIE_LIST            = 8
+    USER_CONNECTED        = 9
+    USER_LEFT_SYSTEM      = 10
+    USER_TO_MAIN_ROOM     = 11
+    USER_TO_MOVIE_ROOM    = 12
+    CHAT_REQUEST          = 13
+    CHAT_MESSAGE          = 14
+
+# Types whose frame is made of msgHead only.
+HEAD_ONLY_TYPES   = frozenset((0, 5, 6))
+NOTIFICATION_TYPES = frozenset((9, 10, 11, 12))
+
+SEQ_BITS   = 11
+SEQ_MASK   = (1 << SEQ_BITS) - 1
+TYPE_MASK  = 31
+
+HEAD       = struct.Struct('!H')
+HEAD_LEN   = struct.Struct('!HH')
+ROOM_ID    = struct.Struct('!B')
+NAME_LEN   = struct.Struct('!H')
+USER_ENTRY = struct.Struct('!BH')
+MOVIE_ENTRY = struct.Struct('!B4sHH')
+MOVIE_ENTRY_HOST = struct.Struct('!BIHH')
+
+SACK       = struct.Struct('!I')
+TAG        = struct.Struct('!B')
+CAPS_TRAILER = struct.Struct('!BB')
+ACK_TRAILER  = struct.Struct('!BHI')
+
+HEAD_SIZE     = HEAD.size
+HEAD_LEN_SIZE = HEAD_LEN.size
+
+# Trailer tags and capability flags.
+TAG_CAPS   = 0xCA
+TAG_ACK    = 0xAC
+CAP_CUMULATIVE_ACK = 0x01
+SACK_BITS  = 32
+
+# TCP login sequence number offering (and accepting) the reliable mode.
+RELIABLE_SEQ = SEQ_MASK
+
+
+def packHead(seqNbr, msgType):
+    """
+    :param int seqNbr  : the sequence number field of the message.
+    :param int msgType : the message Type field.
+
+    Returns the 2 bytes msgHead of a message.
+    """
+    return HEAD.pack(((seqNbr & SEQ_MASK) << 5) + msgType)
+
+
+def unpackHead(data, offset=0):
+    """
+    :param string data: the message packet.
+
+    Returns the (seqNbr, msgType) tuple of the message header.
+    """
+    msgHead = HEAD.unpack_from(data, offset)[0]
+    return (msgHead >> 5, msgHead & TYPE_MASK)
+
+
+def unpackLen(data, offset=0):
+    """
+    :param string data: the message packet.
+
+    Returns the msgLen field of the message.
+    """
+    return HEAD_LEN.unpack_from(data, offset)[1]
+
+
+def frame(seqNbr, msgType, body=''):
+    """
+    :param int seqNbr  : the sequence number field of the message.
+    :param int msgType : the message Type field.
+    :param string body : everything following the msgLen field.
+
+    Returns a complete message made of msgHead, msgLen and body.
+    """
+    return HEAD_LEN.pack(((seqNbr & SEQ_MASK) << 5) + msgType,
+                         HEAD_LEN_SIZE + len(body)) + body
+
+
+def frameHead(seqNbr, msgType, bodyLen):
+    """
+    :param int seqNbr  : the sequence number field of the message.
+    :param int msgType : the message Type field.
+    :param int bodyLen : the length of the message body.
+
+    Returns the msgHead and msgLen fields of a message, to be written
+    right before a body shared by several messages.
+    """
+    return HEAD_LEN.pack(((seqNbr & SEQ_MASK) << 5) + msgType,
+                         HEAD_LEN_SIZE + bodyLen)
+
+
+def build(seqNbr, msgType, body=''):
+    """
+    :param int seqNbr  : the sequence number field of the message.
+    :param int msgType : the message Type field.
+    :param string body : everything following the msgLen field.
+
+    Returns the complete message: msgHead alone for the types made of
+    msgHead only, msgHead, msgLen and body for the others.
+    """
+    if msgType in HEAD_ONLY_TYPES:
+        return packHead(seqNbr, msgType)
+    return frame(seqNbr, msgType, body)
+
+
+def messageLength(data):
+    """
+    :param string data: the message packet.
+
+    Returns the length of the message itself, without any trailer.
+    """
+    if (HEAD.unpack_from(data)[0] & TYPE_MASK) in HEAD_ONLY_TYPES:
+        return HEAD_SIZE
+    return unpackLen(data)
+
+
+def getBody(data):
+    """
+    :param string data: the message packet.
+
+    Returns the bytes between the msgLen field and the end of the
+    message (as given by msgLen).
+    """
+    return data[HEAD_LEN_SIZE:unpackLen(data)]
+
+
+# ---------------------------------------------------------------------------
+# Message bodies.  They do not depend on the sequence number, so a body can
+# be built once and framed for every recipient.
+# ---------------------------------------------------------------------------
+
+def userListBody(users):
+    """
+    :param users: iterable of (movieId, userName) tuples.
+
+    +−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+
+    |    State      |       Username  Length        |Username (var.)|
+    +−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+
+    """
+    pack = USER_ENTRY.pack
+    return ''.join([pack(movieId, len(userName)) + userName
+                    for movieId, userName in users])
+
+
+def movieListBody(movies):
+    """
+    :param movies: iterable of (movieId, ipAddress, port, movieTitle) tuples,
+        ipAddress being a dotted quad string.
+
+    +−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+
+    |   movieID(1byte)    | Host(4bytes) | Port(2bytes) | Length(2bytes)
+    +−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+
+    |      MovieTitle (variable length)                               |
+    +−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+
+    """
+    pack = MOVIE_ENTRY.pack
+    return ''.join([pack(movieId, socket.inet_aton(ipAddress), port,
+                         len(movieTitle)) + movieTitle
+                    for movieId, ipAddress, port, movieTitle in movies])
+
+
+def notificationBody(movieId, userName):
+    """
+    +−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+
+    |    MovieID(1byte)   |        Username (variable length)       |
+    +−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+
+    """
+    return ROOM_ID.pack(movieId) + userName
+
+
+def chatMessageBody(userName, chatMessage):
+    """
+    +−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+
+    |  len(user.userName) (2bytes)  |      user.userName(var.)      |
+    +−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+
+    |               chatMessage  (variable length)                  |
+    +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+    """
+    return NAME_LEN.pack(len(userName)) + userName + chatMessage
+
+
+def capsTrailer(flags):
+    """
+    :param int flags: the CAP_XXX flags supported by the sender.
+
+    Returns the trailer announcing the capabilities of the sender, appended
+    to the login request and to the login OK message.
+    """
+    return CAPS_TRAILER.pack(TAG_CAPS, flags)
+
+
+def ackTrailer(cumAck, sackBitmap):
+    """
+    :param int cumAck: the sequence number of the next message expected,
+        every message before it was received.
+    :param int sackBitmap: bit i is set if message cumAck + 1 + i was
+        received.
+
+    Returns the trailer carrying an acknowledgement on a data message.
+    """
+    return ACK_TRAILER.pack(TAG_ACK, cumAck & SEQ_MASK, sackBitmap)
+
+
+def parseTrailers(data):
+    """
+    :param string data: the message packet.
+
+    Returns the (capabilities, ack) tuple of the trailers following the
+    message: capabilities is the flags of a caps trailer and ack the
+    (cumAck, sackBitmap) of an ack trailer, each one being None when
+    absent.  An unknown tag ends the parsing.
+    """
+    capabilities = ack = None
+    offset = messageLength(data)
+    end = len(data)
+    while offset < end:
+        tag = TAG.unpack_from(data, offset)[0]
+        if tag == TAG_CAPS and end - offset >= CAPS_TRAILER.size:
+            capabilities = CAPS_TRAILER.unpack_from(data, offset)[1]
+            offset += CAPS_TRAILER.size
+        elif tag == TAG_ACK and end - offset >= ACK_TRAILER.size:
+            ack = ACK_TRAILER.unpack_from(data, offset)[1:]
+            offset += ACK_TRAILER.size
+        else:
+            break
+    return (capabilities, ack)
+
+
+# ---------------------------------------------------------------------------
+# Encoders, one per message type.
+# ---------------------------------------------------------------------------
+
+def encodeAck(seqNbr):
+    return packHead(seqNbr, 0)
+
+
+def encodeExtendedAck(cumAck, sackBitmap):
+    """
+    +−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+
+    |  cumAck             | Type 4  |       msgLen(2bytes)          |
+    +−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+
+    |                 sackBitmap (4bytes)                           |
+    +−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+−+
+    Every message before cumAck was received, as well as the message
+    cumAck + 1 + i for each bit i set in sackBitmap.
+    """
+    return frame(cumAck, 4, SACK.pack(sackBitmap))
+
+
+def encodeLogin(seqNbr, userName):
+    return frame(seqNbr, 1, userName)
+
+
+def encodeLeaveSystem(seqNbr):
+    return frame(seqNbr, 2)
+
+
+def encodeJoinRoom(seqNbr, movieId):
+    return frame(seqNbr, 3, ROOM_ID.pack(movieId))
+
+
+def encodeLoginOk(seqNbr):
+    return packHead(seqNbr, 5)
+
+
+def encodeLoginRejected(seqNbr):
+    return packHead(seqNbr, 6)
+
+
+def encodeUserList(seqNbr, users):
+    return frame(seqNbr, 7, userListBody(users))
+
+
+def encodeMovieList(seqNbr, movies):
+    return frame(seqNbr, 8, movieListBody(movies))
+
+
+def encodeNotification(seqNbr, msgType, movieId, userName):
+    return frame(seqNbr, msgType, notificationBody(movieId, userName))
+
+
+def encodeChatRequest(seqNbr, chatMessage):
+    return frame(seqNbr, 13, chatMessage)
+
+
+def encodeChatMessage(seqNbr, userName, chatMessage):
+    return frame(seqNbr, 14, chatMessageBody(userName, chatMessage))
+
+
+# ---------------------------------------------------------------------------
+# Decoders, one per message type.  They all take a complete message (as
+# delimited by msgLen) and return the fields of its body.
+# ---------------------------------------------------------------------------
+
+def decodeEmpty(data):
+    return ()
+
+
+def decodeExtendedAck(data):
+    """Returns the (sackBitmap,) of an extended acknowledgement."""
+    return SACK.unpack_from(data, HEAD_LEN_SIZE)
+
+
+def decodeLogin(data):
+    """Returns the (userName,) of a login request."""
+    return (getBody(data),)
+
+
+def decodeJoinRoom(data):
+    """Returns the (movieId,) of a join room request."""
+    return ROOM_ID.unpack_from(data, HEAD_LEN_SIZE)
+
+
+def decodeChatRequest(data):
+    """Returns the (chatMessage,) of a chat message sent by a client."""
+    return (getBody(data),)
+
+
+def decodeUserList(data):
+    """
+    Returns a list of (movieId, userName) tuples, one per user of the
+    user list.
+    """
+    msgLen = unpackLen(data)
+    unpack = USER_ENTRY.unpack_from
+    users = []
+    offset = HEAD_LEN_SIZE
+    while offset < msgLen:
+        movieId, userNameLen = unpack(data, offset)
+        offset += USER_ENTRY.size
+        users.append((movieId, data[offset:offset + userNameLen]))
+        offset += userNameLen
+    return users
+
+
+def decodeMovieList(data):
+    """
+    Returns a list of (movieId, host, port, movieTitle) tuples, host being
+    the 32 bits integer form of the movie IP address.
+    """
+    msgLen = unpackLen(data)
+    unpack = MOVIE_ENTRY_HOST.unpack_from
+    movies = []
+    offset = HEAD_LEN_SIZE
+    while offset < msgLen:
+        movieId, host, port, movieTitleLen = unpack(data, offset)
+        offset += MOVIE_ENTRY_HOST.size
+        movies.append((movieId, host, port,
+                       data[offset:offset + movieTitleLen]))
+        offset += movieTitleLen
+    return movies
+
+
+def decodeNotification(data):
+    """Returns the (movieId, userName) of a notification."""
+    msgLen = unpackLen(data)
+    return (ROOM_ID.unpack_from(data, HEAD_LEN_SIZE)[0],
+            data[HEAD_LEN_SIZE + ROOM_ID.size:msgLen])
+
+
+def decodeChatMessage(data):
+    """Returns the (userName, chatMessage) of a chat message."""
+    msgLen = unpackLen(data)
+    userNameLen = NAME_LEN.unpack_from(data, HEAD_LEN_SIZE)[0]
+    offset = HEAD_LEN_SIZE + NAME_LEN.size
+    return (data[offset:offset + userNameLen],
+            data[offset + userNameLen:msgLen])
+
+
+def notificationEncoder(msgType):
+    """Returns the encoder of the notification type msgType."""
+    def encodeTypedNotification(seqNbr, movieId, userName):
+        return encodeNotification(seqNbr, msgType, movieId, userName)
+    return encodeTypedNotification
+
+
+ENCODERS = {
+    0:  encodeAck,
+    1:  encodeLogin,
+    2:  encodeLeaveSystem,
+    3:  encodeJoinRoom,
+    4:  encodeExtendedAck,
+    5:  encodeLoginOk,
+    6:  encodeLoginRejected,
+    7:  encodeUserList,
+    8:  encodeMovieList,
+    9:  notificationEncoder(9),
+    10: notificationEncoder(10),
+    11: notificationEncoder(11),
+    12: notificationEncoder(12),
+    13: encodeChatRequest,
+    14: encodeChatMessage,
+}
+
+DECODERS = {
+    0:  decodeEmpty,
+    1:  decodeLogin,
+    2:  decodeEmpty,
+    3:  decodeJoinRoom,
+    4:  decodeExtendedAck,
+    5:  decodeEmpty,
+    6:  decodeEmpty,
+    7:  decodeUserList,
+    8:  decodeMovieList,
+    9:  decodeNotification,
+    10: decodeNotification,
+    11: decodeNotification,
+    12: decodeNotification,
+    13: decodeChatRequest,
+    14: decodeChatMessage,
+}
+
+
+def encode(msgType, seqNbr, *fields):
+    """
+    :param int msgType : the message Type field.
+    :param int seqNbr  : the sequence number field of the message.
+    :param fields      : the fields of the message body (see the
+        encodeXXX function of the type).
+
+    Generic entry point, returns the complete message.
+    """
+    return ENCODERS[msgType](seqNbr, *fields)
+
+
+def decode(data):
+    """
+    :param string data: a complete message.
+
+    Generic entry point, returns a (seqNbr, msgType, fields) tuple,
+    fields being the tuple/list returned by the decodeXXX function of the
+    type.  Raises KeyError for an unknown type.
+    """
+    seqNbr, msgType = unpackHead(data)
+    return (seqNbr, msgType, DECODERS[msgType](data))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Incremental deframer for the TCP version of the c2w protocol.
+
+The bytes received on a connection are appended to a bytearray and a read
+offset walks over it, so extracting a frame never moves the rest of the
+buffer.  The consumed prefix is only dropped once it is large enough to be
+worth the copy.
+"""
+import Codec
+
+
+class FramingError(Exception):
+    """
+    Raised when the peer sends an invalid frame or lets its unread
+    data grow above the framer limit.
+    """
+    pass
+
+
+class StreamFramer(object):
+
+    def __init__(self, maxBufferSize=256 * 1024, compactThreshold=16 * 1024):
+        """
+        :param int maxBufferSize: the maximum number of buffered bytes
+            not yet forming a complete frame.
+        :param int compactThreshold: the consumed prefix is dropped once
+            it is larger than this many bytes (and than the unread part).
+
+        .. attribute:: buf
+
+            The bytearray holding the received bytes.
+
+        .. attribute:: offset
+
+            The offset of the first unread byte in buf.
+        """
+        self.maxBufferSize    = maxBufferSize
+        self.compactThreshold = compactThreshold
+        self.buf              = bytearray()
+        self.offset           = 0
+
+    def bufferedBytes(self):
+        """
+        Returns the number of received bytes not yet returned as a frame.
+        """
+        return len(self.buf) - self.offset
+
+    def feed(self, data):
+        """
+        :param string data: the bytes just received on the connection.
+
+        Appends data to the buffer and returns the list of all the
+        complete frames it now holds, in order.  Raises FramingError if
+        a frame header is invalid or if the unread data exceeds
+        maxBufferSize.
+        """
+        buf = self.buf
+        buf.extend(data)
+        end = len(buf)
+        offset = self.offset
+        frames = []
+        view = memoryview(buf)
+        try:
+            while end - offset >= Codec.HEAD_SIZE:
+                msgType = Codec.HEAD.unpack_from(buf, offset)[0] & Codec.TYPE_MASK
+                if msgType in Codec.HEAD_ONLY_TYPES:
+                    msgLen = Codec.HEAD_SIZE
+                else:
+                    if end - offset < Codec.HEAD_LEN_SIZE:
+                        break
+                    msgLen = Codec.HEAD_LEN.unpack_from(buf, offset)[1]
+                    if msgLen < Codec.HEAD_LEN_SIZE:
+                        raise FramingError('invalid message length %d' % msgLen)
+                    if end - offset < msgLen:
+                        break
+                frames.append(view[offset:offset + msgLen].tobytes())
+                offset += msgLen
+        finally:
+            # the bytearray cannot be resized while a view on it exists
+            del view
+
+        if offset == end:
+            del buf[:]
+            offset = 0
+        elif offset > self.compactThreshold and offset > end - offset:
+            del buf[:offset]
+            offset = 0
+        self.offset = offset
+
+        if len(buf) - offset > self.maxBufferSize:
+            raise FramingError('%d bytes buffered without a complete frame'
+                               % (len(buf) - offset))
+        return frames
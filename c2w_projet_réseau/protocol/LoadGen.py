@@ -0,0 +1,609 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Synthetic load on a c2w server.
+
+LoadGenerator simulates many users of the c2w clients, with one socket
+per user, speaking the real protocol through the client engines (see
+ClientEngine).  Each user logs in, receives the user and movie lists,
+joins the room of a movie (or stays in the main room) and sends chat
+messages at random times (a Poisson process of the given rate).  After
+the ramp up, the generator measures a window of the given duration, then
+the users leave the system.
+
+A chat message carries the time it was given to the engine: the users
+receiving it measure its delivery latency, queueing in the engine of the
+sender included (the users all live in this process, on the same clock).
+The engines count the requests they write again, for the retransmission
+ratio of the clients; the one of the server comes from its metrics (see
+Metrics), its CPU time and memory from /proc.
+
+The datagrams of the UDP users go through the LossyTransport of
+c2w.main, as with the -l option of the clients.  TCP does not lose
+anything: lossPr only applies to UDP.
+"""
+import logging
+import os
+import random
+import socket
+from twisted.internet import reactor
+from twisted.internet.protocol import DatagramProtocol, Protocol, ClientCreator
+from c2w.main.lossy_transport import LossyTransport
+import ClientEngine
+from Tools import USER_STATES
+
+moduleLogger = logging.getLogger('c2w.protocol.load_gen')
+
+# The counters of LoadStats, compared between the start and the end of
+# the measured window.
+COUNTERS = ('logins', 'rejected', 'lost', 'requests', 'retransmitted',
+            'chatsSent', 'chatsDelivered')
+
+
+class LoadStats(object):
+    """
+    The counters of a LoadGenerator, since its start.
+    """
+    __slots__ = COUNTERS
+
+    def __init__(self):
+        for name in COUNTERS:
+            setattr(self, name, 0)
+
+    def snapshot(self):
+        """
+        Returns a dictionary of the current values of the counters.
+        """
+        return dict((name, getattr(self, name)) for name in COUNTERS)
+
+
+class Reservoir(object):
+
+    def __init__(self, capacity=100000, randomGenerator=None):
+        """
+        :param int capacity: the number of samples kept.
+        :param randomGenerator: the random.Random choosing the samples
+            replaced (the random module by default).
+
+        A uniform sample of the values observed, of a bounded size
+        (reservoir sampling), for their percentiles.
+
+        .. attribute:: count
+
+            The number of values observed.
+        """
+        self.capacity = capacity
+        self.random   = randomGenerator or random
+        self.samples  = []
+        self.count    = 0
+
+    def add(self, value):
+        self.count += 1
+        if len(self.samples) < self.capacity:
+            self.samples.append(value)
+        else:
+            index = self.random.randrange(self.count)
+            if index < self.capacity:
+                self.samples[index] = value
+
+    def percentile(self, percent):
+        """
+        Returns the value below which percent % of the samples fall, or
+        None without samples.
+        """
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(percent / 100.0 * len(ordered)))]
+
+
+class CountingEngine(object):
+    """
+    Counts the requests written by a client engine in the LoadStats of its
+    user (stats), the first time and again.
+    """
+
+    def transmit(self, msgBuf):
+        if(self.counter):
+            self.stats.retransmitted += 1
+        else:
+            self.stats.requests += 1
+        super(CountingEngine, self).transmit(msgBuf)
+
+
+class DatagramLoadEngine(CountingEngine, ClientEngine.DatagramClientEngine):
+    pass
+
+
+class StreamLoadEngine(CountingEngine, ClientEngine.StreamClientEngine):
+    pass
+
+
+class UdpLoadProtocol(DatagramProtocol):
+
+    def __init__(self, client, serverAddress, lossPr):
+        """
+        :param LoadClient client: the user of the protocol.
+        :param tuple serverAddress: the (IP address, port) of the server.
+        :param float lossPr: the packet loss probability for outgoing
+            packets.
+
+        .. attribute:: engine
+
+            The DatagramLoadEngine of the user.
+        """
+        self.client         = client
+        self.serverAddress  = serverAddress
+        self.lossPr         = lossPr
+        self.lossyTransport = None
+        self.engine         = DatagramLoadEngine(client, self.writeDatagram)
+
+    def startProtocol(self):
+        self.lossyTransport = LossyTransport(self.transport, self.lossPr)
+
+    def datagramReceived(self, datagram, address):
+        self.engine.datagramReceived(datagram)
+
+    def writeDatagram(self, datagram):
+        self.lossyTransport.write(datagram, self.serverAddress)
+
+
+class TcpLoadProtocol(Protocol):
+
+    def __init__(self, client):
+        """
+        :param LoadClient client: the user of the protocol.
+
+        .. attribute:: engine
+
+            The StreamLoadEngine of the user.
+        """
+        self.client = client
+        self.engine = StreamLoadEngine(client, self.writeData, self.loseConnection)
+
+    def dataReceived(self, data):
+        self.engine.dataReceived(data)
+
+    def connectionLost(self, reason):
+        self.client.connectionLost()
+
+    def writeData(self, data):
+        self.transport.write(data)
+
+    def loseConnection(self):
+        self.transport.loseConnection()
+
+
+class LoadClient(object):
+
+    def __init__(self, generator, userName):
+        """
+        :param LoadGenerator generator: the generator of the user.
+        :param string userName: the name the user logs in with.
+
+        A simulated user: the clientProxy of its engine.
+
+        .. attribute:: engine
+
+            The client engine of the user, once its socket is open.
+
+        .. attribute:: online
+
+            True from the end of the login to the leave of the system.
+        """
+        self.generator = generator
+        self.userName  = userName
+        self.engine    = None
+        self.online    = False
+        self.gone      = False
+        self.chatCall  = None
+
+    def started(self, engine):
+        """
+        Called with the engine of the user once its socket is open: the
+        user logs in.
+        """
+        self.engine = engine
+        engine.stats = self.generator.stats
+        engine.login(self.userName)
+
+    def startChatting(self):
+        if self.generator.chatting and self.generator.chatRate and self.chatCall is None:
+            self.chatCall = self.generator.clock.callLater(
+                self.generator.random.expovariate(self.generator.chatRate), self.chat)
+
+    def stopChatting(self):
+        if self.chatCall is not None and self.chatCall.active():
+            self.chatCall.cancel()
+        self.chatCall = None
+
+    def chat(self):
+        self.chatCall = None
+        if self.online and self.generator.chatting:
+            self.engine.chat(self.generator.chatMessage())
+            self.generator.stats.chatsSent += 1
+            self.startChatting()
+
+    def leave(self):
+        """
+        Leaves the system once the requests of the user are done.
+        """
+        self.stopChatting()
+        if not self.online:
+            return
+        if (self.engine.waitingAck() or self.engine.msgQueue or
+                self.engine.state == USER_STATES.TO_ROOM_REQUEST_PENDING):
+            self.generator.clock.callLater(0.1, self.leave)
+        else:
+            self.engine.leaveSystem()
+
+    def left(self, rejected=False):
+        if self.gone:
+            return
+        self.gone = True
+        self.stopChatting()
+        self.generator.clientGone(self, rejected)
+        self.online = False
+
+    def connectionLost(self):
+        if not self.gone:
+            self.left()
+
+    def connectionRejectedONE(self, message):
+        moduleLogger.warning('%s rejected: %s', self.userName, message)
+        self.left(rejected=True)
+
+    def initCompleteONE(self, userList, movieList):
+        self.online = True
+        self.generator.loggedIn(self)
+        if movieList and self.generator.random.random() < self.generator.joinRatio:
+            self.engine.joinRoom(self.generator.random.choice(movieList)[0])
+        else:
+            self.startChatting()
+
+    def joinRoomOKONE(self):
+        self.startChatting()
+
+    def userUpdateReceivedONE(self, userName, roomName):
+        pass
+
+    def chatMessageReceivedONE(self, userName, message):
+        self.generator.chatReceived(message)
+
+    def leaveSystemOKONE(self):
+        self.left()
+
+
+class LoadGenerator(object):
+
+    # Seconds given to the users to log in after the ramp up, and to leave
+    # the system after the measured window.
+    loginTimeout = 10
+    leaveTimeout = 10
+
+    def __init__(self, protocol, serverAddress, serverPort, clients=100, rampRate=100,
+                 chatRate=0.2, duration=30, joinRatio=0.5, lossPr=0, messageSize=32,
+                 serverPid=None, metricsAddress=None, userPrefix='load', clock=None,
+                 seed=None):
+        """
+        :param string protocol: 'UDP' or 'TCP'.
+        :param serverAddress: the IP address (or the name) of the server.
+        :param int serverPort: the port number of the server.
+        :param int clients: the number of simulated users.
+        :param float rampRate: the users logging in per second.
+        :param float chatRate: the chat messages sent per second by each
+            user.
+        :param float duration: the measured window, in seconds.
+        :param float joinRatio: the probability for a user to join the
+            room of a movie rather than staying in the main room.
+        :param float lossPr: the packet loss probability for the outgoing
+            datagrams of the users (UDP only).
+        :param int messageSize: the length of the chat messages.
+        :param int serverPid: the process of the server, for its CPU time
+            and memory, or None.
+        :param string metricsAddress: the metrics address of the server
+            (its --metrics option), or None.
+        :param string userPrefix: the user names are userPrefix followed
+            by the number of the user.
+        :param clock: the IReactorTime running the users (the reactor by
+            default, see Simulator for a virtual one).
+        :param seed: the seed of the random choices of the users (rooms,
+            times of the chat messages), or None.
+
+        .. attribute:: stats
+
+            The LoadStats of the users.
+
+        .. attribute:: latencies
+
+            The Reservoir of the delivery latencies of the chat messages
+            received during the measured window, in seconds.
+
+        .. attribute:: report
+
+            The results of the run, a dictionary (see results), once it
+            is done.
+        """
+        self.protocol       = protocol
+        self.serverAddress  = serverAddress
+        self.serverPort     = serverPort
+        self.clientCount    = clients
+        self.rampRate       = rampRate
+        self.chatRate       = chatRate
+        self.duration       = duration
+        self.joinRatio      = joinRatio
+        self.lossPr         = lossPr
+        self.messageSize    = messageSize
+        self.serverPid      = serverPid
+        self.metricsAddress = metricsAddress
+        self.userPrefix     = userPrefix
+        self.clock          = clock if clock is not None else reactor
+        self.random         = random.Random(seed)
+        self.clients        = []
+        self.stats          = LoadStats()
+        self.latencies      = Reservoir(randomGenerator=self.random)
+        self.settled        = 0
+        self.chatting       = True
+        self.measuring      = False
+        self.startCall      = None
+        self.windowStart    = None
+        self.windowEnd      = None
+        self.leaveCall      = None
+        self.report         = None
+
+    def start(self):
+        """
+        Starts the users, rampRate per second.
+        """
+        self.serverAddress = socket.gethostbyname(self.serverAddress)
+        for index in xrange(self.clientCount):
+            client = LoadClient(self, '%s%d' % (self.userPrefix, index))
+            self.clients.append(client)
+            self.clock.callLater(index / float(self.rampRate), self.startClient, client)
+        self.startCall = self.clock.callLater(self.clientCount / float(self.rampRate) +
+                                           self.loginTimeout, self.startWindow)
+
+    def startClient(self, client):
+        if self.protocol == 'UDP':
+            udpProtocol = UdpLoadProtocol(client, (self.serverAddress, self.serverPort),
+                                          self.lossPr)
+            reactor.listenUDP(0, udpProtocol)
+            client.started(udpProtocol.engine)
+        else:
+            creator = ClientCreator(reactor, TcpLoadProtocol, client)
+            connecting = creator.connectTCP(self.serverAddress, self.serverPort)
+            connecting.addCallback(lambda tcpProtocol: client.started(tcpProtocol.engine))
+            connecting.addErrback(self.connectionFailed, client)
+
+    def connectionFailed(self, failure, client):
+        moduleLogger.warning('%s could not connect: %s', client.userName,
+                             failure.getErrorMessage())
+        client.left(rejected=True)
+
+    def loggedIn(self, client):
+        self.stats.logins += 1
+        self.settle()
+
+    def clientGone(self, client, rejected):
+        if rejected:
+            self.stats.rejected += 1
+        elif client.online and not self.leaveCall:
+        #gone before the end of the run: the server is unreachable
+            self.stats.lost += 1
+        if not client.online:
+            self.settle()
+        if self.leaveCall is not None and all(c.gone or not c.online for c in self.clients):
+            self.finish()
+
+    def settle(self):
+        """
+        Counts a user done with its login, successful or not, and starts
+        the measured window when every user is.
+        """
+        self.settled += 1
+        if self.settled == self.clientCount and self.startCall.active():
+            self.startCall.cancel()
+            self.startWindow()
+
+    def chatMessage(self):
+        """
+        Returns a chat message carrying the current time.
+        """
+        message = '%.6f ' % self.clock.seconds()
+        return message + 'x' * max(0, self.messageSize - len(message))
+
+    def chatReceived(self, message):
+        """
+        :param string message: a chat message received by a user.
+        """
+        self.stats.chatsDelivered += 1
+        if self.measuring:
+            try:
+                sentAt = float(message.split(' ', 1)[0])
+            except ValueError:
+            #not sent by a simulated user
+                return
+            self.latencies.add(self.clock.seconds() - sentAt)
+
+    def startWindow(self):
+        moduleLogger.info('%d users logged in, measuring for %s s',
+                          self.stats.logins, self.duration)
+        self.measuring = True
+        self.windowStart = self.sample()
+        self.clock.callLater(self.duration, self.stopWindow)
+
+    def stopWindow(self):
+        self.measuring = False
+        self.chatting = False
+        self.windowEnd = self.sample()
+        self.leaveCall = self.clock.callLater(self.leaveTimeout, self.finish)
+        online = [client for client in self.clients if client.online]
+        if not online:
+            self.finish()
+        for client in online:
+            client.leave()
+
+    def finish(self):
+        if self.report is not None:
+            return
+        if self.leaveCall.active():
+            self.leaveCall.cancel()
+        self.report = self.results()
+        self.stop()
+
+    def stop(self):
+        """
+        Called once the report is ready: stops the reactor.
+        """
+        reactor.stop()
+
+    def sample(self):
+        """
+        Returns the time, the counters, and the CPU time and the metrics of
+        the server (if known), compared by results.
+        """
+        sample = {'time': self.clock.seconds(), 'stats': self.stats.snapshot(),
+                  'cpu': None, 'metrics': None}
+        if self.serverPid is not None:
+            sample['cpu'] = processCpu(self.serverPid)
+        if self.metricsAddress is not None:
+            sample['metrics'] = scrapeMetrics(self.metricsAddress)
+        return sample
+
+    def results(self):
+        """
+        Returns the results of the measured window, as a dictionary.
+        """
+        start, end = self.windowStart, self.windowEnd
+        elapsed = end['time'] - start['time']
+        counts = dict((name, end['stats'][name] - start['stats'][name])
+                      for name in COUNTERS)
+        report = {
+            'protocol': self.protocol,
+            'clients': self.clientCount,
+            'online': start['stats']['logins'] - start['stats']['lost'],
+            'rejected': self.stats.rejected,
+            'lost': self.stats.lost,
+            'lossPr': self.lossPr,
+            'chatRate': self.chatRate,
+            'duration': elapsed,
+            'chatsSent': counts['chatsSent'],
+            'chatsDelivered': counts['chatsDelivered'],
+            'sentPerSecond': counts['chatsSent'] / elapsed if elapsed else 0,
+            'deliveredPerSecond': counts['chatsDelivered'] / elapsed if elapsed else 0,
+            'latencyP50': self.latencies.percentile(50),
+            'latencyP99': self.latencies.percentile(99),
+            'clientRetransmissionRatio': ratio(counts['retransmitted'], counts['requests']),
+            'serverRetransmissionRatio': None,
+            'serverCpu': None,
+            'serverRss': None,
+            'serverPeakRss': None,
+        }
+        if start['metrics'] is not None and end['metrics'] is not None:
+            delta = lambda name: (end['metrics'].get(name, 0) -
+                                  start['metrics'].get(name, 0))
+            report['serverRetransmissionRatio'] = ratio(
+                delta('c2w_messages_retransmitted_total'), delta('c2w_messages_sent_total'))
+        if start['cpu'] is not None and end['cpu'] is not None and elapsed:
+            report['serverCpu'] = (end['cpu'] - start['cpu']) / elapsed
+        if self.serverPid is not None:
+            report['serverRss'], report['serverPeakRss'] = processMemory(self.serverPid)
+        return report
+
+
+def ratio(part, total):
+    return float(part) / total if total else None
+
+
+def processCpu(pid):
+    """
+    Returns the CPU time (user and system) used by the process pid, in
+    seconds, or None if it cannot be read.
+    """
+    try:
+        with open('/proc/%d/stat' % pid) as statFile:
+            fields = statFile.read().rsplit(')', 1)[1].split()
+    except (IOError, IndexError):
+        return None
+    #utime and stime are the fields 14 and 15, the 3rd one follows the name
+    return (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
+
+
+def processMemory(pid):
+    """
+    Returns the resident memory of the process pid and its peak, in bytes
+    (None if they cannot be read).
+    """
+    memory = {}
+    try:
+        with open('/proc/%d/status' % pid) as statusFile:
+            for line in statusFile:
+                name, _, value = line.partition(':')
+                if name in ('VmRSS', 'VmHWM'):
+                    memory[name] = int(value.split()[0]) * 1024
+    except IOError:
+        pass
+    return memory.get('VmRSS'), memory.get('VmHWM')
+
+
+def scrapeMetrics(address):
+    """
+    :param string address: the metrics address of a server, a port number
+        on the loopback interface or the path of a Unix socket (see
+        Metrics.listen).
+
+    Returns a dictionary metric name -> sum of its values over its labels,
+    or None if the metrics cannot be read.
+    """
+    try:
+        if address.isdigit():
+            sock = socket.create_connection(('127.0.0.1', int(address)), 5)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(5)
+            sock.connect(address)
+        try:
+            sock.sendall('GET /metrics HTTP/1.0\r\n\r\n')
+            chunks = []
+            chunk = sock.recv(65536)
+            while chunk:
+                chunks.append(chunk)
+                chunk = sock.recv(65536)
+        finally:
+            sock.close()
+    except socket.error as error:
+        moduleLogger.warning('cannot read the metrics at %s: %s', address, error)
+        return None
+    body = ''.join(chunks).split('\r\n\r\n', 1)[-1]
+    totals = {}
+    for line in body.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            name = name.split('{', 1)[0]
+            totals[name] = totals.get(name, 0) + float(value)
+    return totals
+
+
+def formatReport(report):
+    """
+    Returns the results of a LoadGenerator as lines of text.
+    """
+    def optional(value, scale, unit):
+        return 'n/a' if value is None else '%.2f%s' % (value * scale, unit)
+    return '\n'.join((
+        '%s load: %d users (%d online, %d rejected, %d lost), %.3g chat/s each, loss %.3g' % (
+            report['protocol'], report['clients'], report['online'], report['rejected'],
+            report['lost'], report['chatRate'], report['lossPr']),
+        'window:            %.1f s' % report['duration'],
+        'chat sent:         %d (%.1f msg/s)' % (report['chatsSent'], report['sentPerSecond']),
+        'chat delivered:    %d (%.1f msg/s)' % (report['chatsDelivered'],
+                                                report['deliveredPerSecond']),
+        'latency p50/p99:   %s / %s' % (optional(report['latencyP50'], 1000, ' ms'),
+                                        optional(report['latencyP99'], 1000, ' ms')),
+        'retransmissions:   clients %s, server %s' % (
+            optional(report['clientRetransmissionRatio'], 100, '%'),
+            optional(report['serverRetransmissionRatio'], 100, '%')),
+        'server cpu:        %s' % optional(report['serverCpu'], 100, '%'),
+        'server rss/peak:   %s / %s' % (optional(report['serverRss'], 1.0 / 2 ** 20, ' MiB'),
+                                        optional(report['serverPeakRss'], 1.0 / 2 ** 20, ' MiB')),
+    ))
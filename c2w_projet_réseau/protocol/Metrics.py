@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Metrics of the c2w server, in the Prometheus text format.
+
+The engines count the messages they receive, send, send again, recognize
+as duplicates and drop, per message type, in the Registry of the process
+(registry).  A counter is a slot of a list indexed by the message type,
+so counting costs an increment on the hot path.  The registry also
+observes the number of recipients of each broadcast and the round trip
+times measured on the acknowledgements, in Histograms.
+
+The gauges (users, rooms, queue depths...) are only computed when the
+metrics are read: the objects owning them (the room index, the engines,
+the TCP connections, the timing wheel) are tracked by the registry and
+asked for their metricGauges then.
+
+listen serves the registry over HTTP on a port of the loopback
+interface or on a Unix socket, for a Prometheus server or for curl.
+"""
+import bisect
+import os
+import stat
+import weakref
+from twisted.internet import reactor
+from twisted.web import server, resource
+import Codec
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+# The type field has 5 bits.
+TYPE_COUNT = 32
+
+TYPE_NAMES = dict((getattr(Codec.MSG_TYPES, name), name.lower())
+                  for name in dir(Codec.MSG_TYPES) if name.isupper())
+
+# Recipients of a broadcast.
+FANOUT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+# Round trip times, in seconds.
+RTT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+               0.25, 0.5, 1, 2.5, 5, 10)
+
+COUNTERS = (('sent', 'c2w_messages_sent_total',
+             'Messages sent for the first time, by type.'),
+            ('received', 'c2w_messages_received_total',
+             'Messages received, by type.'),
+            ('retransmitted', 'c2w_messages_retransmitted_total',
+             'Messages sent again because they were not acknowledged in time, by type.'),
+            ('duplicated', 'c2w_messages_duplicated_total',
+             'Messages received again and not handled again, by type.'),
+            ('dropped', 'c2w_messages_dropped_total',
+             'Messages dropped because their recipient did not keep up, by type.'))
+
+GAUGE_HELP = {
+    'c2w_users': 'Users logged in (or logging in).',
+    'c2w_rooms': 'Rooms with at least one user.',
+    'c2w_room_users': 'Users in each room.',
+    'c2w_sessions': 'Client sessions served by this process.',
+    'c2w_queued_messages': 'Messages waiting behind the send windows.',
+    'c2w_inflight_messages': 'Messages sent and waiting for their acknowledgement.',
+    'c2w_deepest_queue': 'Messages queued for the client with the longest queue.',
+    'c2w_outbox_messages': 'Messages waiting for slow TCP clients.',
+    'c2w_outbox_bytes': 'Bytes waiting for slow TCP clients.',
+    'c2w_paused_connections': 'TCP connections whose transport buffer is full.',
+    'c2w_armed_timers': 'Retransmission timers armed.',
+}
+
+
+class Histogram(object):
+    """
+    The distribution of observed values among fixed buckets.
+    """
+    __slots__ = ('bounds', 'counts', 'total', 'count')
+
+    def __init__(self, bounds):
+        """
+        :param bounds: the sorted upper bounds of the buckets; a last
+            bucket holds the values above the last bound.
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total  = 0
+        self.count  = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class Registry(object):
+
+    def __init__(self):
+        """
+        The metrics of a server process.
+
+        .. attribute:: sent, received, retransmitted, duplicated, dropped
+
+            Lists of TYPE_COUNT counters, indexed by message type.
+
+        .. attribute:: fanout
+
+            The Histogram of the number of recipients of the broadcasts.
+
+        .. attribute:: ackRtt
+
+            The Histogram of the round trip times measured on the
+            acknowledgements (Karn's rule: only for the messages sent
+            once).
+
+        .. attribute:: sources
+
+            The objects tracked for their gauges (see track).
+        """
+        self.sent          = [0] * TYPE_COUNT
+        self.received      = [0] * TYPE_COUNT
+        self.retransmitted = [0] * TYPE_COUNT
+        self.duplicated    = [0] * TYPE_COUNT
+        self.dropped       = [0] * TYPE_COUNT
+        self.fanout        = Histogram(FANOUT_BUCKETS)
+        self.ackRtt        = Histogram(RTT_BUCKETS)
+        self.sources       = weakref.WeakSet()
+
+    def track(self, source):
+        """
+        :param source: an object with a metricGauges method, returning
+            the (name, labels, value) of its gauges.  labels is a
+            dictionary or None.
+
+        The gauges of source are read with the metrics, until it is
+        untracked or collected.  The values of the same gauge (and labels)
+        given by several sources are added.
+        """
+        self.sources.add(source)
+
+    def untrack(self, source):
+        """
+        :param source: a tracked source.
+
+        Stops reading the gauges of source.  A source closed while it may
+        still be referenced (by a reference cycle, collected only by the
+        cyclic garbage collector) must be untracked, or its gauges would
+        still be counted.
+        """
+        self.sources.discard(source)
+
+    def gauges(self):
+        """
+        Returns the sorted list of the (name, labels, value) of the
+        gauges of every tracked source, labels being a sorted tuple of
+        (key, value) pairs.
+        """
+        values = {}
+        for source in list(self.sources):
+            for name, labels, value in source.metricGauges():
+                key = (name, tuple(sorted(labels.items())) if labels else ())
+                values[key] = values.get(key, 0) + value
+        return sorted((name, labels, value) for (name, labels), value in values.iteritems())
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for attribute, name, help in COUNTERS:
+            counts = getattr(self, attribute)
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s counter' % name)
+            for msgType, count in enumerate(counts):
+                if count or msgType in TYPE_NAMES:
+                    lines.append('%s{type="%s"} %d' % (name, TYPE_NAMES.get(msgType, msgType), count))
+        renderHistogram(lines, 'c2w_broadcast_recipients',
+                        'Recipients of each notification or chat message broadcast.', self.fanout)
+        renderHistogram(lines, 'c2w_ack_rtt_seconds',
+                        'Round trip times measured on the acknowledgements.', self.ackRtt)
+        lastName = None
+        for name, labels, value in self.gauges():
+            if name != lastName:
+                lines.append('# HELP %s %s' % (name, GAUGE_HELP.get(name, name)))
+                lines.append('# TYPE %s gauge' % name)
+                lastName = name
+            lines.append('%s%s %s' % (name, formatLabels(labels), formatValue(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def renderHistogram(lines, name, help, histogram):
+    """
+    Appends histogram to lines, with cumulative buckets.
+    """
+    lines.append('# HELP %s %s' % (name, help))
+    lines.append('# TYPE %s histogram' % name)
+    cumulated = 0
+    for bound, count in zip(histogram.bounds, histogram.counts):
+        cumulated += count
+        lines.append('%s_bucket{le="%s"} %d' % (name, formatValue(bound), cumulated))
+    lines.append('%s_bucket{le="+Inf"} %d' % (name, histogram.count))
+    lines.append('%s_sum %s' % (name, formatValue(histogram.total)))
+    lines.append('%s_count %d' % (name, histogram.count))
+
+
+def formatLabels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, escape(value)) for key, value in labels)
+
+
+def formatValue(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def escape(value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# The registry of the process.
+registry = Registry()
+
+
+def listen(address, metrics=None):
+    """
+    :param string address: a port number, to listen on the loopback
+        interface, or the path of a Unix socket.
+    :param Registry metrics: the registry served (registry by default).
+
+    Serves the metrics over HTTP with the reactor (GET on any path).
+    Returns the listening port.
+    """
+    site = server.Site(MetricsResource(metrics or registry))
+    site.noisy = False
+    if address.isdigit():
+        return reactor.listenTCP(int(address), site, interface='127.0.0.1')
+    unlinkStaleSocket(address)
+    return reactor.listenUNIX(address, site)
+
+
+def unlinkStaleSocket(path):
+    """
+    Removes the Unix socket left at path by a previous server.
+    """
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.unlink(path)
+
+
+class MetricsResource(resource.Resource):
+    """
+    The twisted.web resource rendering a Registry.
+    """
+    isLeaf = True
+
+    def __init__(self, metrics):
+        resource.Resource.__init__(self)
+        self.metrics = metrics
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', CONTENT_TYPE)
+        return self.metrics.render()
+
+
+def httpResponse(metrics=None):
+    """
+    :param Registry metrics: the registry served (registry by default).
+
+    Returns a complete HTTP/1.0 response carrying the metrics, for the
+    front-ends without twisted.web (see AioServer).
+    """
+    body = (metrics or registry).render()
+    return ('HTTP/1.0 200 OK\r\nContent-Type: %s\r\nContent-Length: %d\r\n'
+            'Connection: close\r\n\r\n%s' % (CONTENT_TYPE, len(body), body))
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Batched UDP socket calls (Linux recvmmsg/sendmmsg) for the c2w UDP server.
+
+A twisted UDP port makes one sendto system call per written datagram and
+one recvfrom per received one.  A room broadcast writes one datagram per
+member, and the acknowledgements of a burst of messages come back
+together, so most of these calls could be grouped.
+
+BatchedPort takes over the write and doRead methods of a listening port:
+
+- write queues the datagram, and every datagram written during the same
+  reactor iteration is sent by one sendmmsg call on the next one;
+- doRead drains the socket with recvmmsg, up to batchSize datagrams per
+  call, and hands them to the protocol one by one as usual.
+
+Everything above the port is unchanged: LossyTransport still drops the
+datagrams it decides to drop before they reach write.  Only IPv4 is
+handled; the datagrams to a host name (not an address) go through the
+original write method.
+"""
+import ctypes
+import ctypes.util
+import errno
+import socket
+import struct
+import sys
+from twisted.internet import reactor
+from twisted.python import log
+
+_libc = None
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+
+class sockaddr_in(ctypes.Structure):
+    # sin_port and sin_addr hold network order bytes
+    _fields_ = [('sin_family', ctypes.c_ushort),
+                ('sin_port', ctypes.c_uint16),
+                ('sin_addr', ctypes.c_uint32),
+                ('sin_zero', ctypes.c_char * 8)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(iovec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr),
+                ('msg_len', ctypes.c_uint)]
+
+
+SOCKADDR_IN = struct.Struct('=H2s4s8x')
+SOCKADDR_IN_SIZE = ctypes.sizeof(sockaddr_in)
+PORT = struct.Struct('!H')
+# Addresses converted to and from struct sockaddr_in, kept for the next
+# datagrams of the same client.
+ADDRESS_CACHE_SIZE = 4096
+
+
+def libc():
+    """
+    Returns the C library with its sendmmsg and recvmmsg prototypes set,
+    or None if it does not provide them (not Linux, or too old).
+    """
+    global _libc
+    if _libc is None:
+        _libc = False
+        if sys.platform.startswith('linux'):
+            try:
+                lib = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+                lib.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr),
+                                         ctypes.c_uint, ctypes.c_int]
+                lib.sendmmsg.restype = ctypes.c_int
+                lib.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr),
+                                         ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+                lib.recvmmsg.restype = ctypes.c_int
+                _libc = lib
+            except (OSError, AttributeError):
+                pass
+    return _libc or None
+
+
+def available(port=None):
+    """
+    :param port: a listening twisted UDP port (optional).
+
+    Returns True if the batched calls can be used (on port if given: it
+    must be an IPv4 port).
+    """
+    if libc() is None:
+        return False
+    return port is None or getattr(port, 'addressFamily', None) == socket.AF_INET
+
+
+def packAddress((host, port)):
+    """
+    Returns the struct sockaddr_in bytes of the IPv4 address (host, port),
+    or None if host is not an IPv4 address.
+    """
+    if host.count('.') != 3:
+        return None
+    try:
+        return SOCKADDR_IN.pack(socket.AF_INET, PORT.pack(port), socket.inet_aton(host))
+    except (socket.error, struct.error, TypeError):
+        return None
+
+
+def unpackAddress(sockaddr):
+    """
+    Returns the (host, port) tuple of the struct sockaddr_in bytes
+    sockaddr.
+    """
+    family, port, host = SOCKADDR_IN.unpack(sockaddr)
+    return (socket.inet_ntoa(host), PORT.unpack(port)[0])
+
+
+class BatchedPort(object):
+
+    def __init__(self, port, batchSize=64, clock=None):
+        """
+        :param port: a listening twisted UDP port (IPv4).
+        :param int batchSize: the maximum number of datagrams per system
+            call.
+        :param clock: the IReactorTime scheduling the flushes (the
+            reactor by default).
+
+        .. attribute:: queue
+
+            The (datagram, address) waiting for the next flush.
+
+        .. attribute:: sendCalls, sent
+
+            The number of sendmmsg calls made and of datagrams they sent.
+
+        .. attribute:: recvCalls, received
+
+            The number of recvmmsg calls that returned datagrams, and of
+            datagrams they returned.
+        """
+        self.port       = port
+        self.batchSize  = batchSize
+        self.clock      = clock if clock is not None else reactor
+        self.libc       = libc()
+        self.portWrite  = None
+        self.portDoRead = None
+        self.queue      = []
+        self.flushCall  = None
+        self.sendCalls  = 0
+        self.sent       = 0
+        self.recvCalls  = 0
+        self.received   = 0
+        self.packed     = {}
+        self.unpacked   = {}
+        # send side: the iovecs and addresses are filled for each batch
+        self.sendIov    = (iovec * batchSize)()
+        self.sendAddrs  = (sockaddr_in * batchSize)()
+        self.sendMsgs   = (mmsghdr * batchSize)()
+        # receive side: maxPacketSize bytes per datagram, in one area
+        size = port.maxPacketSize
+        self.recvArea   = ctypes.create_string_buffer(size * batchSize)
+        self.recvIov    = (iovec * batchSize)()
+        self.recvAddrs  = (sockaddr_in * batchSize)()
+        self.recvMsgs   = (mmsghdr * batchSize)()
+        for i in xrange(batchSize):
+            for iov, addrs, msgs in ((self.sendIov, self.sendAddrs, self.sendMsgs),
+                                     (self.recvIov, self.recvAddrs, self.recvMsgs)):
+                hdr = msgs[i].msg_hdr
+                hdr.msg_name = ctypes.addressof(addrs[i])
+                # the kernel gives back the same length for IPv4 sources
+                hdr.msg_namelen = SOCKADDR_IN_SIZE
+                hdr.msg_iov = ctypes.pointer(iov[i])
+                hdr.msg_iovlen = 1
+            self.recvIov[i].iov_base = ctypes.addressof(self.recvArea) + i * size
+            self.recvIov[i].iov_len = size
+        # the structures are reached through plain lists and buffers,
+        # indexing a ctypes array builds a new object each time
+        self.sendIovs      = [self.sendIov[i] for i in xrange(batchSize)]
+        self.sendAddrPtrs  = [ctypes.addressof(self.sendAddrs[i]) for i in xrange(batchSize)]
+        self.recvData      = buffer(self.recvArea)
+        self.recvNames     = buffer(self.recvAddrs)
+        self.recvSlots     = [(i * size, i * SOCKADDR_IN_SIZE, self.recvMsgs[i])
+                              for i in xrange(batchSize)]
+
+    def install(self):
+        """
+        Takes over the write and doRead methods of the port.
+        """
+        self.portWrite  = self.port.write
+        self.portDoRead = self.port.doRead
+        self.port.write  = self.write
+        self.port.doRead = self.doRead
+
+    def uninstall(self):
+        """
+        Sends what is queued and gives the port its own methods back.
+        """
+        self.flush()
+        del self.port.write
+        del self.port.doRead
+
+    def write(self, datagram, addr=None):
+        """
+        :param string datagram: the datagram to send.
+        :param addr: the (host, port) destination.
+
+        Queues datagram; it is sent with the other datagrams written
+        during this reactor iteration.
+        """
+        sockaddr = self.packed.get(addr) if addr is not None else None
+        if sockaddr is None and addr is not None:
+            sockaddr = packAddress(addr)
+            if sockaddr is not None:
+                if len(self.packed) >= ADDRESS_CACHE_SIZE:
+                    self.packed.clear()
+                self.packed[addr] = sockaddr
+        if sockaddr is None:
+            # keep the order of the datagrams
+            self.flush()
+            if addr is None:
+                return self.portWrite(datagram)
+            return self.portWrite(datagram, addr)
+        self.queue.append((datagram, sockaddr, addr))
+        if self.flushCall is None:
+            self.flushCall = self.clock.callLater(0, self.flush)
+
+    def flush(self):
+        """
+        Sends every queued datagram, batchSize at a time.  What sendmmsg
+        refuses goes through the original write method, which reports
+        the error the usual way.
+        """
+        if self.flushCall is not None and self.flushCall.active():
+            self.flushCall.cancel()
+        self.flushCall = None
+        queue, self.queue = self.queue, []
+        start = 0
+        while start < len(queue):
+            batch = queue[start:start + self.batchSize]
+            sent = self.sendBatch(batch)
+            if sent <= 0:
+                # let the port write (and report) the first one alone
+                datagram, sockaddr, addr = batch[0]
+                try:
+                    self.portWrite(datagram, addr)
+                except Exception:
+                    log.err(None, 'datagram to %s:%s not sent' % addr)
+                sent = 1
+            start += sent
+
+    def sendBatch(self, batch):
+        """
+        :param list batch: at most batchSize queued (datagram, sockaddr,
+            address).
+
+        Sends batch with one sendmmsg call and returns the number of
+        datagrams sent, or -1 on error.
+        """
+        # one buffer for the whole batch, each iovec points into it
+        data = ''.join([datagram for datagram, sockaddr, addr in batch])
+        buf = ctypes.c_char_p(data)
+        offset = ctypes.cast(buf, ctypes.c_void_p).value
+        iovs = self.sendIovs
+        addrPtrs = self.sendAddrPtrs
+        memmove = ctypes.memmove
+        for i, (datagram, sockaddr, addr) in enumerate(batch):
+            iov = iovs[i]
+            iov.iov_base = offset
+            iov.iov_len = len(datagram)
+            offset += len(datagram)
+            memmove(addrPtrs[i], sockaddr, SOCKADDR_IN_SIZE)
+        while True:
+            sent = self.libc.sendmmsg(self.port.fileno(), self.sendMsgs, len(batch), 0)
+            if sent >= 0 or ctypes.get_errno() != errno.EINTR:
+                break
+        if sent > 0:
+            self.sendCalls += 1
+            self.sent += sent
+        return sent
+
+    def doRead(self):
+        """
+        Called **by the reactor** when the socket is readable: receives
+        batches of datagrams until the socket is empty (or enough were
+        read for this iteration) and hands them to the protocol.
+        """
+        protocol = self.port.protocol
+        slots = self.recvSlots
+        unpacked = self.unpacked
+        recvData = self.recvData
+        recvNames = self.recvNames
+        read = 0
+        while read < self.port.maxThroughput:
+            count = self.recvBatch()
+            if count <= 0:
+                return
+            for i in xrange(count):
+                dataOffset, nameOffset, msg = slots[i]
+                data = recvData[dataOffset:dataOffset + msg.msg_len]
+                sockaddr = recvNames[nameOffset:nameOffset + SOCKADDR_IN_SIZE]
+                addr = unpacked.get(sockaddr)
+                if addr is None:
+                    if len(unpacked) >= ADDRESS_CACHE_SIZE:
+                        unpacked.clear()
+                    addr = unpacked[sockaddr] = unpackAddress(sockaddr)
+                read += len(data)
+                try:
+                    protocol.datagramReceived(data, addr)
+                except Exception:
+                    log.err()
+
+    def recvBatch(self):
+        """
+        Receives up to batchSize datagrams with one recvmmsg call and
+        returns their number (0 when there is nothing to read).
+        """
+        while True:
+            count = self.libc.recvmmsg(self.port.fileno(), self.recvMsgs, self.batchSize,
+                                       socket.MSG_DONTWAIT, None)
+            if count >= 0:
+                break
+            no = ctypes.get_errno()
+            if no == errno.EINTR:
+                continue
+            if no in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ECONNREFUSED):
+                # ECONNREFUSED: ICMP error of an earlier send, ignored as
+                # twisted does for unconnected ports
+                return 0
+            raise socket.error(no, 'recvmmsg failed')
+        if count:
+            self.recvCalls += 1
+            self.received += count
+        return count
+
+    def stats(self):
+        """
+        Returns a dictionary with the system call and datagram counts.
+        """
+        return {'sendCalls': self.sendCalls, 'sent': self.sent,
+                'recvCalls': self.recvCalls, 'received': self.received,
+                'queued': len(self.queue)}
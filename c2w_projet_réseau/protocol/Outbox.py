@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Outgoing buffer of the TCP server for the clients that read too slowly.
+
+Each connection of the TCP server is the streaming producer of its
+transport: Twisted pauses it when the transport buffer is full and resumes
+it once the buffer is drained.  While it is paused, the messages for the
+client wait in an Outbox instead of piling up in the transport.
+
+An Outbox has a byte budget.  When it is exceeded and the messages may be
+degraded (the peer does not expect a given sequence of acknowledged
+messages), a notification about a user replaces the one about the same
+user still queued, then the oldest chat messages are dropped.  If the
+budget is still exceeded the owner of the outbox disconnects the client.
+A notification is never replaced across a connection or a departure of
+its user: the peer must see a user leave before seeing them again.
+"""
+from collections import OrderedDict
+import itertools
+import Codec
+
+# Notifications telling the room of a user: only the latest one matters.
+# A user connected notification (type 9) adds the user on the client, it
+# is never replaced.
+COALESCED_TYPES = frozenset((Codec.MSG_TYPES.USER_LEFT_SYSTEM,
+                             Codec.MSG_TYPES.USER_TO_MAIN_ROOM,
+                             Codec.MSG_TYPES.USER_TO_MOVIE_ROOM))
+DROPPABLE_TYPES = frozenset((Codec.MSG_TYPES.CHAT_MESSAGE,))
+# Notifications after which the next one about the same user is queued
+# behind them rather than replacing them.
+BOUNDARY_TYPES = frozenset((Codec.MSG_TYPES.USER_CONNECTED,
+                            Codec.MSG_TYPES.USER_LEFT_SYSTEM))
+
+
+class Outbox(object):
+
+    def __init__(self, budget=64 * 1024, droppedCounts=None):
+        """
+        :param int budget: the number of bytes the outbox may hold.
+        :param list droppedCounts: the counters, indexed by message type,
+            of the messages coalesced or dropped (see Metrics.Registry),
+            or None.
+
+        .. attribute:: messages
+
+            An OrderedDict key -> (msgType, message) of the queued
+            messages, oldest first, the keys being increasing integers.
+
+        .. attribute:: replaceable
+
+            A dictionary userName -> key of the queued notification about
+            the user that a newer one may replace.
+
+        .. attribute:: bufferedBytes
+
+            The number of bytes queued.
+
+        .. attribute:: peakBytes
+
+            The largest number of bytes queued at the same time.
+
+        .. attribute:: coalesced
+
+            The number of notifications replaced by a newer one.
+
+        .. attribute:: dropped
+
+            The number of chat messages dropped.
+        """
+        self.budget        = budget
+        self.messages      = OrderedDict()
+        self.replaceable   = {}
+        self.keys          = itertools.count()
+        self.bufferedBytes = 0
+        self.peakBytes     = 0
+        self.coalesced     = 0
+        self.dropped       = 0
+        self.droppedCounts = droppedCounts
+
+    def __len__(self):
+        return len(self.messages)
+
+    def push(self, message, key=None, lossy=False):
+        """
+        :param string message: a complete message.
+        :param string key: the name of the user a notification is about.
+        :param bool lossy: whether notifications may be coalesced and
+            chat messages dropped.
+
+        Queues message.  Returns False if the outbox is over its budget
+        even after coalescing and dropping what may be: the client does
+        not keep up and should be disconnected.
+        """
+        msgType = Codec.unpackHead(message)[1]
+        messages = self.messages
+        userName = key
+        key = next(self.keys)
+        if lossy and userName is not None and msgType in COALESCED_TYPES:
+            old = messages.pop(self.replaceable.pop(userName, None), None)
+            if old is not None:
+                self.bufferedBytes -= len(old[1])
+                self.coalesced += 1
+                if self.droppedCounts is not None:
+                    self.droppedCounts[old[0]] += 1
+            if msgType not in BOUNDARY_TYPES:
+                self.replaceable[userName] = key
+        elif userName is not None and msgType in BOUNDARY_TYPES:
+            self.replaceable.pop(userName, None)
+        messages[key] = (msgType, message)
+        self.bufferedBytes += len(message)
+        if self.bufferedBytes > self.peakBytes:
+            self.peakBytes = self.bufferedBytes
+        if self.bufferedBytes <= self.budget:
+            return True
+        if lossy:
+            for key, (msgType, message) in messages.items():
+                if msgType in DROPPABLE_TYPES:
+                    del messages[key]
+                    self.bufferedBytes -= len(message)
+                    self.dropped += 1
+                    if self.droppedCounts is not None:
+                        self.droppedCounts[msgType] += 1
+                    if self.bufferedBytes <= self.budget:
+                        return True
+        return False
+
+    def drain(self):
+        """
+        Empties the outbox and returns the list of its messages, in the
+        order they are to be written.
+        """
+        data = [message for msgType, message in self.messages.itervalues()]
+        self.clear()
+        return data
+
+    def clear(self):
+        """
+        Forgets every queued message.
+        """
+        self.messages.clear()
+        self.replaceable.clear()
+        self.bufferedBytes = 0
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of messages and bytes queued,
+        the peak number of bytes, and the coalesced and dropped counts.
+        """
+        return {'messages': len(self.messages),
+                'bytes': self.bufferedBytes,
+                'peakBytes': self.peakBytes,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped}
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+On demand sampling profiler of a running server.
+
+install only sets a signal handler: until the signal comes (SIGUSR1 by
+default, as in ``kill -USR1 <pid>``) the server runs exactly as without
+it.  The signal starts a SamplingProfiler for a bounded window:
+
+- every interval seconds of CPU time (ITIMER_PROF, so an idle server is
+  not sampled) SIGPROF interrupts the server and the stack of the frame
+  it was running is counted;
+- after duration seconds (ITIMER_REAL), after maxSamples samples, or on
+  the same signal again, the timers are stopped and the samples written.
+
+The SIGPROF and SIGALRM handlers stay installed after the window, doing
+nothing: a signal already pending when the window ends would be handed
+to a default handler put back (an int) and fail.
+
+The report is in the folded stacks format of flamegraph.pl (and of
+speedscope, inferno...): one line per distinct stack, its frames from the
+outermost one separated by semicolons, then its number of samples:
+
+    run (base.py:1190);mainLoop (base.py:1199);doPoll (epollreactor.py:235) 42
+
+The profiler samples the main thread, which runs the event loop and the
+signal handlers.
+"""
+import collections
+import logging
+import os
+import signal
+import tempfile
+import time
+
+moduleLogger = logging.getLogger('c2w.protocol.profiler')
+
+
+def frameName(code):
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+class SamplingProfiler(object):
+
+    def __init__(self, interval=0.005, duration=30, maxSamples=100000, directory=None):
+        """
+        :param float interval: the CPU time between two samples, in
+            seconds.
+        :param float duration: the length of the window, in seconds.
+        :param int maxSamples: the number of samples ending the window.
+        :param string directory: where the report is written (the
+            temporary directory by default).
+
+        .. attribute:: stacks
+
+            A dictionary stack -> number of samples, a stack being the
+            tuple of the code objects of its frames, the innermost one
+            first.
+
+        .. attribute:: running
+
+            True during the window.
+
+        .. attribute:: path
+
+            The report of the last window, once written.
+        """
+        self.interval   = interval
+        self.duration   = duration
+        self.maxSamples = maxSamples
+        self.directory  = directory if directory is not None else tempfile.gettempdir()
+        self.stacks     = collections.defaultdict(int)
+        self.samples    = 0
+        self.running    = False
+        self.startTime  = None
+        self.path       = None
+
+    def start(self):
+        """
+        Starts a window of samples.
+        """
+        self.stacks.clear()
+        self.samples = 0
+        self.running = True
+        self.startTime = time.time()
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.signal(signal.SIGALRM, self.timeout)
+        signal.setitimer(signal.ITIMER_REAL, self.duration)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        moduleLogger.warning('profiling for %.0f s', self.duration)
+
+    def sample(self, signum, frame):
+        """
+        The SIGPROF handler: counts the stack of frame.
+        """
+        if not self.running:
+            return
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        self.stacks[tuple(stack)] += 1
+        self.samples += 1
+        if self.samples >= self.maxSamples:
+            self.stop()
+
+    def timeout(self, signum, frame):
+        self.stop()
+
+    def stop(self):
+        """
+        Ends the window and writes the report.
+        """
+        if not self.running:
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        self.running = False
+        self.path = os.path.join(self.directory, 'c2w-profile-%d-%s.folded' % (
+            os.getpid(), time.strftime('%Y%m%d-%H%M%S', time.localtime(self.startTime))))
+        try:
+            with open(self.path, 'w') as report:
+                self.write(report)
+        except (IOError, OSError) as error:
+            moduleLogger.warning('cannot write the profile: %s', error)
+            return
+        moduleLogger.warning('%d samples in %.1f s written to %s', self.samples,
+                             time.time() - self.startTime, self.path)
+
+    def write(self, report):
+        """
+        Writes the samples to the file report in the folded stacks
+        format.
+        """
+        names = {}
+        for stack, count in sorted(self.stacks.iteritems(), key=lambda item: -item[1]):
+            frames = []
+            for code in reversed(stack):
+                name = names.get(code)
+                if name is None:
+                    name = names[code] = frameName(code)
+                frames.append(name)
+            report.write('%s %d\n' % (';'.join(frames), count))
+
+    def toggle(self, signum=None, frame=None):
+        """
+        The handler of the trigger signal: starts a window, or ends the
+        current one.
+        """
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+
+def install(signum=signal.SIGUSR1, **options):
+    """
+    :param int signum: the signal starting (and ending) a window.
+    :param options: the options of SamplingProfiler.
+
+    Makes signum toggle a SamplingProfiler, and returns it.
+    """
+    profiler = SamplingProfiler(**options)
+    signal.signal(signum, profiler.toggle)
+    return profiler
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Replay of a capture (see Capture) against a c2w server.
+
+The messages the clients sent to the captured server are sent again to a
+server, each client of the capture from its own socket, at the pace they
+were captured (speed 1), faster or slower (another speed), or as fast as
+possible (speed None).  A TCP client is connected at its first message and
+disconnected where its connection was closed.
+
+The replay is open loop: the replayer does not answer the server, the
+acknowledgements sent are the captured ones.  The messages of the server
+are only counted, to be compared with the captured ones.  The load shape
+of the capture (who sends what, when) is reproduced to be measured or
+profiled offline; a server that numbers its messages like the captured
+one did sees the acknowledgements it expects.
+"""
+import socket
+from twisted.internet import reactor
+from twisted.internet.protocol import DatagramProtocol, Protocol, ClientFactory
+import Capture
+
+COUNTERS = ('records', 'sent', 'sentBytes', 'received', 'receivedBytes', 'captured',
+            'capturedBytes', 'clients', 'failed')
+
+
+class ReplayDatagramProtocol(DatagramProtocol):
+
+    def __init__(self, replayer):
+        self.replayer = replayer
+
+    def datagramReceived(self, datagram, address):
+        self.replayer.received(datagram)
+
+
+class ReplayStreamProtocol(Protocol):
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def connectionMade(self):
+        self.connection.connected(self.transport)
+
+    def dataReceived(self, data):
+        self.connection.replayer.received(data)
+
+    def connectionLost(self, reason):
+        self.connection.transport = None
+
+
+class ReplayConnection(ClientFactory):
+
+    def __init__(self, replayer):
+        """
+        :param Replayer replayer: the replay of the connection.
+
+        The TCP connection of a client of the capture.  The messages
+        written before it is made wait in pending.
+        """
+        self.replayer  = replayer
+        self.transport = None
+        self.pending   = []
+        self.closing   = False
+
+    def buildProtocol(self, address):
+        return ReplayStreamProtocol(self)
+
+    def clientConnectionFailed(self, connector, reason):
+        self.replayer.stats['failed'] += 1
+        self.pending = []
+
+    def connected(self, transport):
+        self.transport = transport
+        if self.pending:
+            transport.writeSequence(self.pending)
+            self.pending = []
+        if self.closing:
+            transport.loseConnection()
+
+    def write(self, data):
+        if self.transport is not None:
+            self.transport.write(data)
+        else:
+            self.pending.append(data)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.loseConnection()
+        else:
+            self.closing = True
+
+
+class Replayer(object):
+
+    # Records sent per turn of the reactor as fast as possible, so that
+    # the answers of the server are read in between.
+    batchSize = 256
+
+    def __init__(self, path, serverAddress, serverPort, speed=1.0, linger=2.0, clock=None):
+        """
+        :param string path: the capture file.
+        :param serverAddress: the IP address (or the name) of the server.
+        :param int serverPort: the port number of the server.
+        :param float speed: the replay speed, 1 for the captured pace,
+            None for as fast as possible.
+        :param float linger: how long the answers of the server are still
+            counted after the last message, in seconds.
+        :param clock: the IReactorTime pacing the replay (the reactor by
+            default).
+
+        .. attribute:: stats
+
+            A dictionary of counters: the records of the capture, the
+            messages and bytes sent, received and captured (sent by the
+            captured server), the clients and the failed connections.
+
+        .. attribute:: report
+
+            The stats with the duration of the replay, once it is done.
+        """
+        self.reader        = Capture.Reader(path)
+        self.protocol      = self.reader.protocol
+        self.serverAddress = serverAddress
+        self.serverPort    = serverPort
+        self.speed         = speed
+        self.linger        = linger
+        self.clock         = clock if clock is not None else reactor
+        self.stats         = dict.fromkeys(COUNTERS, 0)
+        self.clients       = {}
+        self.records       = None
+        self.nextRecord    = None
+        self.firstTime     = None
+        self.startTime     = None
+        self.report        = None
+
+    def start(self):
+        """
+        Starts sending the messages of the capture.
+        """
+        self.serverAddress = socket.gethostbyname(self.serverAddress)
+        self.records = iter(self.reader)
+        self.nextRecord = next(self.records, None)
+        if self.nextRecord is not None:
+            self.firstTime = self.nextRecord[0]
+        self.startTime = self.clock.seconds()
+        self.pump()
+
+    def pump(self):
+        """
+        Sends the records due, then schedules the next call.
+        """
+        if self.speed is None:
+            count = 0
+            while self.nextRecord is not None and count < self.batchSize:
+                self.replay(self.nextRecord)
+                self.nextRecord = next(self.records, None)
+                count += 1
+            delay = 0
+        else:
+            replayTime = self.firstTime + (self.clock.seconds() - self.startTime) * self.speed
+            while self.nextRecord is not None and self.nextRecord[0] <= replayTime:
+                self.replay(self.nextRecord)
+                self.nextRecord = next(self.records, None)
+            if self.nextRecord is not None:
+                delay = (self.nextRecord[0] - replayTime) / self.speed
+        if self.nextRecord is None:
+            self.clock.callLater(self.linger, self.finish)
+        else:
+            self.clock.callLater(delay, self.pump)
+
+    def replay(self, record):
+        """
+        :param tuple record: a (time, direction, peer, data) record.
+
+        Sends a message of a client, or closes its connection.
+        """
+        timestamp, direction, peer, data = record
+        stats = self.stats
+        stats['records'] += 1
+        if direction == Capture.OUTBOUND:
+            stats['captured'] += 1
+            stats['capturedBytes'] += len(data)
+            return
+        client = self.clients.get(peer)
+        if direction == Capture.CLOSED:
+            if client is not None:
+                client.close()
+                del self.clients[peer]
+            return
+        if client is None:
+            client = self.clients[peer] = self.newClient()
+            stats['clients'] += 1
+        stats['sent'] += 1
+        stats['sentBytes'] += len(data)
+        if self.protocol == 'UDP':
+            client.write(data, (self.serverAddress, self.serverPort))
+        else:
+            client.write(data)
+
+    def newClient(self):
+        """
+        Returns the UDP port or the ReplayConnection of a new client.
+        """
+        if self.protocol == 'UDP':
+            return reactor.listenUDP(0, ReplayDatagramProtocol(self))
+        connection = ReplayConnection(self)
+        reactor.connectTCP(self.serverAddress, self.serverPort, connection)
+        return connection
+
+    def received(self, data):
+        self.stats['received'] += 1
+        self.stats['receivedBytes'] += len(data)
+
+    def finish(self):
+        """
+        Closes the clients and makes the report.
+        """
+        for client in self.clients.values():
+            if self.protocol == 'UDP':
+                client.stopListening()
+            else:
+                client.close()
+        self.clients.clear()
+        self.report = dict(self.stats, protocol=self.protocol,
+                           duration=self.clock.seconds() - self.startTime - self.linger)
+        self.stop()
+
+    def stop(self):
+        """
+        Called once the report is ready: stops the reactor.
+        """
+        reactor.stop()
+
+
+def formatReport(report):
+    """
+    Returns the report of a Replayer as text.
+    """
+    duration = report['duration']
+    rate = report['sent'] / duration if duration > 0 else 0
+    lines = ['%s replay: %d records, %d clients (%d failed connections)' % (
+                 report['protocol'], report['records'], report['clients'], report['failed']),
+             'duration:          %.1f s' % duration,
+             'sent:              %d messages, %d bytes (%.1f msg/s)' % (
+                 report['sent'], report['sentBytes'], rate),
+             'received:          %d %s, %d bytes' % (
+                 report['received'], 'datagrams' if report['protocol'] == 'UDP' else 'reads',
+                 report['receivedBytes']),
+             'captured answers:  %d messages, %d bytes' % (
+                 report['captured'], report['capturedBytes'])]
+    return '\n'.join(lines)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Room membership index of the c2w server.
+
+The user store of the serverProxy only knows how to list every user, so
+routing a chat message meant scanning all the users of the server.  The
+RoomIndexedServerProxy wraps the serverProxy, forwards every call to it
+and keeps, next to it, the members of each room up to date on addUser,
+updateUserChatroom and removeUser.
+
+It also keeps the encoded bodies of the user list and of the movie list:
+the movie list never changes and is packed once, the user list is packed
+again only when its version changed since the last login.
+"""
+import weakref
+from collections import OrderedDict
+from c2w.main.constants import ROOM_IDS
+import Codec
+
+# One index per serverProxy: the TCP server builds one protocol instance
+# per connection and they must all share the same index.
+_indexes = weakref.WeakKeyDictionary()
+
+
+def indexedServerProxy(serverProxy):
+    """
+    :param serverProxy: the serverProxy given to the protocol.
+
+    Returns the RoomIndexedServerProxy wrapping serverProxy, creating it
+    the first time.
+    """
+    if isinstance(serverProxy, RoomIndexedServerProxy):
+        return serverProxy
+    index = _indexes.get(serverProxy)
+    if index is None:
+        index = RoomIndexedServerProxy(serverProxy)
+        _indexes[serverProxy] = index
+    return index
+
+
+class RoomIndexedServerProxy(object):
+
+    def __init__(self, serverProxy):
+        """
+        :param serverProxy: the serverProxy to wrap.
+
+        .. attribute:: serverProxy
+
+            The wrapped serverProxy.  Every method not defined here is
+            forwarded to it.
+
+        .. attribute:: rooms
+
+            A dictionary room -> OrderedDict(userName -> user).
+
+        .. attribute:: userRooms
+
+            A dictionary userName -> room, used to find the room a user
+            leaves.
+
+        .. attribute:: version
+
+            Incremented each time a user joins, leaves or changes room.
+
+        .. attribute:: movieIds
+
+            A dictionary movieTitle -> movieId.
+        """
+        self.serverProxy      = serverProxy
+        self.rooms            = {}
+        self.userRooms        = {}
+        self.version          = 0
+        self.userListVersion  = None
+        self.userListCache    = None
+        movies = serverProxy.getMovieList()
+        self.movieIds         = dict((movie.movieTitle, movie.movieId) for movie in movies)
+        self.movieListCache   = Codec.movieListBody(
+            [(movie.movieId, movie.movieIpAddress, movie.moviePort, movie.movieTitle)
+             for movie in movies])
+        for user in serverProxy.getUserList():
+            self.indexUser(user, user.userChatRoom)
+
+    def __getattr__(self, name):
+        return getattr(self.serverProxy, name)
+
+    def indexUser(self, user, room):
+        """
+        :param c2wUser user: the user to (re)index.
+        :param room: the room user is now in.
+        """
+        oldRoom = self.userRooms.get(user.userName)
+        if oldRoom is not None:
+            self.unindexUser(user.userName)
+        members = self.rooms.get(room)
+        if members is None:
+            members = self.rooms[room] = OrderedDict()
+        members[user.userName] = user
+        self.userRooms[user.userName] = room
+        self.version += 1
+
+    def unindexUser(self, userName):
+        """
+        :param string userName: the user to forget.
+        """
+        room = self.userRooms.pop(userName, None)
+        if room is None:
+            return
+        members = self.rooms[room]
+        del members[userName]
+        if not members:
+            del self.rooms[room]
+        self.version += 1
+
+    def addUser(self, userName, userChatRoom, userChatInstance=None, userAddress=None):
+        """
+        Same as serverProxy.addUser, the new user is indexed in
+        userChatRoom.
+        """
+        result = self.serverProxy.addUser(userName, userChatRoom,
+                                          userChatInstance, userAddress)
+        user = self.serverProxy.getUserByAddress(userAddress)
+        if user is not None:
+            self.indexUser(user, userChatRoom)
+        return result
+
+    def updateUserChatroom(self, userName, userChatRoom):
+        """
+        Same as serverProxy.updateUserChatroom, the user is moved to
+        userChatRoom in the index.
+        """
+        oldRoom = self.userRooms.get(userName)
+        result = self.serverProxy.updateUserChatroom(userName, userChatRoom)
+        if oldRoom is not None:
+            user = self.rooms[oldRoom][userName]
+            self.indexUser(user, userChatRoom)
+        return result
+
+    def removeUser(self, userName):
+        """
+        Same as serverProxy.removeUser, the user is removed from the index.
+        """
+        self.unindexUser(userName)
+        return self.serverProxy.removeUser(userName)
+
+    def getRoomMembers(self, *rooms):
+        """
+        :param rooms: one or several rooms.
+
+        Returns the list of the users currently in one of rooms.  The cost
+        only depends on the size of those rooms.
+        """
+        if len(rooms) == 1:
+            members = self.rooms.get(rooms[0])
+            return members.values() if members else []
+        users = []
+        for room in rooms:
+            members = self.rooms.get(room)
+            if members:
+                users.extend(members.itervalues())
+        return users
+
+    def metricGauges(self):
+        """
+        Returns the (name, labels, value) of the user and room gauges
+        (see Metrics.Registry.track).
+        """
+        gauges = [('c2w_users', None, len(self.userRooms)),
+                  ('c2w_rooms', None, len(self.rooms))]
+        for room, members in self.rooms.iteritems():
+            gauges.append(('c2w_room_users', {'room': room}, len(members)))
+        return gauges
+
+    def getRoomSize(self, room):
+        """
+        :param room: a room.
+
+        Returns the number of users in room.
+        """
+        members = self.rooms.get(room)
+        return len(members) if members else 0
+
+    def getRoomMovieId(self, room):
+        """
+        :param room: a room.
+
+        Returns the movieId sent on the wire for room: 0 for the main room
+        and out of the system, the id of the movie otherwise.
+        """
+        if room in (ROOM_IDS.MAIN_ROOM, ROOM_IDS.OUT_OF_THE_SYSTEM_ROOM):
+            return 0
+        return self.movieIds[room]
+
+    def userListBody(self):
+        """
+        Returns the encoded body of the user list message (see
+        Codec.userListBody).  It is only rebuilt when a user joined, left
+        or changed room since the previous call.
+        """
+        if self.userListVersion != self.version:
+            self.userListCache = Codec.userListBody(
+                [(self.getRoomMovieId(user.userChatRoom), user.userName)
+                 for user in self.serverProxy.getUserList()])
+            self.userListVersion = self.version
+        return self.userListCache
+
+    def movieListBody(self):
+        """
+        Returns the encoded body of the movie list message (see
+        Codec.movieListBody), packed once when the index is built.
+        """
+        return self.movieListCache
@@ -0,0 +1,1185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Transport independent engine of the c2w server.
+
+The engines hold everything the server does with the messages: the
+state machine of the login, the handling of the requests, the
+construction of the messages and their reliable delivery.  They do no
+I/O of their own:
+
+- the bytes received are handed to them (datagramReceived for a
+  datagram of a client, dataReceived for a piece of a TCP stream);
+- the bytes to send go through the write function given to them;
+- the time comes from the clock given to them (an IReactorTime, the
+  reactor by default): the timers are armed on the TimingWheel of that
+  clock and the timestamps are read from clock.seconds().
+
+The twisted protocols (udp_chat_server, tcp_chat_server) are thin
+adapters wiring an engine to their transport.  Any event loop providing
+callLater and seconds can drive an engine the same way, and a
+twisted.internet.task.Clock runs it on a virtual clock, for a test or a
+benchmark.
+
+ServerEngine handles the requests the same way for both transports:
+
+- DatagramServerEngine serves every client of a UDP port, each one with
+  its own send window (see Arq);
+- StreamServerEngine serves the client of one TCP connection, one message
+  at a time, or without any acknowledgement once the reliable transport
+  mode is negotiated.
+"""
+import collections
+import functools
+import logging
+from twisted.internet import reactor
+import Tools
+import Codec
+import RoomIndex
+import Arq
+import Framer
+import TimingWheel
+import Capture
+import Trace
+import Metrics
+from c2w.main.constants import ROOM_IDS
+
+moduleLogger = logging.getLogger('c2w.protocol.server_engine')
+
+
+class ServerEngine(object):
+
+    # The movieId field of the notification of a user leaving the system.
+    leftMovieId       = 0
+    # Notify the user joining a room of his own move as well.
+    notifyJoiningUser = False
+    # The userChatInstance given to the serverProxy for the users added.
+    chatInstance      = None
+    # The Metrics.Registry counting the messages.
+    metrics           = Metrics.registry
+
+    def __init__(self, serverProxy, clock=None, cluster=None):
+        """
+        :param serverProxy: the serverProxy of the user and movie store.
+        :param clock: the IReactorTime giving the time and running the
+            timers (the reactor by default).
+        :param cluster: the Cluster.Worker or Sharding.Node the server
+            belongs to, or None.
+
+        .. attribute:: serverProxy
+
+            The serverProxy, wrapped in a RoomIndexedServerProxy so the
+            members of a room can be found without scanning every user,
+            and in the proxy of the cluster sharing the users with the
+            other workers or nodes when cluster is set.
+
+        .. attribute:: timerWheel
+
+            The TimingWheel of clock, shared by all the engines using
+            it, on which the retransmission timers are armed.
+
+        The engine, its room index and its timing wheel are tracked by
+        metrics for their gauges (see metricGauges).
+        """
+        self.clock       = clock if clock is not None else reactor
+        self.timerWheel  = TimingWheel.getWheel(self.clock)
+        self.cluster     = cluster
+        self.serverProxy = RoomIndex.indexedServerProxy(serverProxy)
+        self.metrics.track(self)
+        self.metrics.track(self.serverProxy)
+        self.metrics.track(self.timerWheel)
+        if(cluster is not None):
+            self.serverProxy = cluster.attach(self, self.serverProxy)
+
+    # What the transport specific engines provide.
+
+    def metricGauges(self):
+        """
+        Returns the (name, labels, value) of the gauges of the engine
+        (see Metrics.Registry.track).
+        """
+        return ()
+
+    def getUserState(self, address):
+        """
+        Returns the state of the user of the client at address.
+        """
+        raise NotImplementedError
+
+    def setUserState(self, address, userState):
+        """
+        Sets the state of the user of the client at address.
+        """
+        raise NotImplementedError
+
+    def sendReliable(self, address, msgType, msgBody=''):
+        """
+        Sends a message to the client at address, until it is delivered.
+        """
+        raise NotImplementedError
+
+    def deliverNotification(self, user, otherUser, notification):
+        """
+        Sends the notification (msgType, msgBody) about user to otherUser.
+        """
+        raise NotImplementedError
+
+    def deliverChatMessage(self, user, chatMessage, otherUser, msgBody):
+        """
+        Sends the chat message of user, encoded as msgBody, to otherUser.
+        """
+        raise NotImplementedError
+
+    def requestReceived(self, address, msgType, datagram):
+        """
+        :param address: the address of the client.
+        :param int msgType: the message Type field.
+        :param string datagram: the request, already acknowledged.
+
+        Handles a request of a client: a login, or a join room, leave
+        system or chat request from a logged in client.
+        """
+        if(msgType == 1):
+            userName, = Codec.decodeLogin(datagram)
+            self.loginRequested(address, userName, datagram)
+            return
+        if(msgType not in (2, 3, 13)):
+            return
+        user = self.serverProxy.getUserByAddress(address)
+        if(user is None):
+        #request from a client that is not logged in
+            return
+        if(msgType == 3):
+            movieId, = Codec.decodeJoinRoom(datagram)
+            self.joinRequested(user, movieId)
+        elif(msgType == 2):
+            self.leaveRequested(user)
+        else:
+            chatMessage, = Codec.decodeChatRequest(datagram)
+            self.chatRequested(user, chatMessage)
+
+    def loginRequested(self, address, userName, datagram):
+        """
+        :param address: the address of the client.
+        :param string userName: the user name asked for.
+        :param string datagram: the login request.
+
+        Rejects the login if the user name is taken, otherwise adds the
+        user out of the system and sends the login ok.
+        """
+        if(Trace.enabled):
+            moduleLogger.debug('<-----login request received')
+            moduleLogger.debug('----->ack message sent')
+        if(self.serverProxy.userExists(userName)):
+        #If user name not available send login rejected
+            self.setUserState(address, Tools.USER_STATES.CORRECT_USERNAME_PENDING)
+            self.sendReliable(address, 6)
+            if(Trace.enabled):
+                moduleLogger.debug('----->login reject sent')
+        else:
+        #Else send login ok and add the user in data bases
+            self.serverProxy.addUser(userName, ROOM_IDS.OUT_OF_THE_SYSTEM_ROOM,
+                                     self.chatInstance, address)
+            self.loginAccepted(address, datagram)
+            self.setUserState(address, Tools.USER_STATES.LOGIN_OK_PENDING)
+            self.sendReliable(address, 5)
+            if(Trace.enabled):
+                moduleLogger.debug('----->login ok sent')
+
+    def loginAccepted(self, address, datagram):
+        """
+        :param address: the address of the client.
+        :param string datagram: the login request.
+
+        Called right before the login ok is sent, to negotiate what the
+        login request offers.
+        """
+
+    def loginStepDone(self, address):
+        """
+        :param address: the address of the client.
+
+        Called when a message of the login has been delivered: the login
+        goes on with the next message (user list, movie list, then the
+        notification of the other users).  A room joined before the end of
+        the login is kept: the user is announced in the main room, then
+        moved to it.
+        """
+        userState = self.getUserState(address)
+        if(userState is Tools.USER_STATES.LOGIN_OK_PENDING):
+        #Login ok delivered
+            if(Trace.enabled):
+                moduleLogger.debug('----->user list sent')
+            self.setUserState(address, Tools.USER_STATES.USER_LIST_PENDING)
+            self.sendReliable(address, 7, self.serverProxy.userListBody())
+
+        elif(userState is Tools.USER_STATES.USER_LIST_PENDING):
+        #User list delivered
+            if(Trace.enabled):
+                moduleLogger.debug('----->movie list sent')
+            self.setUserState(address, Tools.USER_STATES.MOVIE_LIST_PENDING)
+            self.sendReliable(address, 8, self.serverProxy.movieListBody())
+
+        elif(userState is Tools.USER_STATES.MOVIE_LIST_PENDING):
+        #Movie list delivered (intialization step complete)
+            self.setUserState(address, Tools.USER_STATES.INITIALAZATION_COMPLETE)
+            user = self.serverProxy.getUserByAddress(address)
+            joinedRoom = user.userChatRoom
+            #update the user statu
+            self.serverProxy.updateUserChatroom(user.userName, ROOM_IDS.MAIN_ROOM)
+            #notify the other users so that user appear in main room
+            self.broadcastNotification(user, [otherUser for otherUser in self.serverProxy.getUserList()
+                                              if otherUser is not user])
+            self.setUserState(address, Tools.USER_STATES.IN_ROOM)
+            if(joinedRoom not in (ROOM_IDS.OUT_OF_THE_SYSTEM_ROOM, ROOM_IDS.MAIN_ROOM)):
+            #the join overtook the acknowledgement of the movie list: the
+            #user goes to his room once the other users know him
+                self.serverProxy.updateUserChatroom(user.userName, joinedRoom)
+                self.broadcastNotification(user, [otherUser for otherUser in self.serverProxy.getUserList()
+                                                  if otherUser is not user])
+
+    def joinRequested(self, user, movieId):
+        """
+        :param c2wUser user: the user asking to change room.
+        :param int movieId: the movie of the room, 0 for the main room.
+        """
+        if(Trace.enabled):
+            moduleLogger.debug('<-----join room received')
+            moduleLogger.debug('----->ack message sent')
+        if(movieId == 0):
+            movieRoom = ROOM_IDS.MAIN_ROOM
+        else:
+            movieRoom = self.serverProxy.getMovieById(movieId).movieTitle
+            self.serverProxy.startStreamingMovie(movieRoom)
+        self.serverProxy.updateUserChatroom(user.userName, movieRoom)
+        if(self.getUserState(user.userAddress) is not Tools.USER_STATES.IN_ROOM):
+        #the join overtook the end of the login, which announces the user
+        #in his room (see loginStepDone)
+            return
+        #send notification to the users
+        if(self.notifyJoiningUser):
+            recipients = self.serverProxy.getUserList()
+        else:
+            recipients = [otherUser for otherUser in self.serverProxy.getUserList()
+                          if otherUser is not user]
+        self.broadcastNotification(user, recipients)
+
+    def leaveRequested(self, user):
+        """
+        :param c2wUser user: the user leaving the system.
+        """
+        if(Trace.enabled):
+            moduleLogger.debug('<-----leave message received')
+            moduleLogger.debug('----->ack message sent')
+        self.serverProxy.updateUserChatroom(user.userName, ROOM_IDS.OUT_OF_THE_SYSTEM_ROOM)
+        #send notification to the users
+        self.broadcastNotification(user, [otherUser for otherUser in self.serverProxy.getUserList()
+                                          if otherUser is not user])
+        #remove user from databases
+        self.sessionClosed(user.userAddress)
+        self.removeUser(user)
+
+    def chatRequested(self, user, chatMessage):
+        """
+        :param c2wUser user: the user sending the message.
+        :param string chatMessage: the chat message.
+        """
+        if(Trace.enabled):
+            moduleLogger.debug('<-----chat message received from %s', user.userName)
+            moduleLogger.debug('----->ack message sent')
+        #broadcast the message in the user chatroom
+        self.broadcastChatMessage(user, chatMessage,
+                                  [otherUser for otherUser in self.serverProxy.getRoomMembers(user.userChatRoom)
+                                   if otherUser is not user])
+
+    def userGone(self, user, reason):
+        """
+        :param c2wUser user: a user who did not leave the system properly.
+        :param string reason: why, for the log.
+
+        Notifies the other users as if user had left the system, and
+        removes him from the databases.
+        """
+        moduleLogger.info('-----X%s %s', user.userName, reason)
+        if(user.userChatRoom is not ROOM_IDS.OUT_OF_THE_SYSTEM_ROOM):
+            self.serverProxy.updateUserChatroom(user.userName, ROOM_IDS.OUT_OF_THE_SYSTEM_ROOM)
+            self.broadcastNotification(user, [otherUser for otherUser in self.serverProxy.getUserList()
+                                              if otherUser is not user])
+        self.removeUser(user)
+
+    def removeUser(self, user):
+        """
+        :param c2wUser user: a user leaving the system.
+
+        Removes user from the databases, unless he is already gone: a
+        broadcast about him can evict another user whose own broadcast
+        evicts him.
+        """
+        if(self.serverProxy.getUserByAddress(user.userAddress) is user):
+            self.serverProxy.removeUser(user.userName)
+
+    def sessionClosed(self, address):
+        """
+        :param address: the address of a client leaving the system.
+
+        Called before the user of the client is removed.
+        """
+
+    def notificationBody(self, user):
+        """
+        :param c2wUser user : the user whose new room is notified.
+
+        Returns the (msgType, msgBody) tuple of the notification telling
+        where user is now.  The body does not depend on the recipient, so
+        it is built once per broadcast.
+        """
+        if(user.userChatRoom is ROOM_IDS.MAIN_ROOM):
+            if(self.getUserState(user.userAddress) is Tools.USER_STATES.INITIALAZATION_COMPLETE):
+                msgType = 9
+            else:
+                msgType = 11
+            movieId = 0
+        elif(user.userChatRoom is ROOM_IDS.OUT_OF_THE_SYSTEM_ROOM):
+            msgType = 10
+            movieId = self.leftMovieId
+        else:
+            msgType = 12
+            movieId = self.serverProxy.getRoomMovieId(user.userChatRoom)
+        return (msgType, Codec.notificationBody(movieId, user.userName))
+
+    def broadcastNotification(self, user, recipients):
+        """
+        :param c2wUser user   : the user whose new room is notified.
+        :param list recipients: the users to notify.
+
+        Sends the notification of user to every recipient.  The message
+        body is encoded once, only the header is written per recipient.
+        """
+        notification = self.notificationBody(user)
+        self.metrics.fanout.observe(len(recipients))
+        traced = Trace.enabled
+        for otherUser in recipients:
+            self.deliverNotification(user, otherUser, notification)
+            if(traced):
+                moduleLogger.debug('----->notification message sent to %s', otherUser.userName)
+
+    def broadcastChatMessage(self, user, chatMessage, recipients):
+        """
+        :param c2wUser user       : the message transmitter.
+        :param string chatMessage : the chat message.
+        :param list recipients    : the users receiving the message.
+
+        Sends the chat message of user to every recipient.  The message
+        body is encoded once, only the header is written per recipient.
+        """
+        msgBody = Codec.chatMessageBody(user.userName, chatMessage)
+        self.metrics.fanout.observe(len(recipients))
+        traced = Trace.enabled
+        for otherUser in recipients:
+            self.deliverChatMessage(user, chatMessage, otherUser, msgBody)
+            if(traced):
+                moduleLogger.debug('----->chat message sent to %s', otherUser.userName)
+
+
+class DatagramServerEngine(ServerEngine):
+
+    # Maximum number of messages in flight towards each client.
+    sendWindowSize    = 8
+    # Accept the cumulative acknowledgements offered by the clients.
+    cumulativeAcks    = True
+    # Number of tries per message before the client is considered as gone.
+    maxTries          = 10
+    # Maximum number of messages queued behind the send window of a client.
+    maxQueueLength    = 64
+    # Messages that may be dropped when the queue of a client is full.
+    droppableTypes    = frozenset((Codec.MSG_TYPES.CHAT_MESSAGE,))
+    leftMovieId       = 1
+    notifyJoiningUser = True
+
+    def __init__(self, serverProxy, write, clock=None, cluster=None):
+        """
+        :param serverProxy: the serverProxy of the user and movie store.
+        :param write: the function sending a datagram, called with the
+            datagram and the (host, port) address of the client.
+        :param clock: the IReactorTime giving the time and running the
+            timers (the reactor by default).
+        :param cluster: the Cluster.Worker or Sharding.Node the server
+            belongs to, or None.
+
+        The engine of the UDP server: every client of the port is served
+        by the same engine.
+
+        .. attribute:: sendWindow
+
+            A dictionary userAddress -> Arq.SendWindow.  Each client has
+            its own sequence numbers and its own window: up to
+            sendWindowSize messages wait for their acknowledgement at the
+            same time, each one with its own retransmission timer.  The
+            window also holds the RTT estimator giving the
+            retransmission timeout of the client.  Behind the window at
+            most maxQueueLength messages wait their turn: when the queue
+            is full the oldest chat message is dropped, and a client
+            whose queue is full of messages that cannot be dropped is
+            evicted.
+
+        .. attribute:: droppedCount
+
+            The number of messages dropped because the queue of their
+            recipient was full (see queueStats).
+
+        .. attribute:: ackCoalescer
+
+            A dictionary userAddress -> Arq.AckCoalescer, for the clients
+            that negotiated cumulative acknowledgements at login.  Their
+            messages are acknowledged with a delay, several at a time, or
+            by a trailer on the next message sent to them.
+
+        .. attribute:: receiveFilter
+
+            A dictionary userAddress -> Arq.DuplicateFilter, recognizing
+            the messages sent again by a client whose acknowledgement was
+            lost.  They are acknowledged again but not handled again.
+
+        .. attribute:: duplicateCount
+
+            The number of messages recognized as duplicates.
+
+        .. attribute:: userState
+
+            A dictionary userAddress -> state of the user, mainly used to
+            react correctly to the acknowledgements.
+
+        .. attribute:: evictions
+
+            While a user is evicted, the list of the addresses of the
+            users evicted by the notification of his departure, evicted
+            after him; None otherwise.
+        """
+        ServerEngine.__init__(self, serverProxy, clock, cluster)
+        if(Capture.recorder is not None):
+            write = Capture.recorder.recordingWrite(write)
+        self.write          = write
+        self.sendWindow     = {}
+        self.ackCoalescer   = {}
+        self.receiveFilter  = {}
+        self.duplicateCount = 0
+        self.droppedCount   = 0
+        self.userState      = {}
+        self.evictions      = None
+
+    def getUserState(self, userAdrs):
+        return self.userState.get(userAdrs)
+
+    def setUserState(self, userAdrs, userState):
+        self.userState[userAdrs] = userState
+
+    def datagramReceived(self, datagram, address):
+        """
+        :param string datagram: the payload of the UDP packet.
+        :param address: the (host, port) address of the source.
+
+        Handles a datagram of a client.  With several workers, a datagram
+        from a client of another worker is forwarded to it.
+        """
+        if(self.cluster is not None and not self.cluster.owns(address)):
+        #the client belongs to another worker
+            self.cluster.forwardDatagram(address, datagram)
+            return
+        if(Capture.recorder is not None):
+            Capture.recorder.record(Capture.INBOUND, address, datagram)
+        msgSeq, msgType = Tools.getHead(datagram)
+        self.metrics.received[msgType] += 1
+        if(msgType == 0):
+        #acknowledgement message recieved
+            if(Trace.enabled):
+                moduleLogger.debug('<-----ack message recieved')
+            window = self.sendWindow.get(address)
+            if(window is None):
+            #ack from an unknown client or for a client already gone
+                return
+            acked = window.ack(msgSeq, self.clock.seconds())
+            if(acked is None):
+            #duplicate ack, the message was already acknowledged
+                self.metrics.duplicated[0] += 1
+                return
+            #the window moved, send the messages waiting for room in it
+            self.flushWindow(address)
+            self.messageAcknowledged(address, acked)
+
+        elif(msgType == 4):
+        #cumulative acknowledgement received
+            if(Trace.enabled):
+                moduleLogger.debug('<-----cumulative ack message recieved')
+            sackBitmap, = Codec.decodeExtendedAck(datagram)
+            self.cumulativeAckReceived(address, msgSeq, sackBitmap)
+
+        else:
+            if(address in self.ackCoalescer):
+            #the client may have put an acknowledgement on its message
+                ack = Codec.parseTrailers(datagram)[1]
+                if(ack is not None):
+                    self.cumulativeAckReceived(address, *ack)
+            receiveFilter = self.receiveFilter.get(address)
+            if(receiveFilter is not None and receiveFilter.isDuplicate(msgSeq)):
+            #our ack was lost: acknowledge again, do not handle it again
+                if(Trace.enabled):
+                    moduleLogger.debug('<-----duplicate message recieved')
+                self.duplicateCount += 1
+                self.metrics.duplicated[msgType] += 1
+                self.acknowledge(msgSeq, address)
+                return
+            if(msgType == 1):
+            #a login starts a new session, forget the previous one
+                self.closeWindow(address)
+                self.receiveFilter[address] = Arq.DuplicateFilter(msgSeq)
+            #send acknowledgement
+            self.acknowledge(msgSeq, address)
+            if(msgType == 1):
+                self.sendWindow[address] = Arq.SendWindow(self.sendWindowSize,
+                                                          maxPending=self.maxQueueLength,
+                                                          droppableTypes=self.droppableTypes)
+            self.requestReceived(address, msgType, datagram)
+
+    def loginAccepted(self, userAdrs, datagram):
+        """
+        Accepts the cumulative acknowledgements offered by the login
+        request.
+        """
+        capabilities = Codec.parseTrailers(datagram)[0]
+        if(self.cumulativeAcks and capabilities is not None
+           and capabilities & Codec.CAP_CUMULATIVE_ACK):
+        #the client acknowledges cumulatively, and so do we
+            msgSeq = Tools.getHead(datagram)[0]
+            self.ackCoalescer[userAdrs] = Arq.AckCoalescer(
+                functools.partial(self.sendExtendedAck, userAdrs),
+                self.timerWheel, Arq.seqAdd(msgSeq, 1))
+
+    def sessionClosed(self, userAdrs):
+        self.closeWindow(userAdrs)
+        self.userState.pop(userAdrs, None)
+
+    def messageAcknowledged(self, userAdrs, acked):
+        """
+        :param <tuple, 'tuple>  userAdrs : the user adress (host,port).
+        :param Arq.Outstanding acked : the message just acknowledged.
+
+        Moves the initialization of the user forward according to the
+        type of the acknowledged message.
+        """
+        if(acked.tries == 1):
+        #Karn's rule: only a message sent once gives a valid RTT
+            self.metrics.ackRtt.observe(self.clock.seconds() - acked.sentAt)
+        if(acked.msgType == 5):
+        #login ok received: the user list and right behind it the movie
+        #list, so that no notification (about a movie room) comes first
+            self.loginStepDone(userAdrs)
+            self.loginStepDone(userAdrs)
+
+        elif(acked.msgType == 8):
+        #movie list received (the user list was before it)
+            self.loginStepDone(userAdrs)
+
+        elif(acked.msgType == 6):
+        #Login rejected ack received, forget the client
+            self.closeWindow(userAdrs)
+            self.userState.pop(userAdrs, None)
+
+    def cumulativeAckReceived(self, userAdrs, cumAck, sackBitmap):
+        """
+        :param <tuple, 'tuple>  userAdrs : the user adress (host,port).
+        :param int cumAck     : every message before cumAck was received.
+        :param int sackBitmap : the messages received after cumAck.
+
+        Handles a type 4 acknowledgement or an ack trailer.
+        """
+        window = self.sendWindow.get(userAdrs)
+        if(window is None):
+            return
+        acked = window.ackCumulative(cumAck, sackBitmap, self.clock.seconds())
+        if(not acked):
+            return
+        self.flushWindow(userAdrs)
+        for outstanding in acked:
+            self.messageAcknowledged(userAdrs, outstanding)
+
+    def acknowledge(self, msgSeq, userAdrs):
+        """
+        :param int msgSeq : the sequence number of the received message.
+        :param <tuple, 'tuple>  userAdrs : the user adress (host,port).
+
+        Acknowledges a message: right away with a type 0 message, or later
+        and together with the next ones if the user negotiated cumulative
+        acknowledgements.
+        """
+        coalescer = self.ackCoalescer.get(userAdrs)
+        if(coalescer is None):
+            self.write(Codec.packHead(msgSeq, 0), userAdrs)
+            self.metrics.sent[0] += 1
+        else:
+            coalescer.received(msgSeq)
+
+    def sendExtendedAck(self, userAdrs, msgBuf):
+        """
+        :param <tuple, 'tuple>  userAdrs : the user adress (host,port).
+        :param string msgBuf : a type 4 message built by the AckCoalescer.
+        """
+        self.write(msgBuf, userAdrs)
+        self.metrics.sent[4] += 1
+
+    def deliverNotification(self, user, otherUser, notification):
+        msgType, msgBody = notification
+        self.sendReliable(otherUser.userAddress, msgType, msgBody)
+
+    def deliverChatMessage(self, user, chatMessage, otherUser, msgBody):
+        self.sendReliable(otherUser.userAddress, 14, msgBody)
+
+    def sendReliable(self, userAdrs, msgType, msgBody=''):
+        """
+        :param <tuple, 'tuple>  userAdrs : the user adress (host,port).
+        :param int msgType    : the message Type field.
+        :param string msgBody : everything following the msgLen field.
+
+        Queues a message in the send window of the user and sends it
+        right away if the window has room for it.  The sequence number is
+        only given when the message enters the window.  If the queue of
+        the user is full an old chat message is dropped, and the user is
+        evicted when there is none to drop.  The messages for a client of
+        another worker are handed to that worker.  A user waiting for the
+        acknowledgement of his login ok gets no notification: his user
+        list, not built yet, will tell it.
+        """
+        if(self.cluster is not None and not self.cluster.owns(userAdrs)):
+        #the user belongs to another worker, which has his send window
+            self.cluster.send(userAdrs, msgType, msgBody)
+            return
+        if(msgType in Codec.NOTIFICATION_TYPES
+           and self.userState.get(userAdrs) is Tools.USER_STATES.LOGIN_OK_PENDING):
+            return
+        window = self.sendWindow.get(userAdrs)
+        if(window is None):
+            moduleLogger.warning('no send window for %s, message type %d dropped',
+                                 userAdrs, msgType)
+            self.metrics.dropped[msgType] += 1
+            return
+        try:
+            dropped = window.push(msgType, msgBody)
+        except Arq.QueueOverflow:
+            moduleLogger.warning('queue of %s full, client evicted: %s',
+                                 userAdrs, self.queueStats())
+            self.metrics.dropped[msgType] += 1
+            self.evictUser(userAdrs)
+            return
+        if(dropped is not None):
+        #the client does not keep up, it misses a chat message
+            self.droppedCount += 1
+            self.metrics.dropped[dropped[0]] += 1
+            moduleLogger.debug('queue of %s full, message type %d dropped',
+                               userAdrs, dropped[0])
+        self.flushWindow(userAdrs)
+
+    def queueStats(self):
+        """
+        Returns a dictionary describing the queues of the clients: the
+        number of sessions, the number of messages queued and in flight in
+        all of them, the depth of the deepest queue, the largest depth
+        reached by a queue of a current session and the number of messages
+        dropped since the server started.
+        """
+        windows = self.sendWindow.values()
+        return {'sessions': len(windows),
+                'queued': sum(len(window.pending) for window in windows),
+                'inFlight': sum(len(window.inFlight) for window in windows),
+                'deepest': max([len(window.pending) for window in windows] or [0]),
+                'peak': max([window.peakPending for window in windows] or [0]),
+                'dropped': self.droppedCount}
+
+    def metricGauges(self):
+        stats = self.queueStats()
+        return (('c2w_sessions', None, stats['sessions']),
+                ('c2w_queued_messages', None, stats['queued']),
+                ('c2w_inflight_messages', None, stats['inFlight']),
+                ('c2w_deepest_queue', None, stats['deepest']))
+
+    def flushWindow(self, userAdrs):
+        """
+        :param <tuple, 'tuple>  userAdrs : the user adress (host,port).
+
+        Sends every message that the send window of the user lets in.
+        """
+        for outstanding in self.sendWindow[userAdrs].admit():
+            self.transmit(userAdrs, outstanding)
+
+    def transmit(self, userAdrs, outstanding):
+        """
+        :param <tuple, 'tuple>  userAdrs : the user adress (host,port).
+        :param Arq.Outstanding outstanding : a message in flight.
+
+        Writes the message, with the pending acknowledgement of the user
+        as a trailer if there is one, and arms its own retransmission
+        timer, with the timeout given by the RTT estimator of the user
+        (doubled at each retransmission).
+        """
+        window = self.sendWindow[userAdrs]
+        msgBuf = outstanding.msgBuf
+        coalescer = self.ackCoalescer.get(userAdrs)
+        if(coalescer is not None):
+            if(outstanding.msgType == 5):
+            #the login ok tells the client that we acknowledge cumulatively
+                msgBuf += Codec.capsTrailer(Codec.CAP_CUMULATIVE_ACK)
+            msgBuf += coalescer.trailer()
+        self.write(msgBuf, userAdrs)
+        if(outstanding.tries == 0):
+            outstanding.sentAt = self.clock.seconds()
+            self.metrics.sent[outstanding.msgType] += 1
+        else:
+            self.metrics.retransmitted[outstanding.msgType] += 1
+        outstanding.tries += 1
+        outstanding.timer  = self.timerWheel.arm(window.rtt.timeout(outstanding.tries),
+                                                 self.retransmit, userAdrs, outstanding)
+
+    def retransmit(self, userAdrs, outstanding):
+        """
+        :param <tuple, 'tuple>  userAdrs : the user adress (host,port).
+        :param Arq.Outstanding outstanding : a message in flight.
+
+        Called when the timer of a message expires: the message is sent
+        again, alone, unless it was tried maxTries times already.  In that
+        case the client is considered as gone and its session is evicted.
+        """
+        outstanding.timer = None
+        window = self.sendWindow.get(userAdrs)
+        if(window is None or not window.isInFlight(outstanding)):
+            return
+        if(outstanding.tries >= self.maxTries):
+            moduleLogger.warning('message %d to %s not acknowledged after %d tries',
+                                 outstanding.seqNbr, userAdrs, outstanding.tries)
+            self.evictUser(userAdrs)
+            return
+        self.transmit(userAdrs, outstanding)
+
+    def evictUser(self, userAdrs):
+        """
+        :param <tuple, 'tuple>  userAdrs : the user adress (host,port).
+
+        Forgets the session of a client that stopped answering, as if it
+        had left the system: the other users are notified and the user
+        is removed from the databases.
+        """
+        self.closeWindow(userAdrs)
+        self.userState.pop(userAdrs, None)
+        if(self.evictions is not None):
+        #the queue of userAdrs overflowed with the notification of an
+        #eviction: one after the other rather than recursively
+            self.evictions.append(userAdrs)
+            return
+        self.evictions = [userAdrs]
+        try:
+            while(self.evictions):
+                user = self.serverProxy.getUserByAddress(self.evictions.pop(0))
+                if(user is not None):
+                    self.userGone(user, 'evicted')
+        finally:
+            self.evictions = None
+
+    def closeWindow(self, userAdrs):
+        """
+        :param <tuple, 'tuple>  userAdrs : the user adress (host,port).
+
+        Cancels every timer of the user and forgets his send window and
+        his receive filter.  A pending cumulative acknowledgement is sent
+        first.
+        """
+        self.receiveFilter.pop(userAdrs, None)
+        window = self.sendWindow.pop(userAdrs, None)
+        if(window is not None):
+            window.close()
+        coalescer = self.ackCoalescer.pop(userAdrs, None)
+        if(coalescer is not None):
+            coalescer.flush()
+
+
+class StreamServerEngine(ServerEngine):
+
+    # Number of tries per message before the client is considered as gone.
+    maxTries          = 10
+    # Maximum number of messages queued behind the one waiting for its ack:
+    # a burst of logins queues a notification per user.
+    maxQueueLength    = 1024
+    # Messages that may be dropped when the queue is full.
+    droppableTypes    = frozenset((Codec.MSG_TYPES.CHAT_MESSAGE,))
+    # Accept the reliable transport mode offered by the clients.
+    reliableTransport = True
+
+    def __init__(self, serverProxy, address, writeMessage, loseConnection,
+                 clock=None, cluster=None):
+        """
+        :param serverProxy: the serverProxy of the user and movie store.
+        :param address: the (host, port) address of the client.
+        :param writeMessage: the function sending a message, called with
+            the message (a string, or a tuple of strings written one after
+            the other) and, for a notification, the name of the user it
+            is about.
+        :param loseConnection: the function closing the connection.
+        :param clock: the IReactorTime giving the time and running the
+            timers (the reactor by default).
+        :param cluster: the Sharding.Node the server belongs to, or None.
+
+        The engine of one TCP connection.  It is the userChatInstance of
+        its user: the other engines send their notifications and chat
+        messages to the user through sendNotification and
+        sendChatMessage.
+
+        .. attribute:: seqNbr
+
+            The sequence number of the next message sent to the client.
+
+        .. attribute:: outstanding
+
+            The (msgType, msgBuf, key) of the message waiting for its
+            acknowledgement, or None.
+
+        .. attribute:: pending
+
+            A deque of the (msgType, msgBody, key) of the messages waiting
+            for the acknowledgement of the outstanding one: the client
+            acknowledges one message at a time.  They get their sequence
+            number when they are written.  Behind it at most
+            maxQueueLength messages wait their turn: when the queue is
+            full the oldest chat message is dropped, and a client whose
+            queue is full of messages that cannot be dropped is
+            disconnected.
+
+        .. attribute:: timer
+
+            The retransmission timer of the outstanding message.
+
+        .. attribute:: counter
+
+            The number of times the outstanding message has been written.
+
+        .. attribute:: rtt
+
+            The Arq.RttEstimator giving the retransmission timeout,
+            measured on the acknowledgements of the client.
+
+        .. attribute:: sentAt
+
+            When the outstanding message was first sent.
+
+        .. attribute:: userState
+
+            The state of the user, mainly used to react correctly to the
+            acknowledgements.
+
+        .. attribute:: receiveFilter
+
+            The Arq.DuplicateFilter recognizing the messages the client
+            sent again because our acknowledgement came too late.
+
+        .. attribute:: framer
+
+            The StreamFramer cutting the received stream into messages.
+
+        .. attribute:: reliable
+
+            True once the reliable transport mode is negotiated (see
+            Codec.RELIABLE_SEQ): TCP already delivers every message once
+            and in order, so no message is acknowledged, no timer is
+            armed, and the messages of the login are sent one after the
+            other without waiting.
+        """
+        ServerEngine.__init__(self, serverProxy, clock, cluster)
+        if(Capture.recorder is not None):
+            writeMessage = Capture.recorder.recordingWriteMessage(writeMessage, address)
+        self.address        = address
+        self.writeMessage   = writeMessage
+        self.loseConnection = loseConnection
+        self.chatInstance   = self
+        self.seqNbr         = 0
+        self.outstanding    = None
+        self.pending        = collections.deque()
+        self.timer          = None
+        self.userState      = Tools.USER_STATES.CONNECTING
+        self.counter        = 0
+        self.rtt            = Arq.RttEstimator()
+        self.sentAt         = None
+        self.receiveFilter  = Arq.DuplicateFilter()
+        self.framer         = Framer.StreamFramer()
+        self.reliable       = False
+
+    def getUserState(self, address):
+        return self.userState
+
+    def setUserState(self, address, userState):
+        self.userState = userState
+
+    def metricGauges(self):
+        return (('c2w_sessions', None, 1),
+                ('c2w_queued_messages', None, len(self.pending)),
+                ('c2w_inflight_messages', None, 0 if self.outstanding is None else 1))
+
+    def dataReceived(self, data):
+        """
+        :param string data: bytes received on the connection.
+
+        Cuts the stream into messages and handles them.  The connection
+        is closed when the stream cannot be a c2w one.
+        """
+        try:
+            frames = self.framer.feed(data)
+        except Framer.FramingError:
+            moduleLogger.warning('invalid stream received, closing the connection')
+            self.loseConnection()
+            return
+        for frame in frames:
+            self.messageReceived(frame)
+
+    def messageReceived(self, datagram):
+        """
+        :param string datagram: a complete message of the client.
+        """
+        if(Capture.recorder is not None):
+            Capture.recorder.record(Capture.INBOUND, self.address, datagram)
+        msgSeq, msgType = Tools.getHead(datagram)
+        self.metrics.received[msgType] += 1
+        if(msgType == 1 and msgSeq == Codec.RELIABLE_SEQ and self.reliableTransport):
+        #the client offers the reliable transport mode
+            if(self.reliable and self.userState not in (Tools.USER_STATES.CONNECTING,
+                                                        Tools.USER_STATES.CORRECT_USERNAME_PENDING)):
+            #its login is already accepted, this one was sent again
+                if(Trace.enabled):
+                    moduleLogger.debug('<-----duplicate login request received')
+                self.metrics.duplicated[1] += 1
+                return
+            self.reliable = True
+        elif(msgType == 0 and (self.reliable or self.outstanding is None
+                               or msgSeq != self.seqNbr)):
+        #late or repeated ack, the message was already acknowledged
+            if(Trace.enabled):
+                moduleLogger.debug('<-----duplicate ack message received')
+            self.metrics.duplicated[0] += 1
+            return
+        elif(msgType != 0 and not self.reliable and self.receiveFilter.isDuplicate(msgSeq)):
+        #our ack came too late: acknowledge again, do not handle it again
+            if(Trace.enabled):
+                moduleLogger.debug('<-----duplicate message received')
+            self.metrics.duplicated[msgType] += 1
+            self.sendAcknowledgement(msgSeq)
+            return
+        if(msgType == 0):
+        #acknowledgement message received
+            if(Trace.enabled):
+                moduleLogger.debug('<-----ack message received')
+            self.timer.cancel()
+            if(self.counter == 1):
+            #Karn's rule: only a message sent once gives a valid RTT
+                rtt = self.clock.seconds() - self.sentAt
+                self.rtt.sample(rtt)
+                self.metrics.ackRtt.observe(rtt)
+            ackedType = self.outstanding[0]
+            self.outstanding = None
+            self.counter     = 0
+            self.messageDelivered(ackedType)
+            self.flush()
+        else:
+            if(not self.reliable):
+            #send acknowledgement
+                self.sendAcknowledgement(msgSeq)
+            if(msgType == 1):
+            #the messages of a previous login are forgotten, and in the
+            #reliable mode the answer carries RELIABLE_SEQ
+                self.closeQueue()
+                self.seqNbr = Codec.RELIABLE_SEQ if self.reliable else 0
+            self.requestReceived(self.address, msgType, datagram)
+
+    def connectionLost(self):
+        """
+        Called when the connection is closed.  If the user did not leave
+        the system properly (connection reset, client evicted by
+        retransmit or for not reading), the other users are notified
+        and the user is removed from the databases.
+        """
+        self.metrics.untrack(self)
+        if(Capture.recorder is not None):
+            Capture.recorder.record(Capture.CLOSED, self.address)
+        self.closeQueue()
+        user = self.serverProxy.getUserByAddress(self.address)
+        if(user is None or user.userChatInstance is not self):
+            return
+        self.userGone(user, 'connection lost')
+
+    def messageDelivered(self, msgType):
+        """
+        :param int msgType: the type of the message delivered.
+
+        Called when the message sent last has been delivered: when its
+        acknowledgement is received, or right after it is written in the
+        reliable transport mode.  Moves the login forward according to
+        its type.
+        """
+        self.seqNbr = Arq.seqAdd(self.seqNbr, 1)
+        if(msgType == 5):
+        #login ok delivered: the user list and right behind it the movie
+        #list, so that no notification (about a movie room) comes first
+            self.loginStepDone(self.address)
+            self.loginStepDone(self.address)
+
+        elif(msgType == 8):
+        #movie list delivered (the user list was before it)
+            self.loginStepDone(self.address)
+
+    def closeQueue(self):
+        """
+        Cancels the timer of the outstanding message and forgets it, with
+        the queued ones.
+        """
+        if(self.timer is not None and self.timer.active()):
+            self.timer.cancel()
+        self.timer       = None
+        self.outstanding = None
+        self.counter     = 0
+        self.pending.clear()
+
+    def sendAcknowledgement(self, msgSeq):
+        """
+        :param int msgSeq : the sequence number of the acknowledged message.
+        """
+        self.writeMessage(Codec.packHead(msgSeq, 0))
+        self.metrics.sent[0] += 1
+
+    def sendReliable(self, address, msgType, msgBody='', key=None):
+        """
+        :param address: the address of the client (unused, the connection
+            has only one).
+        :param int msgType    : the message Type field.
+        :param string msgBody : everything following the msgLen field.
+        :param string key     : for a notification, the name of the user
+            it is about.
+
+        Sends a message to the client.  The body is not copied: only the
+        header is built, and both are written one after the other.  Until
+        the reliable transport mode is negotiated, the message is queued
+        behind the one waiting for its acknowledgement (see pending).  A
+        user waiting for the acknowledgement of his login ok gets no
+        notification: his user list, not built yet, will tell it.
+        """
+        if(msgType in Codec.NOTIFICATION_TYPES
+           and self.userState is Tools.USER_STATES.LOGIN_OK_PENDING):
+            return
+        if(self.reliable):
+            self.transmit(msgType, msgBody, key)
+            return
+        pending = self.pending
+        if(len(pending) >= self.maxQueueLength):
+        #the client does not keep up
+            for index, message in enumerate(pending):
+                if(message[0] in self.droppableTypes):
+                    del pending[index]
+                    self.metrics.dropped[message[0]] += 1
+                    break
+            else:
+                self.metrics.dropped[msgType] += 1
+                if(msgType not in self.droppableTypes):
+                    moduleLogger.warning('queue of %s:%s full, closing the connection',
+                                         self.address[0], self.address[1])
+                    self.closeQueue()
+                    self.loseConnection()
+                return
+        pending.append((msgType, msgBody, key))
+        self.flush()
+
+    def flush(self):
+        """
+        Sends the next queued message, unless one is waiting for its
+        acknowledgement.
+        """
+        if(self.outstanding is None and self.pending):
+            self.transmit(*self.pending.popleft())
+
+    def transmit(self, msgType, msgBody, key):
+        """
+        :param int msgType    : the message Type field.
+        :param string msgBody : everything following the msgLen field.
+        :param string key     : for a notification, the name of the user
+            it is about.
+
+        Writes the message with the current sequence number.  In the
+        reliable transport mode it is delivered right away, otherwise it
+        is outstanding until its acknowledgement comes.
+        """
+        if(msgType in Codec.HEAD_ONLY_TYPES):
+            msgBuf = Codec.packHead(self.seqNbr, msgType)
+        else:
+            msgBuf = (Codec.frameHead(self.seqNbr, msgType, len(msgBody)), msgBody)
+        self.writeMessage(msgBuf, key)
+        self.metrics.sent[msgType] += 1
+        if(self.reliable):
+        #the message is delivered as far as we are concerned
+            self.messageDelivered(msgType)
+        else:
+            self.outstanding = (msgType, msgBuf, key)
+            self.sentAt      = self.clock.seconds()
+            self.manageTimer()
+
+    def retransmit(self):
+        """
+        Called when the timer of the outstanding message expires: it is
+        written again, unless it was tried maxTries times already.  In
+        that case the client is considered as gone and the connection is
+        closed (see connectionLost).
+        """
+        self.timer = None
+        if(self.outstanding is None):
+            return
+        if(self.counter >= self.maxTries):
+            moduleLogger.warning('no answer from %s:%s after %d tries, closing the connection',
+                                 self.address[0], self.address[1], self.maxTries)
+            self.closeQueue()
+            self.loseConnection()
+            return
+        msgType, msgBuf, key = self.outstanding
+        self.writeMessage(msgBuf, key)
+        self.metrics.retransmitted[msgType] += 1
+        self.manageTimer()
+
+    def sendNotification(self, sender, notification=None):
+        """
+        :param c2wUser sender : the user whose new room is notified.
+        :param tuple notification (optional) : the (msgType, msgBody)
+         returned by notificationBody, shared by all the recipients
+         of a broadcast.
+
+        Sends the notification of sender to the user of this connection.
+        """
+        if(notification is None):
+            notification = self.notificationBody(sender)
+        msgType, msgBody = notification
+        self.sendReliable(self.address, msgType, msgBody, sender.userName)
+
+    def sendChatMessage(self, senderName, chatMessage, msgBody=None):
+        """
+        :param string senderName  : the name of the message transmitter.
+        :param string chatMessage : the chat message.
+        :param string msgBody (optional) : the encoded message body,
+         shared by all the recipients of a broadcast.
+
+        Sends a chat message from senderName to the user of this
+        connection.
+        """
+        if(msgBody is None):
+            msgBody = Codec.chatMessageBody(senderName, chatMessage)
+        self.sendReliable(self.address, 14, msgBody)
+
+    def deliverNotification(self, user, otherUser, notification):
+        otherUser.userChatInstance.sendNotification(user, notification=notification)
+
+    def deliverChatMessage(self, user, chatMessage, otherUser, msgBody):
+        otherUser.userChatInstance.sendChatMessage(user.userName, chatMessage, msgBody=msgBody)
+
+    def manageTimer(self):
+        """
+        Arms the timer writing the outstanding message again after the
+        timeout given by the RTT estimator, doubled at each try.
+        """
+        self.counter += 1
+        self.timer    = self.timerWheel.arm(self.rtt.timeout(self.counter), self.retransmit)
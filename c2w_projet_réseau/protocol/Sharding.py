@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Sharding of the c2w server across several nodes connected by a broker.
+
+Each node is a complete c2w server (UDP or TCP) with its own clients.
+The nodes share their users: every change of the user store of a node
+(a login, a change of room, a leave) is published to the other nodes,
+which keep a copy of the remote users next to their own.  The user list
+and the members of a room are thus the same on every node.
+
+The movie rooms are divided among the nodes (see Node.roomOwner).  When
+a user joins a room owned by another node, the join is forwarded to the
+owner: it streams the movie and publishes the change of room to the
+other nodes, so the arrivals in a room are seen in the same order
+everywhere.  The main room belongs to every node.
+
+A message for a remote user (a notification or a chat message of the
+room) is handed to the node of the user, which sends it as its own:
+
+- the UDP server routes them through its cluster hook (owns and send,
+  as the workers of Cluster do);
+- the remote users of the TCP server have a RemoteChatInstance as
+  userChatInstance, which the broadcasts use as a connection.
+
+The messages for a node are grouped and published once per reactor
+iteration on the topic of the node.  The broker is pluggable, see
+Broker.  Like the workers of Cluster, the nodes accept two users logging
+in with the same name at the same time on two nodes.
+"""
+import zlib
+from collections import namedtuple
+from twisted.internet import reactor
+from twisted.python import log
+from c2w.main.constants import ROOM_IDS
+import Codec
+from Cluster import (MSG_DATAGRAM, MSG_SEND, MSG_USER_ADDED, MSG_USER_MOVED,
+                     MSG_USER_REMOVED, internRoom)
+
+# Messages exchanged by the nodes, next to the ones of Cluster.  The
+# changes of the user store carry the node the user is connected to and
+# a version given by that node, the older changes are ignored:
+#   (MSG_USER_ADDED, userName, userChatRoom, address, origin, version)
+#   (MSG_USER_MOVED, userName, userChatRoom, origin, version)
+#   (MSG_USER_REMOVED, userName, origin, version)
+MSG_DELIVER = 6   # (MSG_DELIVER, userName, msgType, msgBody, senderName)
+MSG_JOIN    = 7   # (MSG_JOIN, userName, userChatRoom, origin, version)
+
+TOPIC_PREFIX = 'c2w.node.'
+
+# What a TCP connection needs to know about the sender of a notification
+# whose body is already encoded.
+Sender = namedtuple('Sender', 'userName')
+
+
+class Node(object):
+
+    def __init__(self, name, nodes, broker, clock=None):
+        """
+        :param string name: the name of this node.
+        :param list nodes: the names of all the nodes, in the same order
+            on every node (it gives the owners of the rooms).
+        :param broker: the broker connecting the nodes (see Broker).
+        :param clock: the IReactorTime scheduling the flushes (the
+            reactor by default).
+
+        .. attribute:: engine
+
+            The server engine attached last (the UDP server has only
+            one, see ServerEngine).
+
+        .. attribute:: serverProxy
+
+            The ShardedServerProxy shared by the engines of this node.
+
+        .. attribute:: remoteAddresses
+
+            A dictionary address -> node of the users connected to
+            another node.
+
+        .. attribute:: outgoing
+
+            A dictionary node -> list of the messages for that node
+            posted during this reactor iteration.
+
+        .. attribute:: forwarded, relayed, published, received, joins
+
+            The number of datagrams forwarded, of messages given to
+            another node to send, of changes of the user store published,
+            of messages received and of joins forwarded to the owner of
+            the room.
+        """
+        if name not in nodes:
+            raise ValueError('node %s is not one of %s' % (name, ', '.join(nodes)))
+        self.name            = name
+        self.nodes           = list(nodes)
+        self.broker          = broker
+        self.clock           = clock if clock is not None else reactor
+        self.engine          = None
+        self.serverProxy     = None
+        self.remoteAddresses = {}
+        self.outgoing        = {}
+        self.flushCall       = None
+        self.version         = 0
+        self.forwarded       = 0
+        self.relayed         = 0
+        self.published       = 0
+        self.received        = 0
+        self.joins           = 0
+        broker.subscribe(TOPIC_PREFIX + name, self.messagesReceived)
+
+    def roomOwner(self, room):
+        """
+        Returns the name of the node owning the movie room, or None for
+        the main room (and out of the system), which every node owns.
+        """
+        if room == ROOM_IDS.MAIN_ROOM or room == ROOM_IDS.OUT_OF_THE_SYSTEM_ROOM:
+            return None
+        return self.nodes[(zlib.crc32(room) & 0xffffffff) % len(self.nodes)]
+
+    def nextVersion(self):
+        self.version += 1
+        return self.version
+
+    def attach(self, engine, serverProxy):
+        """
+        :param engine: a server engine of this node.
+        :param serverProxy: its (indexed) serverProxy.
+
+        Returns the ShardedServerProxy the engine must use instead of
+        serverProxy, the same for every engine of this node.
+        """
+        self.engine = engine
+        if self.serverProxy is None:
+            self.serverProxy = ShardedServerProxy(serverProxy, self)
+        return self.serverProxy
+
+    def owns(self, address):
+        """
+        Returns True unless the client at address is connected to
+        another node.
+        """
+        return address not in self.remoteAddresses
+
+    def forwardDatagram(self, address, datagram):
+        """
+        Gives a datagram received from the client at address to the node
+        it is connected to.
+        """
+        self.forwarded += 1
+        self.post(self.remoteAddresses[address], (MSG_DATAGRAM, address, datagram))
+
+    def send(self, address, msgType, msgBody):
+        """
+        Asks the node of the UDP client at address to send it a message
+        (see c2wUdpChatServerProtocol.sendReliable).
+        """
+        self.relayed += 1
+        self.post(self.remoteAddresses[address], (MSG_SEND, address, msgType, msgBody))
+
+    def deliver(self, node, userName, msgType, msgBody, senderName):
+        """
+        Asks node to send a message on the TCP connection of userName.
+        """
+        self.relayed += 1
+        self.post(node, (MSG_DELIVER, userName, msgType, msgBody, senderName))
+
+    def publish(self, message, exclude=()):
+        """
+        Sends a change of the user store to every other node, except the
+        ones in exclude.
+        """
+        self.published += 1
+        for node in self.nodes:
+            if node != self.name and node not in exclude:
+                self.post(node, message)
+
+    def post(self, node, message):
+        """
+        Queues message for node, until the end of this reactor iteration.
+        """
+        self.outgoing.setdefault(node, []).append(message)
+        if self.flushCall is None:
+            self.flushCall = self.clock.callLater(0, self.flush)
+
+    def flush(self):
+        """
+        Publishes the queued messages, once per node.
+        """
+        if self.flushCall is not None and self.flushCall.active():
+            self.flushCall.cancel()
+        self.flushCall = None
+        outgoing, self.outgoing = self.outgoing, {}
+        for node, messages in outgoing.iteritems():
+            self.broker.publish(TOPIC_PREFIX + node, (self.name, messages))
+
+    def messagesReceived(self, (node, messages)):
+        """
+        Handles the messages flushed by node.
+        """
+        for message in messages:
+            self.received += 1
+            try:
+                self.dispatch(message)
+            except Exception:
+                log.err(None, 'message %r from node %s failed' % (message[0], node))
+
+    def dispatch(self, message):
+        kind = message[0]
+        if kind == MSG_DATAGRAM:
+            self.engine.datagramReceived(message[2], tuple(message[1]))
+        elif kind == MSG_SEND:
+            self.engine.sendReliable(tuple(message[1]), *message[2:])
+        elif kind == MSG_DELIVER:
+            self.serverProxy.deliver(*message[1:])
+        elif kind == MSG_JOIN:
+            self.serverProxy.joinReceived(*message[1:])
+        else:
+            self.serverProxy.apply(message)
+
+    def stats(self):
+        """
+        Returns a dictionary with the counts of messages exchanged with
+        the other nodes.
+        """
+        return {'node': self.name, 'nodes': len(self.nodes),
+                'remoteUsers': len(self.remoteAddresses),
+                'forwarded': self.forwarded, 'relayed': self.relayed,
+                'published': self.published, 'received': self.received,
+                'joins': self.joins,
+                'queued': sum(len(messages) for messages in self.outgoing.values())}
+
+
+class RemoteChatInstance(object):
+
+    def __init__(self, node, nodeName, userName):
+        """
+        :param Node node: the node of this process.
+        :param string nodeName: the node the user is connected to.
+        :param string userName: the user.
+
+        The userChatInstance of a user connected to another node: the
+        messages the TCP server sends on it are handed to that node.
+        """
+        self.node     = node
+        self.nodeName = nodeName
+        self.userName = userName
+
+    def sendNotification(self, sender, notification=None):
+        msgType, msgBody = notification
+        self.node.deliver(self.nodeName, self.userName, msgType, msgBody, sender.userName)
+
+    def sendChatMessage(self, senderName, chatMessage, msgBody=None):
+        if msgBody is None:
+            msgBody = Codec.chatMessageBody(senderName, chatMessage)
+        self.node.deliver(self.nodeName, self.userName, Codec.MSG_TYPES.CHAT_MESSAGE,
+                          msgBody, senderName)
+
+
+class ShardedServerProxy(object):
+
+    def __init__(self, serverProxy, node):
+        """
+        :param serverProxy: the serverProxy to wrap (a
+            RoomIndexedServerProxy).
+        :param Node node: the node of this process.
+
+        Publishes the changes of the user store made on this node,
+        forwards the joins of the rooms owned by other nodes and applies
+        the changes made on the other nodes.  Every method not defined
+        here is forwarded to serverProxy.
+
+        .. attribute:: versions
+
+            A dictionary userName -> (origin, version) of the last
+            change applied for each remote user.
+        """
+        self.serverProxy = serverProxy
+        self.node        = node
+        self.versions    = {}
+
+    def __getattr__(self, name):
+        return getattr(self.serverProxy, name)
+
+    def addUser(self, userName, userChatRoom, userChatInstance=None, userAddress=None):
+        result = self.serverProxy.addUser(userName, userChatRoom, userChatInstance, userAddress)
+        node = self.node
+        node.publish((MSG_USER_ADDED, userName, userChatRoom, userAddress,
+                      node.name, node.nextVersion()))
+        return result
+
+    def updateUserChatroom(self, userName, userChatRoom):
+        result = self.serverProxy.updateUserChatroom(userName, userChatRoom)
+        node = self.node
+        owner = node.roomOwner(userChatRoom)
+        message = (userName, userChatRoom, node.name, node.nextVersion())
+        if owner is None or owner == node.name:
+            node.publish((MSG_USER_MOVED,) + message)
+        else:
+            node.joins += 1
+            node.post(owner, (MSG_JOIN,) + message)
+        return result
+
+    def removeUser(self, userName):
+        result = self.serverProxy.removeUser(userName)
+        node = self.node
+        node.publish((MSG_USER_REMOVED, userName, node.name, node.nextVersion()))
+        return result
+
+    def startStreamingMovie(self, movieTitle):
+        # the owner of the room starts it when the join reaches it
+        if self.node.roomOwner(movieTitle) in (None, self.node.name):
+            return self.serverProxy.startStreamingMovie(movieTitle)
+
+    def joinReceived(self, userName, userChatRoom, origin, version):
+        """
+        A user of the node origin joined a room owned by this node.
+        """
+        if self.apply((MSG_USER_MOVED, userName, userChatRoom, origin, version)):
+            self.serverProxy.startStreamingMovie(internRoom(userChatRoom))
+            self.node.publish((MSG_USER_MOVED, userName, userChatRoom, origin, version),
+                              exclude=(origin,))
+
+    def isNewer(self, userName, origin, version):
+        last = self.versions.get(userName)
+        return last is not None and last[0] == origin and last[1] < version
+
+    def apply(self, message):
+        """
+        Applies a change of the user store made on another node.
+        Returns False if it was older than the last one applied.
+        """
+        kind, userName = message[:2]
+        if kind == MSG_USER_ADDED:
+            userChatRoom, address, origin, version = message[2:]
+            if self.serverProxy.userExists(userName):
+                log.msg('user %s of node %s already exists, ignored' % (userName, origin))
+                return False
+            address = tuple(address)
+            self.serverProxy.addUser(userName, internRoom(userChatRoom),
+                                     RemoteChatInstance(self.node, origin, userName), address)
+            self.node.remoteAddresses[address] = origin
+        elif kind == MSG_USER_MOVED:
+            userChatRoom, origin, version = message[2:]
+            if not self.isNewer(userName, origin, version):
+                return False
+            self.serverProxy.updateUserChatroom(userName, internRoom(userChatRoom))
+        else:
+            origin, version = message[2:]
+            if not self.isNewer(userName, origin, version):
+                return False
+            user = self.serverProxy.getUserByName(userName)
+            self.node.remoteAddresses.pop(user.userAddress, None)
+            self.serverProxy.removeUser(userName)
+            del self.versions[userName]
+            return True
+        self.versions[userName] = (origin, version)
+        return True
+
+    def deliver(self, userName, msgType, msgBody, senderName):
+        """
+        Sends a message handed by another node on the TCP connection of
+        userName, a user of this node.
+        """
+        user = self.serverProxy.getUserByName(userName)
+        if user is None or isinstance(user.userChatInstance, RemoteChatInstance):
+            return
+        if msgType == Codec.MSG_TYPES.CHAT_MESSAGE:
+            user.userChatInstance.sendChatMessage(senderName, None, msgBody=msgBody)
+        else:
+            user.userChatInstance.sendNotification(Sender(senderName),
+                                                   notification=(msgType, msgBody))
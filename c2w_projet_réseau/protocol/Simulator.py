@@ -0,0 +1,451 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Deterministic network simulator for the c2w protocols.
+
+The engines (see ServerEngine and ClientEngine) do no I/O and read the
+time from the clock they are given.  The simulator gives them a
+VirtualClock, whose time jumps from one event to the next, and a Network
+carrying their datagrams and streams inside the process.  A scenario of
+an hour runs as fast as its events can be handled: a retransmission timer
+of half a second costs nothing to wait for.
+
+Each datagram gets the LinkProfile of its link: a latency, with jitter,
+and probabilities to be lost, duplicated or held back behind the
+datagrams sent after it (reordered).  Every draw comes from the
+random.Random of the network, created from a seed, and the engines handle
+the events of a run in a fixed order: the same seed and the same scenario
+give the same run.
+
+The streams (TCP) take the latency and the jitter of their link but, as
+TCP does, deliver the bytes once and in order.
+
+SimulatedServer runs a server engine on the network, over a
+Store.ServerStore; SimulatedLoad runs the simulated users of LoadGen
+against it, and simulate puts them together.
+"""
+import functools
+import heapq
+import itertools
+import logging
+import random
+import ServerEngine
+import LoadGen
+from Store import ServerStore
+
+moduleLogger = logging.getLogger('c2w.protocol.simulator')
+
+SERVER_ADDRESS = ('10.0.0.1', 1900)
+
+
+class VirtualCall(object):
+    """
+    A call scheduled by VirtualClock.callLater, with the cancel, active
+    and getTime methods of twisted's IDelayedCall.
+    """
+    __slots__ = ('time', 'function', 'args', 'called', 'cancelled')
+
+    def __init__(self, time, function, args):
+        self.time      = time
+        self.function  = function
+        self.args      = args
+        self.called    = False
+        self.cancelled = False
+
+    def getTime(self):
+        return self.time
+
+    def active(self):
+        return not (self.called or self.cancelled)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class VirtualClock(object):
+
+    def __init__(self, start=0.0):
+        """
+        :param float start: the time the clock starts at, in seconds.
+
+        The IReactorTime of a simulation: callLater only queues the call,
+        run makes the calls in the order of their times (and of their
+        scheduling for the same time), setting the time to theirs.
+
+        .. attribute:: processed
+
+            The number of calls made.
+
+        .. attribute:: failures
+
+            The number of calls that raised an exception (it is logged,
+            and the simulation goes on, as with the reactor).
+        """
+        self.now       = start
+        self.calls     = []
+        self.sequence  = itertools.count()
+        self.stopped   = False
+        self.processed = 0
+        self.failures  = 0
+
+    def seconds(self):
+        return self.now
+
+    def callLater(self, delay, function, *args):
+        """
+        Schedules function(*args) in delay seconds and returns its
+        VirtualCall.
+        """
+        call = VirtualCall(self.now + max(0.0, delay), function, args)
+        heapq.heappush(self.calls, (call.time, next(self.sequence), call))
+        return call
+
+    def stop(self):
+        """
+        Makes run return after the current call.
+        """
+        self.stopped = True
+
+    def run(self, until=None):
+        """
+        :param float until: the time to stop at, or None.
+
+        Makes the scheduled calls until stop is called, no call is left
+        or the next one is after until.
+        """
+        calls = self.calls
+        pop = heapq.heappop
+        self.stopped = False
+        while calls and not self.stopped:
+            time, _, call = calls[0]
+            if until is not None and time > until:
+                break
+            pop(calls)
+            if call.cancelled:
+                continue
+            self.now = time
+            call.called = True
+            self.processed += 1
+            try:
+                call.function(*call.args)
+            except Exception:
+                self.failures += 1
+                moduleLogger.exception('simulated call %r failed', call.function)
+        if until is not None and not self.stopped and self.now < until:
+            self.now = until
+
+
+class LinkProfile(object):
+
+    def __init__(self, latency=0.01, jitter=0.0, loss=0.0, duplicate=0.0, reorder=0.0,
+                 reorderDelay=None):
+        """
+        :param float latency: the one way delay of the link, in seconds.
+        :param float jitter: a random delay between 0 and jitter added to
+            each datagram, in seconds.
+        :param float loss: the probability for a datagram to be lost.
+        :param float duplicate: the probability for a datagram to be
+            delivered twice.
+        :param float reorder: the probability for a datagram to be held
+            back by reorderDelay, the datagrams sent after it overtaking
+            it.
+        :param float reorderDelay: the delay of the datagrams held back
+            (twice the latency by default).
+        """
+        self.latency      = latency
+        self.jitter       = jitter
+        self.loss         = loss
+        self.duplicate    = duplicate
+        self.reorder      = reorder
+        self.reorderDelay = reorderDelay if reorderDelay is not None else 2 * latency
+
+
+class Network(object):
+
+    def __init__(self, seed=0, profile=None, clock=None):
+        """
+        :param seed: the seed of every random draw of the simulation.
+        :param LinkProfile profile: the profile of the links without
+            their own (see setLink).
+        :param VirtualClock clock: the clock of the simulation (a new
+            one by default).
+
+        .. attribute:: random
+
+            The random.Random of the network, for the other random
+            choices of the simulation as well.
+
+        .. attribute:: sent, delivered, lost, duplicated, reordered, undeliverable
+
+            Counts of the datagrams.
+        """
+        self.clock         = clock if clock is not None else VirtualClock()
+        self.random        = random.Random(seed)
+        self.profile       = profile if profile is not None else LinkProfile()
+        self.links         = {}
+        self.endpoints     = {}
+        self.listeners     = {}
+        self.hostCount     = 0
+        self.sent          = 0
+        self.delivered     = 0
+        self.lost          = 0
+        self.duplicated    = 0
+        self.reordered     = 0
+        self.undeliverable = 0
+
+    def setLink(self, source, destination, profile, bothWays=True):
+        """
+        Gives profile to the link from source to destination (and back).
+        """
+        self.links[(source, destination)] = profile
+        if bothWays:
+            self.links[(destination, source)] = profile
+
+    def linkProfile(self, source, destination):
+        return self.links.get((source, destination), self.profile)
+
+    def newAddress(self):
+        """
+        Returns an address of a new host, ('10.x.y.z', 5000).
+        """
+        self.hostCount += 1
+        host = self.hostCount
+        return ('10.%d.%d.%d' % (1 + (host >> 16), (host >> 8) & 255, host & 255), 5000)
+
+    def delay(self, profile):
+        if profile.jitter:
+            return profile.latency + self.random.uniform(0, profile.jitter)
+        return profile.latency
+
+    def bind(self, address, receive):
+        """
+        :param tuple address: the address of an endpoint.
+        :param receive: called with the datagram and the address of its
+            source for each datagram delivered to address.
+        """
+        self.endpoints[address] = receive
+
+    def unbind(self, address):
+        self.endpoints.pop(address, None)
+
+    def sendDatagram(self, source, destination, datagram):
+        """
+        Sends datagram from source to destination, through the profile of
+        their link.
+        """
+        self.sent += 1
+        profile = self.linkProfile(source, destination)
+        draw = self.random.random
+        if profile.loss and draw() < profile.loss:
+            self.lost += 1
+            return
+        copies = 1
+        if profile.duplicate and draw() < profile.duplicate:
+            self.duplicated += 1
+            copies = 2
+        for _ in xrange(copies):
+            delay = self.delay(profile)
+            if profile.reorder and draw() < profile.reorder:
+                self.reordered += 1
+                delay += profile.reorderDelay
+            self.clock.callLater(delay, self.deliver, source, destination, datagram)
+
+    def deliver(self, source, destination, datagram):
+        receive = self.endpoints.get(destination)
+        if receive is None:
+            self.undeliverable += 1
+            return
+        self.delivered += 1
+        receive(datagram, source)
+
+    def listen(self, address, accept):
+        """
+        :param tuple address: the address of a stream server.
+        :param accept: called with the server side StreamEnd of each
+            connection to address.
+        """
+        self.listeners[address] = accept
+
+    def connect(self, source, destination):
+        """
+        Returns the client side StreamEnd of a connection from source to
+        destination, made at once, or None if nothing listens there.
+        """
+        accept = self.listeners.get(destination)
+        if accept is None:
+            return None
+        client = StreamEnd(self, source, destination)
+        server = StreamEnd(self, destination, source)
+        client.peer = server
+        server.peer = client
+        accept(server)
+        return client
+
+    def stats(self):
+        return {'sent': self.sent, 'delivered': self.delivered, 'lost': self.lost,
+                'duplicated': self.duplicated, 'reordered': self.reordered,
+                'undeliverable': self.undeliverable}
+
+
+class StreamEnd(object):
+
+    def __init__(self, network, address, peerAddress):
+        """
+        One end of a simulated TCP connection.  The owner sets
+        dataReceived and connectionLost, called with the bytes received
+        and when the connection is closed.
+        """
+        self.network        = network
+        self.address        = address
+        self.peerAddress    = peerAddress
+        self.peer           = None
+        self.profile        = network.linkProfile(address, peerAddress)
+        self.lastArrival    = 0.0
+        self.closed         = False
+        self.dataReceived   = None
+        self.connectionLost = None
+
+    def arrival(self):
+        """
+        Returns the delay before the bytes written now arrive, after the
+        ones written before.
+        """
+        clock = self.network.clock
+        self.lastArrival = max(clock.seconds() + self.network.delay(self.profile),
+                               self.lastArrival)
+        return self.lastArrival - clock.seconds()
+
+    def write(self, data):
+        if not self.closed:
+            self.network.clock.callLater(self.arrival(), self.peer.received, data)
+
+    def writeSequence(self, data):
+        self.write(''.join(data))
+
+    def loseConnection(self):
+        if not self.closed:
+            self.closed = True
+            self.network.clock.callLater(self.arrival(), self.peer.lost)
+            self.network.clock.callLater(0, self.lost)
+
+    def received(self, data):
+        if self.dataReceived is not None:
+            self.dataReceived(data)
+
+    def lost(self):
+        self.closed = True
+        if self.connectionLost is not None:
+            callback, self.connectionLost = self.connectionLost, None
+            callback()
+
+
+class SimulatedServer(object):
+
+    def __init__(self, network, protocol, address, serverProxy):
+        """
+        :param Network network: the network of the server.
+        :param string protocol: 'UDP' or 'TCP'.
+        :param tuple address: the address the server listens on.
+        :param serverProxy: the user and movie store (a ServerStore).
+
+        A c2w server on the network: a DatagramServerEngine bound to
+        address, or a StreamServerEngine for each connection to address.
+        """
+        self.network     = network
+        self.address     = address
+        self.serverProxy = serverProxy
+        self.engine      = None
+        if protocol == 'UDP':
+            self.engine = ServerEngine.DatagramServerEngine(serverProxy, self.writeDatagram,
+                                                            clock=network.clock)
+            network.bind(address, self.engine.datagramReceived)
+        else:
+            network.listen(address, self.accept)
+
+    def writeDatagram(self, datagram, userAdrs):
+        self.network.sendDatagram(self.address, userAdrs, datagram)
+
+    def accept(self, stream):
+        def writeMessage(msgBuf, key=None):
+            if isinstance(msgBuf, tuple):
+                msgBuf = ''.join(msgBuf)
+            stream.write(msgBuf)
+        engine = ServerEngine.StreamServerEngine(self.serverProxy, stream.peerAddress,
+                                                 writeMessage, stream.loseConnection,
+                                                 clock=self.network.clock)
+        stream.dataReceived = engine.dataReceived
+        stream.connectionLost = engine.connectionLost
+
+
+class SimulatedLoad(LoadGen.LoadGenerator):
+
+    def __init__(self, network, protocol, serverAddress=SERVER_ADDRESS, **options):
+        """
+        :param Network network: the network of the users.
+        :param string protocol: 'UDP' or 'TCP'.
+        :param tuple serverAddress: the address of the SimulatedServer.
+        :param options: the options of LoadGen.LoadGenerator.  Its
+            lossPr is only reported: the datagrams are lost by the links.
+
+        The simulated users of LoadGen, each one on its own host of the
+        network, on its virtual clock.
+        """
+        options.setdefault('seed', network.random.getrandbits(32))
+        LoadGen.LoadGenerator.__init__(self, protocol, serverAddress[0], serverAddress[1],
+                                       clock=network.clock, **options)
+        self.network = network
+
+    def startClient(self, client):
+        address = self.network.newAddress()
+        server = (self.serverAddress, self.serverPort)
+        if self.protocol == 'UDP':
+            engine = LoadGen.DatagramLoadEngine(
+                client, functools.partial(self.network.sendDatagram, address, server),
+                clock=self.clock)
+            self.network.bind(address, lambda datagram, source: engine.datagramReceived(datagram))
+        else:
+            stream = self.network.connect(address, server)
+            if stream is None:
+                client.left(rejected=True)
+                return
+            engine = LoadGen.StreamLoadEngine(client, stream.write, stream.loseConnection,
+                                              clock=self.clock)
+            stream.dataReceived = engine.dataReceived
+            stream.connectionLost = client.connectionLost
+        client.started(engine)
+
+    def sample(self):
+        sample = LoadGen.LoadGenerator.sample(self)
+        metrics = ServerEngine.ServerEngine.metrics
+        sample['metrics'] = {'c2w_messages_sent_total': sum(metrics.sent),
+                             'c2w_messages_retransmitted_total': sum(metrics.retransmitted)}
+        return sample
+
+    def stop(self):
+        self.clock.stop()
+
+
+def simulate(protocol='UDP', clients=1000, duration=3600, profile=None, seed=0,
+             movieCount=16, **options):
+    """
+    :param string protocol: 'UDP' or 'TCP'.
+    :param int clients: the number of simulated users.
+    :param float duration: the measured window, in simulated seconds.
+    :param LinkProfile profile: the profile of every link.
+    :param seed: the seed of the simulation.
+    :param int movieCount: the number of movies of the server.
+    :param options: the other options of LoadGen.LoadGenerator.
+
+    Runs a load scenario on a simulated network and returns the
+    SimulatedLoad, whose report holds the results, and the Network.
+    """
+    network = Network(seed, profile)
+    options.setdefault('lossPr', network.profile.loss)
+    store = ServerStore([('Movie %d' % movieId, '10.0.1.%d' % movieId, 5000 + movieId)
+                         for movieId in xrange(1, movieCount + 1)])
+    SimulatedServer(network, protocol, SERVER_ADDRESS, store)
+    load = SimulatedLoad(network, protocol, SERVER_ADDRESS, clients=clients,
+                         duration=duration, **options)
+    load.start()
+    network.clock.run()
+    return load, network
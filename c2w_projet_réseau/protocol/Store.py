@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+In-memory user and movie store.
+
+ServerStore has the methods of the serverProxy of c2w.main used by the
+server engines, without the video part.  The asyncio server (see
+AioServer) runs on it, and the benchmarks (see Bench) build their users
+and movies in it without the reactor of c2w.main.
+"""
+import logging
+from collections import OrderedDict
+
+moduleLogger = logging.getLogger('c2w.protocol.store')
+
+
+class User(object):
+    """
+    A user of a ServerStore, with the attributes of the users of the c2w
+    serverProxy.
+    """
+    __slots__ = ('userName', 'userChatRoom', 'userChatInstance', 'userAddress', 'userId')
+
+    def __init__(self, userName, userChatRoom, userChatInstance, userAddress, userId):
+        self.userName         = userName
+        self.userChatRoom     = userChatRoom
+        self.userChatInstance = userChatInstance
+        self.userAddress      = userAddress
+        self.userId           = userId
+
+
+class Movie(object):
+    """
+    A movie of a ServerStore, with the attributes of the movies of the
+    c2w serverProxy.
+    """
+    __slots__ = ('movieTitle', 'movieIpAddress', 'moviePort', 'movieId')
+
+    def __init__(self, movieTitle, movieIpAddress, moviePort, movieId):
+        self.movieTitle     = movieTitle
+        self.movieIpAddress = movieIpAddress
+        self.moviePort      = moviePort
+        self.movieId        = movieId
+
+
+class ServerStore(object):
+
+    def __init__(self, movies=()):
+        """
+        :param movies: the (movieTitle, movieIpAddress, moviePort) of the
+            movies, numbered from 1 in this order.
+
+        The user and movie store of the asyncio server and of the
+        benchmarks, with the methods of the c2w serverProxy used by the
+        engines.
+
+        .. attribute:: users
+
+            An OrderedDict userName -> User, in the order of the logins.
+
+        .. attribute:: addresses
+
+            A dictionary userAddress -> User.
+
+        .. attribute:: movies
+
+            The list of the Movie.
+        """
+        self.users      = OrderedDict()
+        self.addresses  = {}
+        self.movies     = [Movie(title, ipAddress, int(port), movieId)
+                           for movieId, (title, ipAddress, port) in enumerate(movies, 1)]
+        self.nextUserId = 1
+        self.streaming  = set()
+
+    def getUserList(self):
+        return self.users.values()
+
+    def userExists(self, userName):
+        return userName in self.users
+
+    def addUser(self, userName, userChatRoom, userChatInstance=None, userAddress=None):
+        """
+        Adds a user and returns its userId.
+        """
+        user = User(userName, userChatRoom, userChatInstance, userAddress, self.nextUserId)
+        self.nextUserId += 1
+        self.users[userName] = user
+        if userAddress is not None:
+            self.addresses[userAddress] = user
+        return user.userId
+
+    def getUserByName(self, userName):
+        return self.users.get(userName)
+
+    def getUserByAddress(self, userAddress):
+        return self.addresses.get(userAddress)
+
+    def updateUserChatroom(self, userName, userChatRoom):
+        self.users[userName].userChatRoom = userChatRoom
+
+    def removeUser(self, userName):
+        user = self.users.pop(userName)
+        if self.addresses.get(user.userAddress) is user:
+            del self.addresses[user.userAddress]
+
+    def getMovieList(self):
+        return self.movies
+
+    def getMovieById(self, movieId):
+        for movie in self.movies:
+            if movie.movieId == movieId:
+                return movie
+        return None
+
+    def getMovieByTitle(self, movieTitle):
+        for movie in self.movies:
+            if movie.movieTitle == movieTitle:
+                return movie
+        return None
+
+    def startStreamingMovie(self, movieTitle):
+        """
+        The store does not stream the videos: the request is only
+        logged, once per movie.
+        """
+        if movieTitle not in self.streaming:
+            self.streaming.add(movieTitle)
+            moduleLogger.info('no video streaming: %s', movieTitle)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Hashed timing wheel for the retransmission timers of the c2w protocols.
+
+Every reliable message arms a timer that is cancelled on its
+acknowledgement, nearly always long before it expires.  Giving each one to
+reactor.callLater means pushing it in and out of the reactor heap.  The
+wheel keeps them in a ring of slots instead, one slot per tick: arming and
+cancelling a timer is a set insertion/removal, and the reactor only wakes
+the wheel up once per tick (and not at all when no timer is armed), to
+fire every timer of the slot in one batch.
+
+A timer fires on the first tick at or after its deadline, so it can be up
+to tickInterval late.  The timers due on the same tick fire in the order
+they were armed, so that a run on a virtual clock is repeated exactly (see
+Simulator).
+"""
+import logging
+import math
+from twisted.internet import reactor
+
+moduleLogger = logging.getLogger('c2w.protocol.timing_wheel')
+
+# One wheel per clock, shared by every protocol instance using it.
+_wheels = {}
+
+
+def getWheel(clock=None):
+    """
+    :param clock: the IReactorTime providing the time (the reactor by
+        default).
+
+    Returns the TimingWheel driven by clock, creating it the first time.
+    """
+    if clock is None:
+        clock = reactor
+    wheel = _wheels.get(id(clock))
+    if wheel is None or wheel.clock is not clock:
+        wheel = _wheels[id(clock)] = TimingWheel(clock=clock)
+    return wheel
+
+
+def sequenceOf(handle):
+    return handle.sequence
+
+
+class TimerHandle(object):
+    """
+    A timer armed on a TimingWheel.  Like the IDelayedCall returned by
+    callLater it has cancel and active methods, but cancelling a timer
+    that already fired or was already cancelled does nothing.
+    """
+    __slots__ = ('wheel', 'slot', 'rounds', 'function', 'args', 'armed', 'sequence')
+
+    def __init__(self, wheel, slot, rounds, function, args, sequence):
+        self.sequence = sequence
+        self.wheel    = wheel
+        self.slot     = slot
+        self.rounds   = rounds
+        self.function = function
+        self.args     = args
+        self.armed    = True
+
+    def active(self):
+        """
+        Returns True until the timer fires or is cancelled.
+        """
+        return self.armed
+
+    def cancel(self):
+        """
+        Cancels the timer if it is still armed.
+        """
+        if self.armed:
+            self.wheel.disarm(self)
+
+
+class TimingWheel(object):
+
+    def __init__(self, tickInterval=0.01, wheelSize=512, clock=None):
+        """
+        :param float tickInterval: the duration of a tick, in seconds.
+        :param int wheelSize: the number of slots of the wheel.  A timer
+            further than wheelSize ticks away goes around the wheel once
+            per wheelSize ticks until it is due.
+        :param clock: the IReactorTime driving the wheel (the reactor by
+            default).
+
+        .. attribute:: slots
+
+            The list of the slots, each one being the set of the
+            TimerHandle due on its ticks.
+
+        .. attribute:: currentTick
+
+            The number of ticks processed since the wheel was created.
+
+        .. attribute:: armedCount
+
+            The number of timers currently armed.
+
+        .. attribute:: armedTotal
+
+            The number of timers armed since the wheel was created, which
+            numbers them in the order they were armed.
+
+        .. attribute:: expiredCount
+
+            The number of timers that fired since the wheel was created.
+
+        .. attribute:: cancelledCount
+
+            The number of timers cancelled since the wheel was created.
+        """
+        self.tickInterval   = tickInterval
+        self.wheelSize      = wheelSize
+        self.clock          = clock if clock is not None else reactor
+        self.slots          = [set() for i in xrange(wheelSize)]
+        self.currentTick    = 0
+        self.startTime      = self.clock.seconds()
+        self.tickCall       = None
+        self.ticking        = False
+        self.armedCount     = 0
+        self.armedTotal     = 0
+        self.expiredCount   = 0
+        self.cancelledCount = 0
+
+    def arm(self, delay, function, *args):
+        """
+        :param float delay: the delay before the timer fires, in seconds.
+        :param function: the function to call.
+        :param args: its arguments.
+
+        Arms a timer and returns its TimerHandle.
+        """
+        idle = self.tickCall is None and not self.ticking
+        if idle:
+            # realign the ticks on the current time
+            self.startTime = self.clock.seconds() - self.currentTick * self.tickInterval
+        ticks = max(1, int(math.ceil(delay / self.tickInterval)))
+        slot = (self.currentTick + ticks) % self.wheelSize
+        self.armedTotal += 1
+        handle = TimerHandle(self, slot, (ticks - 1) // self.wheelSize, function, args,
+                             self.armedTotal)
+        self.slots[slot].add(handle)
+        self.armedCount += 1
+        if idle:
+            self.scheduleTick()
+        return handle
+
+    def disarm(self, handle):
+        """
+        :param TimerHandle handle: an armed timer.
+
+        Cancels a timer (use TimerHandle.cancel).
+        """
+        self.slots[handle.slot].discard(handle)
+        handle.armed = False
+        self.armedCount -= 1
+        self.cancelledCount += 1
+
+    def scheduleTick(self):
+        """
+        Asks the clock to call tick at the beginning of the next tick.
+        """
+        nextTime = self.startTime + (self.currentTick + 1) * self.tickInterval
+        self.tickCall = self.clock.callLater(max(0, nextTime - self.clock.seconds()),
+                                             self.tick)
+
+    def tick(self):
+        """
+        Processes every tick elapsed since the previous call, firing the
+        timers due, then schedules the next call if timers are still
+        armed.
+        """
+        self.tickCall = None
+        self.ticking = True
+        lastTick = int((self.clock.seconds() - self.startTime) / self.tickInterval)
+        # called at the time of the next tick, which the rounding can put
+        # just before it: a clock that does not move on would call again
+        lastTick = max(lastTick, self.currentTick + 1)
+        try:
+            # nothing left to fire once no timer is armed
+            while self.currentTick < lastTick and self.armedCount:
+                self.currentTick += 1
+                self.fireSlot(self.slots[self.currentTick % self.wheelSize])
+        finally:
+            self.ticking = False
+        self.currentTick = lastTick
+        if self.armedCount:
+            self.scheduleTick()
+
+    def fireSlot(self, slot):
+        """
+        :param set slot: the slot of the current tick.
+
+        Fires the timers of slot that are due, the others go around the
+        wheel once more.
+        """
+        due = []
+        for handle in slot:
+            if handle.rounds:
+                handle.rounds -= 1
+            else:
+                due.append(handle)
+        if len(due) > 1:
+            due.sort(key=sequenceOf)
+        for handle in due:
+            slot.discard(handle)
+            handle.armed = False
+        self.armedCount -= len(due)
+        self.expiredCount += len(due)
+        for handle in due:
+            try:
+                handle.function(*handle.args)
+            except Exception:
+                moduleLogger.exception('timer %r failed', handle.function)
+
+    def stats(self):
+        """
+        Returns a dictionary with the armed, expired and cancelled timer
+        counts.
+        """
+        return {'armed': self.armedCount,
+                'expired': self.expiredCount,
+                'cancelled': self.cancelledCount}
+
+    def metricGauges(self):
+        """
+        Returns the (name, labels, value) of the gauge of the armed timers
+        (see Metrics.Registry.track).
+        """
+        return (('c2w_armed_timers', None, self.armedCount),)
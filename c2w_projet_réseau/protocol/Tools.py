@@ -1,6 +1,5 @@
 #!/usr/bin/env python
-import struct
-import ctypes
+import Codec
 
 
 class USER_STATES(object):
@@ -50,8 +49,7 @@ def getData(dataGram,msgLen):
 
     This function extract the data field from the datagram.
     """
-    f=struct.unpack_from('!I'+str(msgLen-4)+'s',dataGram,0)
-    return f[1]
+    return dataGram[Codec.HEAD_LEN_SIZE:msgLen]
     
 def getRoomIdFromData(dataGram,msgLen):
     """
@@ -60,8 +58,7 @@ def getRoomIdFromData(dataGram,msgLen):
 
     This function extracts the roomId field from the packet.    
     """
-    f=struct.unpack_from('!IB',dataGram,0)
-    return f[1]
+    return Codec.ROOM_ID.unpack_from(dataGram, Codec.HEAD_LEN_SIZE)[0]
 
 
 def getHead(dataGram):
@@ -70,10 +67,7 @@ def getHead(dataGram):
 
     This function extract the header of the packet (sequence Number-Type).    
     """
-    f = struct.unpack_from('!H',dataGram,0)
-    seqNbr  =  f[0]>>5
-    msgType =  f[0]&31
-    return (seqNbr, msgType)
+    return Codec.unpackHead(dataGram)
     
 def getLen(dataGram):
     """
@@ -81,6 +75,4 @@ def getLen(dataGram):
 
     This function extract the msgLength field from the packet.    
     """
-    f = struct.unpack_from('!HH',dataGram,0)
-    return f[1]
-
+    return Codec.unpackLen(dataGram)
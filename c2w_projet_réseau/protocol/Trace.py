@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Debug log of the messages exchanged by the c2w protocols.
+
+The engines used to print one or two lines for every message received or
+sent, building the strings even when nobody read them.  They now log
+through their module logger, and only when enabled is set:
+
+    if(Trace.enabled):
+        moduleLogger.debug('----->chat message sent to %s', otherUser.userName)
+
+While the log is disabled (the default) this costs the test of a module
+attribute: no string is built and logging is not called.  The launchers
+call enable for their --debug option.  The records are then written to
+the standard error, or handed to an AsyncHandler with --async-log, so
+that the event loop never waits for the terminal or the disk.
+"""
+import logging
+import sys
+import threading
+import Queue
+
+# Set by enable: the engines only log the messages exchanged when True.
+enabled = False
+
+FORMAT = '%(asctime)s %(name)s %(message)s'
+
+
+def enable(stream=None, threaded=False):
+    """
+    :param stream: the file the log is written to (the standard error by
+        default).
+    :param bool threaded: write the log from a thread (see AsyncHandler).
+
+    Logs the messages exchanged by the protocols, with every other debug
+    record of the c2w.protocol loggers.  Returns the handler writing them.
+    """
+    global enabled
+    if threaded:
+        handler = AsyncHandler(stream or sys.stderr)
+    else:
+        handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(logging.Formatter(FORMAT))
+    logger = logging.getLogger('c2w.protocol')
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    # the root logger has its own handler (see logging.basicConfig in the
+    # protocol modules): do not write the records twice
+    logger.propagate = False
+    enabled = True
+    return handler
+
+
+def disable():
+    """
+    Stops logging the messages exchanged by the protocols.
+    """
+    global enabled
+    enabled = False
+
+
+class AsyncHandler(logging.Handler):
+
+    def __init__(self, stream, capacity=65536):
+        """
+        :param stream: the file the records are written to.
+        :param int capacity: the number of records waiting to be written
+            beyond which the new ones are dropped.
+
+        A logging handler writing its records from a thread.  emit only
+        queues the record; the thread formats the records by batches and
+        writes each batch at once.  Under load the log can be dropped
+        (see dropped), the protocol is never slowed down.
+
+        .. attribute:: dropped
+
+            The number of records dropped because the queue was full.
+        """
+        logging.Handler.__init__(self)
+        self.stream  = stream
+        self.queue   = Queue.Queue(capacity)
+        self.dropped = 0
+        self.thread  = threading.Thread(target=self.run, name='c2w-log')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        """
+        Writes the queued records until close queues None.
+        """
+        while True:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < 1024:
+                    batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                pass
+            lines = []
+            for record in batch:
+                if record is None:
+                    break
+                try:
+                    lines.append(self.format(record))
+                except Exception:
+                    self.handleError(record)
+            if lines:
+                self.stream.write('\n'.join(lines) + '\n')
+                self.stream.flush()
+            if record is None:
+                return
+
+    def close(self):
+        """
+        Writes the records still queued, then stops the thread.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(5)
+        logging.Handler.close(self)
@@ -0,0 +1,27 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import stat
+
+# Set path and import the broker
+from set_path import set_path
+set_path()
+from twisted.internet import reactor
+from c2w.protocol import Broker
+
+parser = argparse.ArgumentParser(description='Broker connecting the nodes ' +
+                                 'of a sharded c2w server (--node option ' +
+                                 'of the servers) on the same machine.')
+parser.add_argument('-s', '--socket', dest='path',
+                    help='The Unix socket to listen on.',
+                    default='/tmp/c2w-broker.sock')
+
+options = parser.parse_args()
+
+# a socket left by a previous broker
+if os.path.exists(options.path) and stat.S_ISSOCK(os.stat(options.path).st_mode):
+    os.unlink(options.path)
+reactor.listenUNIX(options.path, Broker.BrokerHub())
+reactor.run()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import logging
+import os
+import resource
+import shlex
+import subprocess
+import sys
+import time
+
+# Set path and import the protocol modules
+from set_path import set_path
+set_path()
+from twisted.internet import reactor
+from c2w.protocol import LoadGen
+from c2w.protocol import Trace
+
+parser = argparse.ArgumentParser(description='Load generator: simulated ' +
+                                 'c2w users logging in, joining rooms and ' +
+                                 'chatting against a server, with the ' +
+                                 'throughput, the delivery latency, the ' +
+                                 'retransmissions and the resources of ' +
+                                 'the server.')
+parser.add_argument('protocol', choices=('udp', 'tcp'),
+                    help='The protocol of the server.')
+parser.add_argument('--server', dest='serverAddress',
+                    help='The address of the server.', default='127.0.0.1')
+parser.add_argument('-p', '--port', dest='serverPort', type=int,
+                    help='The port of the server.', default=1900)
+parser.add_argument('-c', '--clients', dest='clients', type=int,
+                    help='The number of simulated users.', default=100)
+parser.add_argument('--ramp', dest='rampRate', type=float,
+                    help='The users logging in per second.', default=100)
+parser.add_argument('-r', '--rate', dest='chatRate', type=float,
+                    help='The chat messages sent per second by each user.',
+                    default=0.2)
+parser.add_argument('-d', '--duration', dest='duration', type=float,
+                    help='The measured time, in seconds, once the users ' +
+                    'are logged in.', default=30)
+parser.add_argument('-j', '--join', dest='joinRatio', type=float,
+                    help='The probability for a user to join the room ' +
+                    'of a movie rather than staying in the main room.',
+                    default=0.5)
+parser.add_argument('-l', '--loss-pr', dest='lossPr', type=float,
+                    help='The packet loss probability for the packets ' +
+                    'sent by the users (UDP only).', default=0)
+parser.add_argument('-s', '--size', dest='messageSize', type=int,
+                    help='The length of the chat messages.', default=32)
+parser.add_argument('--server-pid', dest='serverPid', type=int,
+                    help='The process of the server, for its CPU time ' +
+                    'and memory.', default=None)
+parser.add_argument('--metrics', dest='metricsAddress',
+                    help='The metrics address of the server (its ' +
+                    '--metrics option), for its retransmission ratio.',
+                    default=None)
+parser.add_argument('--spawn', dest='spawn',
+                    help='Start the c2w server of the protocol on the ' +
+                    'port (with --metrics if given) for the run.',
+                    action="store_true", default=False)
+parser.add_argument('--server-args', dest='serverArgs',
+                    help='More options for the server started by --spawn.',
+                    default='')
+parser.add_argument('--json', dest='json',
+                    help='Print the results as JSON.',
+                    action="store_true", default=False)
+parser.add_argument('-e', '--debug', dest='debugFlag',
+                    help='Raise the log level to debug and log the ' +
+                    'messages exchanged.',
+                    action="store_true", default=False)
+
+options = parser.parse_args()
+
+logging.basicConfig()
+if options.debugFlag:
+    Trace.enable()
+
+# one socket per user
+soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+if soft < hard:
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+server = None
+if options.spawn:
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'c2w_%s_server.py' % options.protocol)
+    command = [sys.executable, script, '-p', str(options.serverPort)]
+    if options.metricsAddress is not None:
+        command += ['--metrics', options.metricsAddress]
+    server = subprocess.Popen(command + shlex.split(options.serverArgs))
+    options.serverPid = server.pid
+    time.sleep(1)
+
+generator = LoadGen.LoadGenerator(options.protocol.upper(),
+                                  options.serverAddress, options.serverPort,
+                                  clients=options.clients,
+                                  rampRate=options.rampRate,
+                                  chatRate=options.chatRate,
+                                  duration=options.duration,
+                                  joinRatio=options.joinRatio,
+                                  lossPr=options.lossPr,
+                                  messageSize=options.messageSize,
+                                  serverPid=options.serverPid,
+                                  metricsAddress=options.metricsAddress)
+reactor.callWhenRunning(generator.start)
+try:
+    reactor.run()
+finally:
+    if server is not None:
+        server.terminate()
+        server.wait()
+
+if generator.report is None:
+    parser.exit(1, 'interrupted\n')
+if options.json:
+    print(json.dumps(generator.report, indent=2, sort_keys=True))
+else:
+    print(LoadGen.formatReport(generator.report))
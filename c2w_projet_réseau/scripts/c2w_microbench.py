@@ -0,0 +1,81 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+
+# Set path and import the protocol modules
+from set_path import set_path
+set_path()
+from c2w.protocol import Bench
+
+
+def sizes(text):
+    return tuple(int(size) for size in text.split(','))
+
+
+parser = argparse.ArgumentParser(description='Microbenchmarks of the ' +
+                                 'codec and of the message builds and ' +
+                                 'parsers of the engines, compared with ' +
+                                 'a baseline.')
+parser.add_argument('-o', '--output', dest='output',
+                    help='Write the results to this JSON file.',
+                    default=None)
+parser.add_argument('-b', '--baseline', dest='baseline',
+                    help='Compare the results with this JSON file (the ' +
+                    '--output of a previous run).', default=None)
+parser.add_argument('-t', '--threshold', dest='threshold', type=float,
+                    help='The relative slowdown beyond which a case is ' +
+                    'a regression (0.1 for 10%%).', default=0.1)
+parser.add_argument('-k', '--filter', dest='pattern',
+                    help='Only run the cases whose name contains this.',
+                    default=None)
+parser.add_argument('--users', dest='userCounts', type=sizes,
+                    help='The numbers of users of the list and broadcast ' +
+                    'cases, separated by commas.',
+                    default=Bench.USER_COUNTS)
+parser.add_argument('--movies', dest='movieCounts', type=sizes,
+                    help='The numbers of movies of the movie list cases, ' +
+                    'separated by commas (at most 255).',
+                    default=Bench.MOVIE_COUNTS)
+parser.add_argument('--min-time', dest='minTime', type=float,
+                    help='The minimum duration of a repeat, in seconds.',
+                    default=0.05)
+parser.add_argument('-r', '--repeat', dest='repeat', type=int,
+                    help='The number of repeats of each case (the best ' +
+                    'one is kept).', default=5)
+
+options = parser.parse_args()
+if max(options.movieCounts) > 255:
+    parser.error('a movieId has 8 bits: at most 255 movies')
+
+baseline = None
+if options.baseline is not None:
+    with open(options.baseline) as baselineFile:
+        baseline = json.load(baselineFile)['results']
+
+
+def progress(identifier, seconds):
+    line = '%-45s %12.3f us' % (identifier, seconds * 1e6)
+    if baseline is not None and baseline.get(identifier):
+        line += '  %+7.1f%%' % ((seconds / baseline[identifier] - 1) * 100)
+    print(line)
+
+
+results = Bench.run(options.userCounts, options.movieCounts, options.pattern,
+                    options.minTime, options.repeat, progress)
+
+if options.output is not None:
+    with open(options.output, 'w') as outputFile:
+        json.dump(Bench.document(results), outputFile, indent=2, sort_keys=True)
+        outputFile.write('\n')
+
+if baseline is not None:
+    regressions = [entry for entry in Bench.compare(results, baseline, options.threshold)
+                   if entry[4]]
+    for identifier, before, after, ratio, regression in regressions:
+        print('REGRESSION %s: %.3f us -> %.3f us (%+.1f%%)' % (
+            identifier, before * 1e6, after * 1e6, (ratio - 1) * 100))
+    if regressions:
+        parser.exit(1, '%d regression(s) beyond %.0f%%\n' % (
+            len(regressions), options.threshold * 100))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import resource
+
+# Set path and import the protocol modules
+from set_path import set_path
+set_path()
+from twisted.internet import reactor
+from c2w.protocol import Replay
+
+parser = argparse.ArgumentParser(description='Replay a capture (the ' +
+                                 '--capture option of the servers): the ' +
+                                 'messages of its clients are sent again ' +
+                                 'to a server, each client from its own ' +
+                                 'socket.')
+parser.add_argument('capture', help='The capture file.')
+parser.add_argument('--server', dest='serverAddress',
+                    help='The address of the server.', default='127.0.0.1')
+parser.add_argument('-p', '--port', dest='serverPort', type=int,
+                    help='The port of the server.', default=1900)
+parser.add_argument('--speed', dest='speed', type=float,
+                    help='The replay speed: 1 for the pace of the ' +
+                    'capture, 2 for twice as fast, 0 for as fast as ' +
+                    'possible.', default=1)
+parser.add_argument('--linger', dest='linger', type=float,
+                    help='How long the answers of the server are still ' +
+                    'counted after the last message, in seconds.',
+                    default=2)
+parser.add_argument('--json', dest='json',
+                    help='Print the results as JSON.',
+                    action="store_true", default=False)
+
+options = parser.parse_args()
+if options.speed < 0:
+    parser.error('the speed cannot be negative')
+
+# one socket per client of the capture
+soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+if soft < hard:
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+try:
+    replayer = Replay.Replayer(options.capture, options.serverAddress,
+                               options.serverPort,
+                               speed=options.speed or None,
+                               linger=options.linger)
+except (IOError, ValueError) as error:
+    parser.error(str(error))
+reactor.callWhenRunning(replayer.start)
+reactor.run()
+
+if replayer.report is None:
+    parser.exit(1, 'interrupted\n')
+if options.json:
+    print(json.dumps(replayer.report, indent=2, sort_keys=True))
+else:
+    print(Replay.formatReport(replayer.report))
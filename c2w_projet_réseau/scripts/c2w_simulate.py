@@ -0,0 +1,109 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import logging
+import time
+
+# Set path and import the protocol modules
+from set_path import set_path
+set_path()
+from c2w.protocol import LoadGen
+from c2w.protocol import Simulator
+from c2w.protocol import Trace
+
+parser = argparse.ArgumentParser(description='Load scenario on a simulated ' +
+                                 'network: a c2w server and its users in ' +
+                                 'one process, on a virtual clock, with ' +
+                                 'the latency, jitter, loss, duplication ' +
+                                 'and reordering of the links.  The same ' +
+                                 'seed gives the same run.')
+parser.add_argument('protocol', choices=('udp', 'tcp'),
+                    help='The protocol of the server.')
+parser.add_argument('-c', '--clients', dest='clients', type=int,
+                    help='The number of simulated users.', default=1000)
+parser.add_argument('-d', '--duration', dest='duration', type=float,
+                    help='The measured time, in simulated seconds, once ' +
+                    'the users are logged in.', default=3600)
+parser.add_argument('--ramp', dest='rampRate', type=float,
+                    help='The users logging in per second.', default=100)
+parser.add_argument('-r', '--rate', dest='chatRate', type=float,
+                    help='The chat messages sent per second by each user.',
+                    default=0.01)
+parser.add_argument('-j', '--join', dest='joinRatio', type=float,
+                    help='The probability for a user to join the room ' +
+                    'of a movie rather than staying in the main room.',
+                    default=0.5)
+parser.add_argument('-s', '--size', dest='messageSize', type=int,
+                    help='The length of the chat messages.', default=32)
+parser.add_argument('--movies', dest='movieCount', type=int,
+                    help='The number of movies of the server.', default=16)
+parser.add_argument('--latency', dest='latency', type=float,
+                    help='The one way delay of the links, in seconds.',
+                    default=0.01)
+parser.add_argument('--jitter', dest='jitter', type=float,
+                    help='The random delay added to each packet, up to ' +
+                    'this many seconds.', default=0)
+parser.add_argument('-l', '--loss-pr', dest='loss', type=float,
+                    help='The packet loss probability (UDP only).',
+                    default=0)
+parser.add_argument('--duplicate', dest='duplicate', type=float,
+                    help='The probability for a packet to be delivered ' +
+                    'twice (UDP only).', default=0)
+parser.add_argument('--reorder', dest='reorder', type=float,
+                    help='The probability for a packet to be overtaken ' +
+                    'by the next ones (UDP only).', default=0)
+parser.add_argument('--seed', dest='seed', type=int,
+                    help='The seed of the simulation.', default=0)
+parser.add_argument('--json', dest='json',
+                    help='Print the results as JSON.',
+                    action="store_true", default=False)
+parser.add_argument('-e', '--debug', dest='debugFlag',
+                    help='Raise the log level to debug and log the ' +
+                    'messages exchanged.',
+                    action="store_true", default=False)
+
+options = parser.parse_args()
+if not 0 < options.movieCount < 256:
+    parser.error('a movieId has 8 bits: 1 to 255 movies')
+
+logging.basicConfig()
+if options.debugFlag:
+    Trace.enable()
+
+profile = Simulator.LinkProfile(latency=options.latency, jitter=options.jitter,
+                                loss=options.loss, duplicate=options.duplicate,
+                                reorder=options.reorder)
+wallStart = time.time()
+load, network = Simulator.simulate(options.protocol.upper(),
+                                   clients=options.clients,
+                                   duration=options.duration,
+                                   profile=profile,
+                                   seed=options.seed,
+                                   movieCount=options.movieCount,
+                                   rampRate=options.rampRate,
+                                   chatRate=options.chatRate,
+                                   joinRatio=options.joinRatio,
+                                   messageSize=options.messageSize)
+wallTime = time.time() - wallStart
+
+if load.report is None:
+    parser.exit(1, 'the scenario did not finish\n')
+simulation = {'simulated_seconds': network.clock.seconds(),
+              'wall_seconds': wallTime,
+              'events': network.clock.processed,
+              'failures': network.clock.failures,
+              'datagrams': network.stats()}
+if options.json:
+    report = dict(load.report, simulation=simulation)
+    print(json.dumps(report, indent=2, sort_keys=True))
+else:
+    print(LoadGen.formatReport(load.report))
+    print('simulated %.1f s in %.1f s of wall time, %d events (%d failed)' % (
+        simulation['simulated_seconds'], wallTime, simulation['events'],
+        simulation['failures']))
+    if options.protocol == 'udp':
+        print('datagrams: %(sent)d sent, %(delivered)d delivered, %(lost)d lost, '
+              '%(duplicated)d duplicated, %(reordered)d reordered, '
+              '%(undeliverable)d undeliverable' % simulation['datagrams'])
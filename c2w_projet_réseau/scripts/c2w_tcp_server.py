@@ -9,6 +9,12 @@ import os
 from set_path import set_path
 set_path()
 from  c2w.main.c2w_server import C2wStart
+from c2w.protocol.tcp_chat_server import c2wTcpChatServerProtocol
+from c2w.protocol.ServerEngine import StreamServerEngine
+from c2w.protocol import Trace
+from c2w.protocol import Capture
+from c2w.protocol import Profiler
+from c2w.protocol import Metrics
 
 # Settings
 protocol = 'TCP'
@@ -30,17 +36,97 @@ parser.add_argument('-s', '--stream-video',
                     action="store_true", default=False)
 parser.add_argument('-e', '--debug',
                     dest='debugFlag',
-                    help='Raise the log level to debug',
+                    help='Raise the log level to debug and log the ' +
+                    'messages exchanged.',
                     action="store_true",
                     default=False)
+parser.add_argument('--async-log', dest='asyncLog',
+                    help='With --debug, write the log of the messages ' +
+                    'from a thread so that the protocol never waits ' +
+                    'for the output.',
+                    action="store_true", default=False)
+parser.add_argument('--no-reliable-transport', dest='reliableTransport',
+                    help='Refuse the reliable transport mode offered by ' +
+                    'the clients, acknowledge and retransmit every message.',
+                    action="store_false", default=True)
+parser.add_argument('--node', dest='node',
+                    help='Run as the node NODE of a sharded server: the ' +
+                    'users are shared with the other nodes through the ' +
+                    'broker and the movie rooms are divided among them.',
+                    default=None)
+parser.add_argument('--nodes', dest='nodes',
+                    help='The comma separated names of all the nodes, ' +
+                    'in the same order on every node.', default=None)
+parser.add_argument('--broker', dest='broker',
+                    help='The Unix socket of the broker connecting the ' +
+                    'nodes (see c2w_broker.py).',
+                    default='/tmp/c2w-broker.sock')
+parser.add_argument('--metrics', dest='metrics', metavar='ADDRESS',
+                    help='Serve the metrics of the server in the ' +
+                    'Prometheus text format over HTTP on ADDRESS: a ' +
+                    'port of the loopback interface, or the path of a ' +
+                    'Unix socket.', default=None)
+parser.add_argument('--capture', dest='capture', metavar='FILE',
+                    help='Append every message received and sent to ' +
+                    'the capture FILE, to be replayed by ' +
+                    'c2w_replay.py.', default=None)
+parser.add_argument('--profile-duration', dest='profileDuration', type=float,
+                    help='The length, in seconds, of the profile taken ' +
+                    'on SIGUSR1 (kill -USR1 <pid>; again to stop it ' +
+                    'early).  The samples are written in the folded ' +
+                    'stacks format of flamegraph.pl.', default=30)
+parser.add_argument('--profile-dir', dest='profileDir',
+                    help='The directory of the profiles (the temporary ' +
+                    'directory by default).', default=None)
+parser.add_argument('--loop', dest='loop', choices=('twisted', 'asyncio'),
+                    help='The event loop running the server.  The ' +
+                    'asyncio server runs on trollius, the asyncio ' +
+                    'backport of python 2.  It is not the same as the ' +
+                    'twisted server: it keeps its users and movies in ' +
+                    'memory (see --movie) and streams no video.',
+                    default='twisted')
+parser.add_argument('--movie', dest='movies', action='append', default=[],
+                    metavar='TITLE:IP:PORT',
+                    help='A movie of the asyncio server (repeat the ' +
+                    'option for each movie).  The twisted server has ' +
+                    'the movies of c2w.main.')
 
 options = parser.parse_args()
 
+if options.debugFlag:
+    Trace.enable(threaded=options.asyncLog)
+Profiler.install(duration=options.profileDuration, directory=options.profileDir)
+StreamServerEngine.reliableTransport = options.reliableTransport
+if options.loop == 'asyncio' and (options.node is not None or options.streamVideoFlag):
+    parser.error('--node and --stream-video need the twisted loop')
+if options.loop == 'twisted' and options.movies:
+    parser.error('--movie needs the asyncio loop')
+if options.node is not None:
+    nodes = options.nodes.split(',') if options.nodes else [options.node]
+    if options.node not in nodes:
+        parser.error('--nodes must include the node %s' % options.node)
+    from c2w.protocol import Broker, Sharding
+    broker = Broker.UnixBroker(options.broker)
+    c2wTcpChatServerProtocol.cluster = Sharding.Node(options.node, nodes, broker)
+if options.capture is not None:
+    Capture.enable(options.capture, protocol)
+
 
-# Call start function
-C2wStart(protocol,
-         options.server_port,
-         options.noVideoFlag,
-         options.streamVideoFlag,
-         options.debugFlag, 
-         0)
+if options.loop == 'asyncio':
+    from c2w.protocol import AioServer
+    try:
+        movies = [AioServer.parseMovie(spec) for spec in options.movies]
+    except ValueError:
+        parser.error('--movie must be given as TITLE:IP:PORT')
+    AioServer.serve(protocol, options.server_port, movies, 0,
+                    metricsAddress=options.metrics)
+else:
+    if options.metrics is not None:
+        Metrics.listen(options.metrics)
+    # Call start function
+    C2wStart(protocol,
+             options.server_port,
+             options.noVideoFlag,
+             options.streamVideoFlag,
+             options.debugFlag, 
+             0)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+import argparse
+import socket
+import time
+
+# Set path and import the protocol modules
+from set_path import set_path
+set_path()
+from twisted.internet import reactor
+from twisted.internet.protocol import DatagramProtocol
+from c2w.protocol import Mmsg
+
+parser = argparse.ArgumentParser(description='Loopback benchmark of the ' +
+                                 'batched UDP socket calls (Mmsg) against ' +
+                                 'the plain twisted UDP port.')
+parser.add_argument('-n', '--datagrams', dest='datagrams', type=int,
+                    help='The number of datagrams sent and received by ' +
+                    'each run.', default=200000)
+parser.add_argument('-r', '--recipients', dest='recipients', type=int,
+                    help='The number of recipients of each broadcast.',
+                    default=32)
+parser.add_argument('-s', '--size', dest='size', type=int,
+                    help='The size of the datagrams, in bytes.',
+                    default=64)
+parser.add_argument('-b', '--batch', dest='batchSize', type=int,
+                    help='The maximum number of datagrams per batched ' +
+                    'system call.', default=64)
+
+options = parser.parse_args()
+
+
+class Counter(DatagramProtocol):
+
+    def __init__(self):
+        self.received = 0
+
+    def datagramReceived(self, datagram, addr):
+        self.received += 1
+
+
+def benchSend(write, flush, recipients, datagram, count):
+    """
+    Broadcasts datagram to recipients until count datagrams are written,
+    flushing after each broadcast as the reactor would after each
+    received message.  Returns the elapsed time.
+    """
+    start = time.time()
+    written = 0
+    while written < count:
+        for addr in recipients:
+            write(datagram, addr)
+        flush()
+        written += len(recipients)
+    return time.time() - start
+
+
+def benchReceive(port, protocol, doRead, datagram, count, burst=1000):
+    """
+    Sends bursts of datagrams to port from a plain socket and times the
+    doRead calls draining them.  Returns (elapsed time, datagrams
+    received).
+    """
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    addr = ('127.0.0.1', port.getHost().port)
+    protocol.received = 0
+    elapsed = 0.0
+    sent = 0
+    while sent < count:
+        for i in xrange(burst):
+            sender.sendto(datagram, addr)
+        sent += burst
+        start = time.time()
+        doRead()
+        elapsed += time.time() - start
+    sender.close()
+    return (elapsed, protocol.received)
+
+
+if not Mmsg.available():
+    parser.exit(1, 'recvmmsg/sendmmsg are not available on this system\n')
+
+sinks = []
+for i in xrange(options.recipients):
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    sinks.append(sink)
+recipients = [sink.getsockname() for sink in sinks]
+datagram = 'x' * options.size
+
+protocol = Counter()
+port = reactor.listenUDP(0, protocol, interface='127.0.0.1')
+port.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+port.maxThroughput = 1 << 30
+batched = Mmsg.BatchedPort(port, options.batchSize)
+
+results = []
+elapsed = benchSend(port.write, lambda: None, recipients, datagram,
+                    options.datagrams)
+results.append(('send', 'plain', options.datagrams, elapsed))
+batched.install()
+elapsed = benchSend(port.write, batched.flush, recipients, datagram,
+                    options.datagrams)
+results.append(('send', 'batched', options.datagrams, elapsed))
+batched.uninstall()
+
+elapsed, received = benchReceive(port, protocol, port.doRead, datagram,
+                                 options.datagrams)
+results.append(('receive', 'plain', received, elapsed))
+batched.install()
+elapsed, received = benchReceive(port, protocol, port.doRead, datagram,
+                                 options.datagrams)
+results.append(('receive', 'batched', received, elapsed))
+batched.uninstall()
+port.stopListening()
+
+print('%-8s %-8s %10s %10s %14s' % ('path', 'mode', 'datagrams', 'seconds',
+                                    'datagrams/s'))
+for path, mode, count, elapsed in results:
+    print('%-8s %-8s %10d %10.3f %14.0f' % (path, mode, count, elapsed,
+                                             count / elapsed if elapsed else 0))
+for path in ('send', 'receive'):
+    plain, batch = [r for r in results if r[0] == path]
+    if plain[3] and batch[3]:
+        print('%s speedup: %.2fx' % (path, (batch[2] / batch[3]) / (plain[2] / plain[3])))
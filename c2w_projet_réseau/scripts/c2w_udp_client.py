@@ -9,6 +9,8 @@ import os
 from set_path import set_path
 set_path()
 from  c2w.main.c2w_client import C2wStart
+from c2w.protocol.ClientEngine import DatagramClientEngine
+from c2w.protocol import Trace
 
 # Settings
 protocol = 'UDP'
@@ -16,18 +18,58 @@ protocol = 'UDP'
 parser = argparse.ArgumentParser(description='c2w Client (UDP Version)')
 parser.add_argument('-e', '--debug',
                     dest='debugFlag',
-                    help='Raise the log level to debug',
+                    help='Raise the log level to debug and log the ' +
+                    'messages exchanged.',
                     action="store_true",
                     default=False)
+parser.add_argument('--async-log', dest='asyncLog',
+                    help='With --debug, write the log of the messages ' +
+                    'from a thread so that the protocol never waits ' +
+                    'for the output.',
+                    action="store_true", default=False)
 parser.add_argument('-l', '--loss-pr', dest='lossPr',
                     help='The packet loss probability for outgoing ' +
                     'packets.', type=float, default=0)
+parser.add_argument('--no-cumulative-acks', dest='cumulativeAcks',
+                    help='Do not offer cumulative acknowledgements to ' +
+                    'the server, acknowledge every message on its own.',
+                    action="store_false", default=True)
+parser.add_argument('--loop', dest='loop', choices=('twisted', 'asyncio'),
+                    help='The event loop running the client.  The ' +
+                    'asyncio client runs on trollius, the asyncio ' +
+                    'backport of python 2, and has no user interface: ' +
+                    'it logs in as --user, prints what happens and ' +
+                    'reads the chat messages and the ' +
+                    '/join TITLE, /main and /quit commands on its ' +
+                    'standard input.', default='twisted')
+parser.add_argument('--server', dest='serverAddress',
+                    help='The address of the server (asyncio client).',
+                    default='127.0.0.1')
+parser.add_argument('-p', '--port', dest='serverPort', type=int,
+                    help='The port of the server (asyncio client).',
+                    default=1900)
+parser.add_argument('-u', '--user', dest='userName',
+                    help='The user name (asyncio client).', default=None)
+parser.add_argument('--room', dest='roomName',
+                    help='The movie room to join once logged in ' +
+                    '(asyncio client).', default=None)
 
 options = parser.parse_args()
 
+if options.debugFlag:
+    Trace.enable(threaded=options.asyncLog)
+DatagramClientEngine.cumulativeAcks = options.cumulativeAcks
 
-# Call start function
-C2wStart(protocol,
-         options.debugFlag, 
-         options.lossPr)
+
+if options.loop == 'asyncio':
+    if options.userName is None:
+        parser.error('the asyncio client needs a --user')
+    from c2w.protocol import AioClient
+    AioClient.run(protocol, options.serverAddress, options.serverPort,
+                  options.userName, options.roomName, options.lossPr)
+else:
+    # Call start function
+    C2wStart(protocol,
+             options.debugFlag, 
+             options.lossPr)
 
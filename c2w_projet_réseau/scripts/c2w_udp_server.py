@@ -5,10 +5,35 @@ import argparse
 import subprocess
 import os
 
-# Set path and import C2wStart
+# Set path
 from set_path import set_path
 set_path()
+from c2w.protocol import Cluster
+
+# With several workers, they are forked before the imports below install
+# the reactor: each worker must have its own.  Not with --node or --movie,
+# refused below once rather than by every worker.
+preParser = argparse.ArgumentParser(add_help=False)
+preParser.add_argument('-p', '--port', dest='server_port', type=int,
+                       default=1900)
+preParser.add_argument('--workers', dest='workers', type=int, default=1)
+preParser.add_argument('--loop', dest='loop', default='twisted')
+preParser.add_argument('--node', dest='node', default=None)
+preParser.add_argument('--movie', dest='movies', action='append', default=[])
+preOptions = preParser.parse_known_args()[0]
+worker = None
+if (preOptions.workers > 1 and preOptions.loop == 'twisted'
+    and preOptions.node is None and not preOptions.movies):
+    worker = Cluster.fork(preOptions.workers, preOptions.server_port)
+
+# Import C2wStart
 from  c2w.main.c2w_server import C2wStart
+from c2w.protocol.udp_chat_server import c2wUdpChatServerProtocol
+from c2w.protocol.ServerEngine import DatagramServerEngine
+from c2w.protocol import Trace
+from c2w.protocol import Capture
+from c2w.protocol import Profiler
+from c2w.protocol import Metrics
 
 # Settings
 protocol = 'UDP'
@@ -30,21 +55,141 @@ parser.add_argument('-s', '--stream-video',
                     action="store_true", default=False)
 parser.add_argument('-e', '--debug',
                     dest='debugFlag',
-                    help='Raise the log level to debug',
+                    help='Raise the log level to debug and log the ' +
+                    'messages exchanged.',
                     action="store_true",
                     default=False)
+parser.add_argument('--async-log', dest='asyncLog',
+                    help='With --debug, write the log of the messages ' +
+                    'from a thread so that the protocol never waits ' +
+                    'for the output.',
+                    action="store_true", default=False)
 parser.add_argument('-l', '--loss-pr', dest='lossPr',
                     help='The packet loss probability for outgoing ' +
                     'packets.', type=float, default=0)
+parser.add_argument('-w', '--window', dest='sendWindowSize', type=int,
+                    help='The number of messages sent to a client ' +
+                    'without waiting for their acknowledgement.',
+                    default=DatagramServerEngine.sendWindowSize)
+parser.add_argument('--no-cumulative-acks', dest='cumulativeAcks',
+                    help='Acknowledge every message on its own, even ' +
+                    'for the clients offering cumulative acknowledgements.',
+                    action="store_false", default=True)
+parser.add_argument('-q', '--queue-length', dest='maxQueueLength', type=int,
+                    help='The number of messages queued for a client ' +
+                    'behind its send window.  When the queue is full ' +
+                    'old chat messages are dropped.',
+                    default=DatagramServerEngine.maxQueueLength)
+
+parser.add_argument('-b', '--batched-io', dest='batchedIo',
+                    help='Send and receive the datagrams by batches ' +
+                    '(recvmmsg/sendmmsg, Linux only).',
+                    action="store_true", default=False)
+parser.add_argument('--workers', dest='workers', type=int,
+                    help='The number of server processes sharing the ' +
+                    'port (SO_REUSEPORT).  The users are spread among ' +
+                    'them by address.', default=1)
+parser.add_argument('--node', dest='node',
+                    help='Run as the node NODE of a sharded server: the ' +
+                    'users are shared with the other nodes through the ' +
+                    'broker and the movie rooms are divided among them.',
+                    default=None)
+parser.add_argument('--nodes', dest='nodes',
+                    help='The comma separated names of all the nodes, ' +
+                    'in the same order on every node.', default=None)
+parser.add_argument('--broker', dest='broker',
+                    help='The Unix socket of the broker connecting the ' +
+                    'nodes (see c2w_broker.py).',
+                    default='/tmp/c2w-broker.sock')
+parser.add_argument('--metrics', dest='metrics', metavar='ADDRESS',
+                    help='Serve the metrics of the server in the ' +
+                    'Prometheus text format over HTTP on ADDRESS: a ' +
+                    'port of the loopback interface, or the path of a ' +
+                    'Unix socket.  With --workers, worker i adds i to the port (or ' +
+                    '.i to the path).', default=None)
+parser.add_argument('--capture', dest='capture', metavar='FILE',
+                    help='Append every message received and sent to ' +
+                    'the capture FILE, to be replayed by ' +
+                    'c2w_replay.py.  With --workers, worker i writes ' +
+                    'to FILE.i.', default=None)
+parser.add_argument('--profile-duration', dest='profileDuration', type=float,
+                    help='The length, in seconds, of the profile taken ' +
+                    'on SIGUSR1 (kill -USR1 <pid>; again to stop it ' +
+                    'early).  The samples are written in the folded ' +
+                    'stacks format of flamegraph.pl.  With --workers, ' +
+                    'the supervisor passes the signal on to every ' +
+                    'worker.', default=30)
+parser.add_argument('--profile-dir', dest='profileDir',
+                    help='The directory of the profiles (the temporary ' +
+                    'directory by default).', default=None)
+parser.add_argument('--loop', dest='loop', choices=('twisted', 'asyncio'),
+                    help='The event loop running the server.  The ' +
+                    'asyncio server runs on trollius, the asyncio ' +
+                    'backport of python 2.  It is not the same as the ' +
+                    'twisted server: it keeps its users and movies in ' +
+                    'memory (see --movie) and streams no video.',
+                    default='twisted')
+parser.add_argument('--movie', dest='movies', action='append', default=[],
+                    metavar='TITLE:IP:PORT',
+                    help='A movie of the asyncio server (repeat the ' +
+                    'option for each movie).  The twisted server has ' +
+                    'the movies of c2w.main.')
 
 options = parser.parse_args()
 
+if options.debugFlag:
+    Trace.enable(threaded=options.asyncLog)
+Profiler.install(duration=options.profileDuration, directory=options.profileDir)
+DatagramServerEngine.sendWindowSize = options.sendWindowSize
+DatagramServerEngine.cumulativeAcks = options.cumulativeAcks
+DatagramServerEngine.maxQueueLength = options.maxQueueLength
+c2wUdpChatServerProtocol.batchedIo = options.batchedIo
+if options.loop == 'asyncio' and (options.workers > 1 or options.node is not None
+                                  or options.batchedIo or options.streamVideoFlag):
+    parser.error('--workers, --node, --batched-io and --stream-video need the twisted loop')
+if options.loop == 'twisted' and options.movies:
+    parser.error('--movie needs the asyncio loop')
+if options.node is not None and options.workers > 1:
+    parser.error('--node and --workers cannot be used together')
+if worker is not None:
+    c2wUdpChatServerProtocol.cluster = worker
+    worker.install()
+if options.node is not None:
+    nodes = options.nodes.split(',') if options.nodes else [options.node]
+    if options.node not in nodes:
+        parser.error('--nodes must include the node %s' % options.node)
+    from c2w.protocol import Broker, Sharding
+    broker = Broker.UnixBroker(options.broker)
+    c2wUdpChatServerProtocol.cluster = Sharding.Node(options.node, nodes, broker)
+if options.capture is not None:
+    capturePath = options.capture
+    if worker is not None:
+        capturePath = '%s.%d' % (capturePath, worker.index)
+    Capture.enable(capturePath, protocol)
+
 
-# Call start function
-C2wStart(protocol,
-         options.server_port,
-         options.noVideoFlag,
-         options.streamVideoFlag,
-         options.debugFlag, 
-         options.lossPr)
+if options.loop == 'asyncio':
+    from c2w.protocol import AioServer
+    try:
+        movies = [AioServer.parseMovie(spec) for spec in options.movies]
+    except ValueError:
+        parser.error('--movie must be given as TITLE:IP:PORT')
+    AioServer.serve(protocol, options.server_port, movies, options.lossPr,
+                    metricsAddress=options.metrics)
+else:
+    if options.metrics is not None:
+        metricsAddress = options.metrics
+        if worker is not None:
+            if metricsAddress.isdigit():
+                metricsAddress = str(int(metricsAddress) + worker.index)
+            else:
+                metricsAddress = '%s.%d' % (metricsAddress, worker.index)
+        Metrics.listen(metricsAddress)
+    # Call start function
+    C2wStart(protocol,
+             options.server_port,
+             options.noVideoFlag,
+             options.streamVideoFlag,
+             options.debugFlag, 
+             options.lossPr)
 
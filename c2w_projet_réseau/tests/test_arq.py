@@ -0,0 +1,206 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+"""
+The send and receive windows of Arq, including across the wrap of the 11
+bits sequence numbers.
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'scripts'))
+from set_path import set_path
+set_path()
+from c2w.protocol import Arq
+from c2w.protocol import Codec
+
+
+class RecordingRtt(object):
+
+    def __init__(self):
+        self.samples = []
+
+    def sample(self, rtt):
+        self.samples.append(rtt)
+
+
+class SeqTest(unittest.TestCase):
+
+    def testWrap(self):
+        self.assertEqual(Arq.seqAdd(Arq.SEQ_MODULO - 1, 1), 0)
+        self.assertEqual(Arq.seqAdd(5, Arq.SEQ_MODULO), 5)
+        self.assertEqual(Arq.seqDiff(1, Arq.SEQ_MODULO - 2), 3)
+        self.assertEqual(Arq.seqDiff(4, 4), 0)
+
+    def testStepsAroundTheSequenceSpace(self):
+        seqNbr = 0
+        for _ in xrange(3 * Arq.SEQ_MODULO):
+            seqNbr = Arq.seqAdd(seqNbr, 1)
+            self.assertTrue(0 <= seqNbr < Arq.SEQ_MODULO)
+        self.assertEqual(seqNbr, 0)
+
+
+class SendWindowTest(unittest.TestCase):
+
+    def pushed(self, window, count, msgType=14):
+        for index in xrange(count):
+            window.push(msgType, 'message %d' % index)
+        return window.admit()
+
+    def testAdmitUpToTheWindowSize(self):
+        window = Arq.SendWindow(windowSize=4)
+        admitted = self.pushed(window, 6)
+        self.assertEqual([outstanding.seqNbr for outstanding in admitted], [0, 1, 2, 3])
+        self.assertEqual(len(window.pending), 2)
+        self.assertEqual(window.admit(), [])
+        self.assertEqual(Codec.decode(admitted[2].msgBuf)[:2], (2, 14))
+
+    def testInOrderAcksSlide(self):
+        window = Arq.SendWindow(windowSize=4)
+        self.pushed(window, 6)
+        self.assertEqual(window.ack(0).seqNbr, 0)
+        self.assertEqual(window.base, 1)
+        self.assertEqual([outstanding.seqNbr for outstanding in window.admit()], [4])
+        self.assertEqual(window.admit(), [])
+
+    def testOutOfOrderAckWaitsForTheGap(self):
+        window = Arq.SendWindow(windowSize=4)
+        self.pushed(window, 4)
+        window.ack(2)
+        window.ack(1)
+        self.assertEqual(window.base, 0)
+        window.ack(0)
+        self.assertEqual(window.base, 3)
+
+    def testDuplicateAck(self):
+        window = Arq.SendWindow(windowSize=2)
+        self.pushed(window, 2)
+        self.assertIsNotNone(window.ack(0))
+        self.assertIsNone(window.ack(0))
+        self.assertIsNone(window.ack(7))
+
+    def testCumulativeAckWithSack(self):
+        window = Arq.SendWindow(windowSize=8)
+        self.pushed(window, 8)
+        acked = window.ackCumulative(3, sackBitmap=0b101)
+        self.assertEqual([outstanding.seqNbr for outstanding in acked], [0, 1, 2, 4, 6])
+        self.assertEqual(window.base, 3)
+        self.assertEqual(sorted(window.inFlight), [3, 5, 7])
+
+    def testLateAndBogusCumulativeAcks(self):
+        window = Arq.SendWindow(windowSize=4)
+        self.pushed(window, 4)
+        window.ackCumulative(2)
+        self.assertEqual(window.ackCumulative(1), [])
+        self.assertEqual(window.ackCumulative(100), [])
+        self.assertEqual(window.base, 2)
+
+    def testWrapAround(self):
+        window = Arq.SendWindow(windowSize=4, firstSeqNbr=Arq.SEQ_MODULO - 2)
+        admitted = self.pushed(window, 4)
+        self.assertEqual([outstanding.seqNbr for outstanding in admitted],
+                         [Arq.SEQ_MODULO - 2, Arq.SEQ_MODULO - 1, 0, 1])
+        acked = window.ackCumulative(1)
+        self.assertEqual(len(acked), 3)
+        self.assertEqual(window.base, 1)
+        window.ack(1)
+        self.assertEqual(window.base, window.nextSeqNbr)
+        self.assertEqual(window.nextSeqNbr, 2)
+
+    def testKarnsRule(self):
+        rtt = RecordingRtt()
+        window = Arq.SendWindow(windowSize=2, rtt=rtt)
+        first, second = self.pushed(window, 2)
+        first.tries, first.sentAt = 1, 10.0
+        second.tries, second.sentAt = 2, 10.0
+        window.ack(0, now=10.25)
+        window.ack(1, now=10.5)
+        self.assertEqual(rtt.samples, [0.25])
+
+    def testFullQueueDropsTheOldestDroppable(self):
+        window = Arq.SendWindow(windowSize=1, maxPending=2, droppableTypes=(14,))
+        window.push(9, 'notification')
+        window.admit()
+        window.push(14, 'old chat')
+        window.push(11, 'notification')
+        self.assertEqual(window.push(14, 'new chat'), (14, 'old chat'))
+        self.assertEqual(list(window.pending), [(11, 'notification'), (14, 'new chat')])
+        self.assertEqual(window.dropped, 1)
+
+    def testFullQueueOverflows(self):
+        window = Arq.SendWindow(windowSize=1, maxPending=2, droppableTypes=(14,))
+        window.push(9)
+        window.admit()
+        window.push(10)
+        window.push(11)
+        self.assertEqual(window.push(14, 'chat'), (14, 'chat'))
+        self.assertRaises(Arq.QueueOverflow, window.push, 9)
+        self.assertEqual(len(window.pending), 2)
+
+    def testClose(self):
+        window = Arq.SendWindow(windowSize=2)
+        self.pushed(window, 4)
+        window.close()
+        self.assertEqual((window.inFlight, len(window.pending)), ({}, 0))
+        self.assertEqual(window.base, window.nextSeqNbr)
+
+    def testWindowSizeLimits(self):
+        self.assertRaises(ValueError, Arq.SendWindow, windowSize=0)
+        self.assertRaises(ValueError, Arq.SendWindow, windowSize=Arq.MAX_WINDOW + 1)
+
+
+class ReceiveWindowTest(unittest.TestCase):
+
+    def testInOrder(self):
+        window = Arq.ReceiveWindow()
+        self.assertEqual(window.receive(0, 'a'), ['a'])
+        self.assertEqual(window.receive(1, 'b'), ['b'])
+        self.assertEqual(window.expected, 2)
+
+    def testHeldUntilTheGapIsFilled(self):
+        window = Arq.ReceiveWindow()
+        self.assertEqual(window.receive(2, 'c'), [])
+        self.assertEqual(window.receive(1, 'b'), [])
+        self.assertEqual(window.receive(0, 'a'), ['a', 'b', 'c'])
+        self.assertEqual(window.held, {})
+
+    def testDuplicates(self):
+        window = Arq.ReceiveWindow()
+        window.receive(0, 'a')
+        window.receive(2, 'c')
+        self.assertIsNone(window.receive(0, 'a'))
+        self.assertIsNone(window.receive(2, 'c'))
+        self.assertEqual(window.duplicates, 2)
+
+    def testBeyondTheWindowIsOld(self):
+        window = Arq.ReceiveWindow(windowSize=4)
+        self.assertIsNone(window.receive(4, 'e'))
+        self.assertEqual(window.receive(3, 'd'), [])
+
+    def testWrapAround(self):
+        window = Arq.ReceiveWindow(expectedSeqNbr=Arq.SEQ_MODULO - 1)
+        self.assertEqual(window.receive(0, 'b'), [])
+        self.assertEqual(window.receive(Arq.SEQ_MODULO - 1, 'a'), ['a', 'b'])
+        self.assertEqual(window.expected, 1)
+        self.assertIsNone(window.receive(Arq.SEQ_MODULO - 1, 'a'))
+
+
+class DuplicateFilterTest(unittest.TestCase):
+
+    def testRepeatedAndOldMessages(self):
+        duplicateFilter = Arq.DuplicateFilter()
+        self.assertFalse(duplicateFilter.isDuplicate(0))
+        self.assertTrue(duplicateFilter.isDuplicate(0))
+        self.assertFalse(duplicateFilter.isDuplicate(3))
+        self.assertTrue(duplicateFilter.isDuplicate(1))
+        self.assertEqual(duplicateFilter.duplicates, 2)
+
+    def testWrapAround(self):
+        duplicateFilter = Arq.DuplicateFilter(Arq.SEQ_MODULO - 1)
+        self.assertFalse(duplicateFilter.isDuplicate(0))
+        self.assertTrue(duplicateFilter.isDuplicate(Arq.SEQ_MODULO - 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
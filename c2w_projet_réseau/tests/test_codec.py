@@ -0,0 +1,124 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+"""
+Round trips of every message type through the Codec encoders and decoders.
+"""
+import os
+import socket
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'scripts'))
+from set_path import set_path
+set_path()
+from c2w.protocol import Codec
+
+
+def hostOf(ipAddress):
+    return struct.unpack('!I', socket.inet_aton(ipAddress))[0]
+
+
+class HeadTest(unittest.TestCase):
+
+    def testEverySeqNbrAndType(self):
+        for seqNbr in (0, 1, 1023, 1024, Codec.SEQ_MASK):
+            for msgType in xrange(Codec.TYPE_MASK + 1):
+                head = Codec.packHead(seqNbr, msgType)
+                self.assertEqual(len(head), Codec.HEAD_SIZE)
+                self.assertEqual(Codec.unpackHead(head), (seqNbr, msgType))
+
+    def testSeqNbrKeepsElevenBits(self):
+        self.assertEqual(Codec.unpackHead(Codec.packHead(Codec.SEQ_MASK + 1, 3)), (0, 3))
+
+    def testFrameLength(self):
+        message = Codec.frame(7, 13, 'hello')
+        self.assertEqual(Codec.unpackLen(message), len(message))
+        self.assertEqual(Codec.messageLength(message), len(message))
+        self.assertEqual(Codec.getBody(message), 'hello')
+
+    def testHeadOnlyTypes(self):
+        for msgType in Codec.HEAD_ONLY_TYPES:
+            message = Codec.build(9, msgType)
+            self.assertEqual(len(message), Codec.HEAD_SIZE)
+            self.assertEqual(Codec.messageLength(message), Codec.HEAD_SIZE)
+
+
+class MessageTest(unittest.TestCase):
+
+    def roundTrip(self, msgType, seqNbr, *fields):
+        message = Codec.encode(msgType, seqNbr, *fields)
+        decodedSeqNbr, decodedType, decoded = Codec.decode(message)
+        self.assertEqual((decodedSeqNbr, decodedType), (seqNbr, msgType))
+        return decoded
+
+    def testAck(self):
+        self.assertEqual(self.roundTrip(0, 2047), ())
+
+    def testExtendedAck(self):
+        self.assertEqual(Codec.decode(Codec.encodeExtendedAck(12, 0x80000005)),
+                         (12, 4, (0x80000005,)))
+
+    def testLogin(self):
+        self.assertEqual(self.roundTrip(1, 0, 'alice'), ('alice',))
+
+    def testLeaveSystem(self):
+        self.assertEqual(self.roundTrip(2, 5), ())
+
+    def testJoinRoom(self):
+        for movieId in (0, 1, 255):
+            self.assertEqual(self.roundTrip(3, 5, movieId), (movieId,))
+
+    def testLoginAnswers(self):
+        self.assertEqual(self.roundTrip(5, 0), ())
+        self.assertEqual(self.roundTrip(6, 0), ())
+
+    def testUserList(self):
+        users = [(0, 'alice'), (3, 'bob'), (255, 'x' * 300)]
+        self.assertEqual(self.roundTrip(7, 1, users), users)
+        self.assertEqual(self.roundTrip(7, 1, []), [])
+
+    def testMovieList(self):
+        movies = [(1, '127.0.0.1', 1991, 'Movie A'),
+                  (2, '10.0.255.1', 65535, ''),
+                  (255, '192.168.1.200', 0, 'T' * 200)]
+        decoded = self.roundTrip(8, 2, movies)
+        self.assertEqual(decoded, [(movieId, hostOf(ipAddress), port, title)
+                                   for movieId, ipAddress, port, title in movies])
+
+    def testNotifications(self):
+        for msgType in Codec.NOTIFICATION_TYPES:
+            self.assertEqual(self.roundTrip(msgType, 100, 4, 'carol'), (4, 'carol'))
+
+    def testChatRequest(self):
+        self.assertEqual(self.roundTrip(13, 6, 'hi there'), ('hi there',))
+        self.assertEqual(self.roundTrip(13, 6, ''), ('',))
+
+    def testChatMessage(self):
+        self.assertEqual(self.roundTrip(14, 8, 'bob', 'hello'), ('bob', 'hello'))
+        self.assertEqual(self.roundTrip(14, 8, 'bob', ''), ('bob', ''))
+
+
+class TrailerTest(unittest.TestCase):
+
+    def testNoTrailer(self):
+        self.assertEqual(Codec.parseTrailers(Codec.encodeChatRequest(1, 'hi')), (None, None))
+
+    def testCapsAndAckTrailers(self):
+        message = (Codec.encodeLoginOk(0) + Codec.capsTrailer(Codec.CAP_CUMULATIVE_ACK)
+                   + Codec.ackTrailer(Codec.SEQ_MASK + 3, 0x11))
+        self.assertEqual(Codec.parseTrailers(message), (Codec.CAP_CUMULATIVE_ACK, (2, 0x11)))
+
+    def testDecodeIgnoresTrailers(self):
+        message = Codec.encodeChatMessage(8, 'bob', 'hello') + Codec.ackTrailer(4, 0)
+        self.assertEqual(Codec.decode(message), (8, 14, ('bob', 'hello')))
+        self.assertEqual(Codec.parseTrailers(message), (None, (4, 0)))
+
+    def testUnknownTagEndsParsing(self):
+        message = Codec.encodeChatRequest(1, 'hi') + '\x00' + Codec.capsTrailer(1)
+        self.assertEqual(Codec.parseTrailers(message), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+"""
+Seeded runs of the load generator against a server on the simulated
+network: in the middle of the run, the room of every user in the server
+databases is the room his client joined.  Over TCP, the clients that
+acknowledge every message stay connected and get their chat messages.
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'scripts'))
+from set_path import set_path
+set_path()
+from c2w.protocol import ClientEngine
+from c2w.protocol import Simulator
+from c2w.protocol.Store import ServerStore
+
+
+class RoomMembershipTest(unittest.TestCase):
+
+    def rooms(self, protocol, seed, loss):
+        """
+        Returns the rooms of the online users 40 virtual seconds into the
+        run, as dictionaries user name -> room name: the ones of the
+        server, then the ones of the clients.
+        """
+        network = Simulator.Network(seed, Simulator.LinkProfile(latency=0.02, jitter=0.01,
+                                                                loss=loss))
+        store = ServerStore([('Movie %d' % index, '10.0.1.%d' % index, 5000 + index)
+                             for index in range(1, 5)])
+        Simulator.SimulatedServer(network, protocol, Simulator.SERVER_ADDRESS, store)
+        load = Simulator.SimulatedLoad(network, protocol, Simulator.SERVER_ADDRESS, clients=40,
+                                       duration=60, joinRatio=0.7, lossPr=loss)
+        rooms = []
+
+        def snapshot():
+            rooms.append((dict((user.userName, user.userChatRoom)
+                               for user in store.getUserList()),
+                          dict((client.engine.userName, client.engine.roomName)
+                               for client in load.clients if client.online)))
+        network.clock.callLater(40, snapshot)
+        load.start()
+        network.clock.run()
+        return rooms[0]
+
+    def checkRooms(self, protocol, seed, loss):
+        serverRooms, clientRooms = self.rooms(protocol, seed, loss)
+        self.assertTrue(clientRooms)
+        self.assertEqual(dict((userName, serverRooms.get(userName)) for userName in clientRooms),
+                         clientRooms)
+        self.assertTrue(any(roomName.startswith('Movie') for roomName in clientRooms.values()))
+
+    def testUdp(self):
+        self.checkRooms('UDP', 1, 0.0)
+
+    def testUdpWithLoss(self):
+        for seed in (3, 7):
+            self.checkRooms('UDP', seed, 0.05)
+
+    def testTcp(self):
+        self.checkRooms('TCP', 1, 0.0)
+
+    def testSameSeedSameRun(self):
+        self.assertEqual(self.rooms('UDP', 5, 0.05), self.rooms('UDP', 5, 0.05))
+
+
+class AcknowledgedTcpTest(unittest.TestCase):
+
+    def testLosslessLink(self):
+        #a client not offering the reliable transport mode: every message
+        #is acknowledged, one at a time
+        self.addCleanup(setattr, ClientEngine.StreamClientEngine, 'reliableTransport',
+                        ClientEngine.StreamClientEngine.reliableTransport)
+        ClientEngine.StreamClientEngine.reliableTransport = False
+        load, network = Simulator.simulate('TCP', clients=20, duration=30, seed=1,
+                                           profile=Simulator.LinkProfile(latency=0.02))
+        self.assertEqual((load.report['online'], load.report['lost']), (20, 0))
+        self.assertTrue(load.report['chatsSent'])
+        self.assertTrue(load.report['chatsDelivered'] >= load.report['chatsSent'])
+        #no message is written again and again while an older one waits
+        self.assertTrue(load.report['serverRetransmissionRatio'] < 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()